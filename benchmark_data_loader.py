@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк парсинга прайс-листов: построчный df.apply против векторизованных .str операций
+
+Использование:
+    python benchmark_data_loader.py
+    python benchmark_data_loader.py --rows 1000000
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.data_loader import DataLoader
+
+
+def make_synthetic_price_list(rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Создает синтетический прайс-лист в формате changed_50.csv
+
+    Названия содержат хвост "- <цена> руб.", цены встречаются в разных форматах
+    ("61263", "61 263 руб.", "1860,50", пустые значения).
+    """
+    rng = np.random.default_rng(seed)
+    base_names = [
+        "Короб 100x100 мм, L=3000 мм, горячее цинкование DKC арт. 35101",
+        "Гайка с насечкой препятствующей откручиванию, М6 DKC арт. СМ100600",
+        "Винт с крестообразным шлицем М6х10 DKC арт. СМ010610",
+        "Крышка 200 мм, L=2000 мм, горячее цинкование",
+        "Лоток перфорированный 600 мм",
+    ]
+    prices = rng.integers(1, 200000, size=rows)
+    names = [
+        f"{base_names[i % len(base_names)]} - {price} руб."
+        for i, price in enumerate(prices)
+    ]
+    price_formats = [
+        lambda p: str(p),
+        lambda p: f"{p:,}".replace(",", " ") + " руб.",
+        lambda p: f"{p},50",
+        lambda p: f"{p} руб",
+    ]
+    price_col = [price_formats[i % len(price_formats)](p) for i, p in enumerate(prices)]
+    # Несколько пропусков, как в реальных выгрузках
+    for i in range(0, rows, 997):
+        price_col[i] = None
+        names[i] = None
+
+    return pd.DataFrame({"name": names, "price": price_col})
+
+
+def benchmark(rows: int):
+    loader = DataLoader()
+
+    print("=" * 70)
+    print("ПРОВЕРКА ИДЕНТИЧНОСТИ НА ПОСТАВЛЯЕМЫХ CSV")
+    print("=" * 70)
+    raw = pd.read_csv("changed_50.csv", encoding="utf-8")
+    for column, scalar, vectorized in [
+        ("Товар", loader.clean_product_name, loader.clean_product_name_series),
+        ("Цена", loader.parse_price, loader.parse_price_series),
+    ]:
+        expected = raw[column].apply(scalar)
+        actual = vectorized(raw[column])
+        assert expected.tolist() == actual.tolist(), f"Расхождение в колонке {column}"
+        print(f"✓ {column}: {len(raw)} строк совпадают")
+
+    print("\n" + "=" * 70)
+    print(f"СИНТЕТИЧЕСКИЙ ПРАЙС-ЛИСТ: {rows:,} строк")
+    print("=" * 70)
+    df = make_synthetic_price_list(rows)
+
+    start = time.perf_counter()
+    names_apply = df["name"].apply(loader.clean_product_name)
+    prices_apply = df["price"].apply(loader.parse_price)
+    apply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    names_vec = loader.clean_product_name_series(df["name"])
+    prices_vec = loader.parse_price_series(df["price"])
+    vec_time = time.perf_counter() - start
+
+    assert names_apply.tolist() == names_vec.tolist(), "Расхождение в названиях"
+    assert prices_apply.tolist() == prices_vec.tolist(), "Расхождение в ценах"
+
+    print(f"df.apply (построчно):    {apply_time:8.2f} с")
+    print(f"векторизованно (.str):   {vec_time:8.2f} с")
+    print(f"Ускорение:               {apply_time / vec_time:8.1f}x")
+    print("✓ Результаты идентичны")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк парсинга прайс-листов")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Размер синтетического прайс-листа")
+    args = parser.parse_args()
+    benchmark(args.rows)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк динамического батчинга LLM: разбор запросов по одному против батчей
+
+Параллельные клиенты отправляют запросы из tests/query_*.json в
+LLMRequestParser; сравнивается пропускная способность (запросов в минуту)
+планировщика с max_batch_size=1 и с батчами.
+
+Использование:
+    python benchmark_llm_batching.py
+    python benchmark_llm_batching.py --clients 8 --batch-size 8 --rounds 2
+"""
+
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.llm_request_parser import LLMRequestParser
+from src.llm_scheduler import get_scheduler
+
+
+def load_queries(tests_dir: Path):
+    """Запросы из тестовых JSON файлов"""
+    queries = []
+    for path in sorted(tests_dir.glob("query_*.json")):
+        with open(path, 'r', encoding='utf-8') as f:
+            queries.append(json.load(f)['query'])
+    return queries
+
+
+def run(parser: LLMRequestParser, queries, clients: int, batch_size: int):
+    """Разбирает все запросы параллельными клиентами, возвращает время и метрики"""
+    scheduler = get_scheduler(parser.model, parser.tokenizer)
+    scheduler.max_batch_size = batch_size
+    before = scheduler.stats()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(parser.parse_request, queries))
+    elapsed = time.perf_counter() - start
+
+    after = scheduler.stats()
+    batches = after['batches'] - before['batches']
+    requests = after['requests'] - before['requests']
+    return elapsed, (requests / batches if batches else 0.0)
+
+
+def benchmark(model_path: str, clients: int, batch_size: int, rounds: int):
+    queries = load_queries(Path("tests")) * rounds
+    # Без кэша разборов, чтобы каждый запрос действительно шел в LLM
+    parser = LLMRequestParser(model_path=model_path, parse_cache_path=None)
+
+    print("=" * 70)
+    print(f"РАЗБОР {len(queries)} ЗАПРОСОВ, {clients} ПАРАЛЛЕЛЬНЫХ КЛИЕНТОВ")
+    print("=" * 70)
+
+    sequential_time, _ = run(parser, queries, clients, batch_size=1)
+    batched_time, avg_batch = run(parser, queries, clients, batch_size=batch_size)
+
+    print(f"По одному (batch=1):        {sequential_time:8.1f} с, "
+          f"{len(queries) / sequential_time * 60:6.1f} запросов/мин")
+    print(f"Батчами (batch≤{batch_size}):        {batched_time:8.1f} с, "
+          f"{len(queries) / batched_time * 60:6.1f} запросов/мин "
+          f"(средний батч {avg_batch:.1f})")
+    print(f"Ускорение:                  {sequential_time / batched_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк динамического батчинга LLM")
+    parser.add_argument("--model", default="Qwen/Qwen3-4B-Instruct-2507", help="Путь к LLM модели")
+    parser.add_argument("--clients", type=int, default=8, help="Число параллельных клиентов")
+    parser.add_argument("--batch-size", type=int, default=8, help="Максимальный размер батча")
+    parser.add_argument("--rounds", type=int, default=1, help="Сколько раз повторить набор запросов")
+    args = parser.parse_args()
+    benchmark(args.model, args.clients, args.batch_size, args.rounds)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк speculative decoding: генерация основной моделью с draft моделью и без
+
+Для каждого запроса из tests/query_*.json строится промпт LLMRequestParser
+и выполняется жадная генерация (do_sample=False) через планировщик модели —
+сначала без draft модели, затем с ней. При жадной генерации ответы должны
+совпадать токен в токен; сравнивается время и токены в секунду.
+
+Использование:
+    python benchmark_speculative_decoding.py
+    python benchmark_speculative_decoding.py --model ./Qwen/Qwen3-4B-Instruct-2507 --draft ./Qwen/Qwen3-0.6B
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.model_registry import acquire_model
+from src.llm_scheduler import get_scheduler, render_chat
+from src.llm_request_parser import LLMRequestParser, PROMPT_INSTRUCTIONS, SYSTEM_PROMPT
+
+
+def load_queries(tests_dir: Path):
+    """Запросы из тестовых JSON файлов"""
+    queries = []
+    for path in sorted(tests_dir.glob("query_*.json")):
+        with open(path, 'r', encoding='utf-8') as f:
+            queries.append(json.load(f)['query'])
+    return queries
+
+
+def run(scheduler, tokenizer, prompts, max_new_tokens: int):
+    """Жадная генерация по всем промптам: ответы, время и число токенов"""
+    outputs = []
+    tokens = 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        text = scheduler.generate(
+            prompt,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id
+        )
+        outputs.append(text)
+        tokens += len(tokenizer(text, add_special_tokens=False)['input_ids'])
+    return outputs, time.perf_counter() - start, tokens
+
+
+def benchmark(model_path: str, draft_path: str, device: str, dtype: str, max_new_tokens: int):
+    queries = load_queries(Path("tests"))
+
+    main = acquire_model(model_path, device=device, dtype=dtype)
+    draft = acquire_model(draft_path, device=device, dtype=dtype)
+    scheduler = get_scheduler(main.model, main.tokenizer)
+
+    prompts = [
+        render_chat(main.tokenizer, SYSTEM_PROMPT,
+                    PROMPT_INSTRUCTIONS + LLMRequestParser._prompt_suffix(query))
+        for query in queries
+    ]
+
+    print("=" * 70)
+    print(f"SPECULATIVE DECODING: {len(prompts)} запросов, draft {draft_path}")
+    print("=" * 70)
+
+    scheduler.set_draft_model(None)
+    baseline, base_time, base_tokens = run(scheduler, main.tokenizer, prompts, max_new_tokens)
+
+    scheduler.set_draft_model(draft.model)
+    assisted, spec_time, spec_tokens = run(scheduler, main.tokenizer, prompts, max_new_tokens)
+    scheduler.set_draft_model(None)
+
+    for query, plain, fast in zip(queries, baseline, assisted):
+        mark = "✓" if plain == fast else "⚠️"
+        print(f"{mark} {query[:60]}")
+
+    same = sum(plain == fast for plain, fast in zip(baseline, assisted))
+    print(f"\nСовпадают ответы:           {same}/{len(prompts)}")
+    print(f"Без draft модели:           {base_time:8.1f} с, {base_tokens / base_time:6.1f} токенов/с")
+    print(f"С draft моделью:            {spec_time:8.1f} с, {spec_tokens / spec_time:6.1f} токенов/с")
+    print(f"Ускорение:                  {base_time / spec_time:8.1f}x")
+
+    draft.release()
+    main.release()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк speculative decoding с draft моделью")
+    parser.add_argument("--model", default="Qwen/Qwen3-4B-Instruct-2507", help="Путь к основной LLM модели")
+    parser.add_argument("--draft", default="Qwen/Qwen3-0.6B", help="Путь к draft модели (тот же токенизатор)")
+    parser.add_argument("--device", default="cpu", help="Устройство (cpu / cuda / mps)")
+    parser.add_argument("--dtype", default=None, help="float32 / bfloat16 / int8 (по умолчанию LLM_CPU_DTYPE)")
+    parser.add_argument("--max-new-tokens", type=int, default=512, help="Максимум новых токенов")
+    args = parser.parse_args()
+    benchmark(args.model, args.draft, args.device, args.dtype, args.max_new_tokens)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Проверка точности разбора запросов LLM в пониженной точности (bfloat16, int8)
+
+Разбирает запросы из tests/query_*.json в float32 и в каждом проверяемом
+dtype жадной генерацией (do_sample=False) с constrained decoding, ищет
+каждую разобранную позицию в векторном индексе и сравнивает найденные
+товары с ожидаемыми из теста (response.found_items, items_count). Жадная
+генерация детерминирована, поэтому различия между dtype — это различия
+точности, а не шум сэмплирования. Также печатает совпадение разборов с
+float32, объем весов и время разбора.
+
+Использование:
+    python check_llm_dtype_accuracy.py
+    python check_llm_dtype_accuracy.py --dtypes bfloat16 int8 --model ./Qwen/Qwen3-4B-Instruct-2507
+"""
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.model_registry import acquire_model
+from src.llm_scheduler import get_scheduler, render_chat
+from src.llm_request_parser import (
+    GENERATION_KWARGS, LLMRequestParser, PROMPT_INSTRUCTIONS, REQUEST_SCHEMA, SYSTEM_PROMPT
+)
+from src.search_engine import VectorSearchEngine
+
+
+def load_tests(tests_dir: Path):
+    """Запросы и ожидаемые товары из тестовых JSON файлов"""
+    tests = []
+    for path in sorted(tests_dir.glob("query_*.json")):
+        with open(path, 'r', encoding='utf-8') as f:
+            tests.append(json.load(f))
+    return tests
+
+
+def normalize(name: str) -> str:
+    return ' '.join(str(name).split()).lower()
+
+
+def model_size_mb(model) -> float:
+    """Объем параметров и буферов модели (включая упакованные int8 веса)"""
+    total = sum(t.numel() * t.element_size() for t in model.state_dict().values() if torch.is_tensor(t))
+    return total / 1024 ** 2
+
+
+def parse_all(model_path: str, dtype: str, queries):
+    """Жадные разборы всех запросов в заданной точности (None — ответ не разобран)"""
+    handle = acquire_model(model_path, device="cpu", dtype=dtype)
+    scheduler = get_scheduler(handle.model, handle.tokenizer)
+    size = model_size_mb(handle.model)
+
+    parses = []
+    start = time.perf_counter()
+    for query in queries:
+        prompt = render_chat(
+            handle.tokenizer, SYSTEM_PROMPT, PROMPT_INSTRUCTIONS + LLMRequestParser._prompt_suffix(query)
+        )
+        text = scheduler.generate(
+            prompt,
+            json_schema=REQUEST_SCHEMA,
+            max_new_tokens=GENERATION_KWARGS["max_new_tokens"],
+            do_sample=False,
+            pad_token_id=handle.tokenizer.eos_token_id
+        )
+        try:
+            parses.append(json.loads(text))
+        except json.JSONDecodeError:
+            parses.append(None)
+    elapsed = time.perf_counter() - start
+
+    handle.release()
+    return parses, size, elapsed
+
+
+def found_names(search_engine: VectorSearchEngine, parse) -> set:
+    """Лучший товар индекса для каждой разобранной позиции"""
+    names = set()
+    for item in (parse or {}).get('items', []):
+        results = search_engine.search(item.get('name', ''), top_k=1)
+        if results:
+            names.add(normalize(results[0][0]['name']))
+    return names
+
+
+def score_against_expected(test: dict, names: set, parse) -> dict:
+    """Совпадение найденных товаров с ожидаемыми в тесте"""
+    expected = {normalize(item['name']) for item in test['response']['found_items']}
+    hit = len(expected & names)
+    return {
+        "parsed": parse is not None,
+        "same_count": parse is not None and len(parse.get('items', [])) == test['response']['items_count'],
+        "recall": hit / len(expected) if expected else 1.0,
+        "precision": hit / len(names) if names else float(not expected),
+    }
+
+
+def same_parse(reference, candidate) -> bool:
+    """Разбор совпадает с float32 (названия и количества позиций)"""
+    def items(parse):
+        return sorted((normalize(i.get('name', '')), i.get('quantity')) for i in (parse or {}).get('items', []))
+    return reference is not None and candidate is not None and items(reference) == items(candidate)
+
+
+def report(tests, scores):
+    n = len(scores)
+    for test, score in zip(tests, scores):
+        mark = "✓" if score["same_count"] and score["recall"] == 1.0 else "⚠️"
+        print(f"{mark} {test['query'][:50]:50s} recall: {score['recall']:.2f}  precision: {score['precision']:.2f}")
+    print(f"\nРазобрано JSON:           {sum(s['parsed'] for s in scores)}/{n}")
+    print(f"Совпадает число позиций:  {sum(s['same_count'] for s in scores)}/{n}")
+    print(f"Средний recall товаров:   {sum(s['recall'] for s in scores) / n:.2f}")
+    print(f"Средняя precision:        {sum(s['precision'] for s in scores) / n:.2f}")
+
+
+def check(model_path: str, dtypes, embedding_model: str, index_dir: str):
+    tests = load_tests(Path("tests"))
+    queries = [test['query'] for test in tests]
+
+    search_engine = VectorSearchEngine(model_name=embedding_model, index_dir=index_dir)
+    search_engine.load_index()
+
+    print("=" * 70)
+    print(f"ЭТАЛОН float32: {len(queries)} запросов")
+    print("=" * 70)
+    reference, ref_size, ref_time = parse_all(model_path, "float32", queries)
+    report(tests, [
+        score_against_expected(test, found_names(search_engine, parse), parse)
+        for test, parse in zip(tests, reference)
+    ])
+    print(f"Веса: {ref_size:8.0f} МБ, время разбора: {ref_time:6.1f} с")
+
+    for dtype in dtypes:
+        print("\n" + "=" * 70)
+        print(f"ТОЧНОСТЬ {dtype}")
+        print("=" * 70)
+        parses, size, elapsed = parse_all(model_path, dtype, queries)
+
+        report(tests, [
+            score_against_expected(test, found_names(search_engine, parse), parse)
+            for test, parse in zip(tests, parses)
+        ])
+        same = sum(same_parse(ref, cand) for ref, cand in zip(reference, parses))
+        print(f"Разбор совпадает с float32: {same}/{len(parses)}")
+        print(f"Веса: {size:8.0f} МБ ({ref_size / size:.1f}x меньше), "
+              f"время разбора: {elapsed:6.1f} с ({ref_time / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Точность разбора запросов LLM в bfloat16/int8 по ожидаемым товарам тестов")
+    parser.add_argument("--model", default="./Qwen/Qwen3-4B-Instruct-2507", help="Путь к LLM модели")
+    parser.add_argument("--dtypes", nargs="+", default=["bfloat16", "int8"], help="Проверяемые dtype")
+    parser.add_argument("--embedding-model", default="intfloat/multilingual-e5-small", help="Модель эмбеддингов индекса")
+    parser.add_argument("--index-dir", default="data/index_e5", help="Директория векторного индекса")
+    args = parser.parse_args()
+    check(args.model, args.dtypes, args.embedding_model, args.index_dir)
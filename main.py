@@ -16,13 +16,15 @@ from pathlib import Path
 # Добавляем src в путь
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
+from src.product_record import ProductRecord, json_default
+
 
 # Простой поисковый движок для fallback
 class SimpleSearchEngine:
     """Простой поисковый движок на основе совпадения слов"""
     
     def __init__(self, products_df):
-        self.products = products_df.to_dict('records')
+        self.products = ProductRecord.from_frame(products_df)
     
     def search(self, query, top_k=10):
         """Простой текстовый поиск"""
@@ -172,7 +174,7 @@ def process_test_file(processor, test_file: str):
     # Сохраняем результат
     output_file = f"result_{Path(test_file).stem}.json"
     with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(response, f, ensure_ascii=False, indent=2)
+        json.dump(response, f, ensure_ascii=False, indent=2, default=json_default)
     
     print(f"✓ Результат сохранен в {output_file}")
 
@@ -322,7 +324,7 @@ def main():
             
             # Вывод JSON
             print("\nJSON ответ:")
-            print(json.dumps(response, ensure_ascii=False, indent=2))
+            print(json.dumps(response, ensure_ascii=False, indent=2, default=json_default))
         
         else:
             # Если ничего не указано, показываем help
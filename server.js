@@ -9,6 +9,15 @@ const mammoth = require('mammoth')
 const app = express()
 const PORT = process.env.PORT || 5550
 
+// Прайс-листы каталога; FastAPI принимает в /rebuild-db только имена файлов из этой директории
+const dataFilesDir = path.join(__dirname, 'data_files')
+const modelFilesDir = path.join(__dirname, 'model_files')
+
+// Имя загруженного прайс-листа: повторная загрузка того же файла перезаписывает его
+function uploadedCsvName(originalname) {
+  return `uploaded_${path.parse(path.basename(originalname)).name}.csv`
+}
+
 // Middleware
 app.use(cors())
 app.use(express.json())
@@ -374,9 +383,9 @@ app.post('/api/admin/upload-file', upload.single('file'), async (req, res) => {
         csvContent = convertToCSV(products)
       }
       
-      // Сохраняем обработанные данные во временный CSV файл
-      const tempCsvPath = path.join(uploadsDir, `processed_${Date.now()}.csv`)
-      await fs.writeFile(tempCsvPath, csvContent, 'utf-8')
+      // Сохраняем обработанные данные в data_files: файл становится источником каталога
+      const csvName = uploadedCsvName(file.originalname)
+      await fs.writeFile(path.join(dataFilesDir, csvName), csvContent, 'utf-8')
       
       // Уведомляем FastAPI о необходимости обновления БД
       const response = await fetch('http://localhost:8000/rebuild-db', {
@@ -385,8 +394,7 @@ app.post('/api/admin/upload-file', upload.single('file'), async (req, res) => {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          csv_file: `processed_${Date.now()}.csv`,
-          file_path: tempCsvPath,
+          csv_file: csvName,
           mode: mode
         })
       })
@@ -395,9 +403,8 @@ app.post('/api/admin/upload-file', upload.single('file'), async (req, res) => {
         const result = await response.json()
         console.log('База данных успешно обновлена:', result)
         
-        // Удаляем временные файлы
+        // Удаляем исходный загруженный файл
         await fs.unlink(file.path)
-        await fs.unlink(tempCsvPath)
         
         res.json({ 
           message: `Файл ${file.originalname} успешно обработан и база данных обновлена (режим: ${mode})`,
@@ -448,8 +455,8 @@ app.post('/api/admin/upload-csv', upload.single('file'), async (req, res) => {
     }
     
     // Перемещаем файл в директорию данных
-    const newPath = path.join(dataFilesDir, req.file.originalname)
-    await fs.rename(req.file.path, newPath)
+    const csvName = uploadedCsvName(req.file.originalname)
+    await fs.rename(req.file.path, path.join(dataFilesDir, csvName))
     
     // Уведомляем FastAPI о необходимости обновления БД
     try {
@@ -459,8 +466,7 @@ app.post('/api/admin/upload-csv', upload.single('file'), async (req, res) => {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          csv_file: req.file.originalname,
-          file_path: newPath
+          csv_file: csvName
         })
       })
       
@@ -3,18 +3,22 @@ FastAPI приложение для RAG-поиска комплектующих
 """
 
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, FileResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Literal, Optional, Dict, Any
 import uvicorn
+import os
 from pathlib import Path
 
 from src.data_loader import DataLoader
 from src.search_engine import VectorSearchEngine
 from src.hybrid_processor import HybridQueryProcessor
 from src.document_generator import DocumentGenerator
+from src.llm_backend import backend_stats
+from src.llm_scheduler import scheduler_stats
 
 # Инициализация FastAPI
 app = FastAPI(
@@ -37,7 +41,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Загруженные прайс-листы (server.js сохраняет их как data_files/uploaded_<имя>.csv)
+DATA_FILES_DIR = Path("data_files")
+UPLOAD_PREFIX = "uploaded_"
+
 # Глобальные переменные для моделей
+data_loader: Optional[DataLoader] = None
 search_engine: Optional[VectorSearchEngine] = None
 processor: Optional[HybridQueryProcessor] = None
 products_loaded: bool = False
@@ -52,13 +61,21 @@ class SearchRequest(BaseModel):
 
 
 class ProductInfo(BaseModel):
-    """Информация о найденном товаре"""
+    """Информация о найденном товаре (читается напрямую из ProductRecord)"""
+    model_config = ConfigDict(from_attributes=True)
+    
     id: int
     name: str
     cost: float
     category: str
 
 
+class AlternativeInfo(BaseModel):
+    """Альтернативный товар"""
+    product: ProductInfo
+    score: float
+
+
 class SearchResultItem(BaseModel):
     """Элемент результата поиска"""
     requested_item: str
@@ -68,7 +85,7 @@ class SearchResultItem(BaseModel):
     unit_price: float
     total_price: float
     specifications: str
-    alternatives: List[Dict[str, Any]] = []
+    alternatives: List[AlternativeInfo] = []
 
 
 class SearchResponse(BaseModel):
@@ -80,6 +97,12 @@ class SearchResponse(BaseModel):
     found_items: int
     total_cost: float
     currency: str
+    # "deadline", если LLM не уложилась в бюджет, "loading", если LLM еще
+    # загружается, "backend", если LLM сервер недоступен; во всех случаях
+    # запрос разобран эвристикой
+    llm_fallback: Optional[str] = None
+    # Как разобран запрос: "fast" (без LLM), "llm" или "heuristic"
+    route: Optional[str] = None
 
 
 class HealthResponse(BaseModel):
@@ -89,6 +112,41 @@ class HealthResponse(BaseModel):
     products_count: int
     embedding_model: str
     llm_available: bool
+    # Состояние LLM парсера: "loading" / "ready" / "failed" / "disabled"
+    llm_status: str = "disabled"
+    # Какие компоненты уже прогреты (vector_search, llm_parser, router, query_enhancer)
+    capabilities: Dict[str, str] = {}
+
+
+class RebuildRequest(BaseModel):
+    """Запрос на обновление базы после загрузки прайс-листа (вызывается server.js)"""
+    csv_file: Optional[str] = Field(None, description="Имя загруженного CSV файла в data_files/ (без пути)")
+    mode: Literal["append", "replace"] = Field(
+        "append",
+        description="append — добавить к каталогу, replace — удалить ранее загруженные прайс-листы (uploaded_*.csv)"
+    )
+
+
+class RebuildResponse(BaseModel):
+    """Результат инкрементального обновления индекса"""
+    message: str
+    products_count: int
+    changes: Dict[str, int]
+
+
+class PriceSheetRequest(BaseModel):
+    """Запрос на применение прайс-листа с новыми ценами"""
+    csv_file: str = Field(
+        ...,
+        description="Имя загруженного CSV в data_files/ (без пути) с колонками id или Товар/Название и Цена (и необязательно Остаток)"
+    )
+
+
+class PriceSheetResponse(BaseModel):
+    """Результат обновления цен"""
+    message: str
+    updated: int
+    unknown: int
 
 
 class ErrorResponse(BaseModel):
@@ -97,10 +155,30 @@ class ErrorResponse(BaseModel):
     error_type: str
 
 
+def uploaded_file_path(name: str) -> Path:
+    """
+    Путь к загруженному файлу в DATA_FILES_DIR по его имени
+    
+    Принимается только имя файла без каталогов: путь после разрешения
+    символических ссылок должен остаться внутри DATA_FILES_DIR.
+    
+    Raises:
+        HTTPException 400: имя содержит путь или выходит за DATA_FILES_DIR
+    """
+    base = DATA_FILES_DIR.resolve()
+    if not name or name in (".", "..") or Path(name).name != name or "\\" in name:
+        raise HTTPException(status_code=400, detail="Недопустимое имя файла")
+    
+    target = (base / name).resolve()
+    if target.parent != base:
+        raise HTTPException(status_code=400, detail="Недопустимое имя файла")
+    return target
+
+
 @app.on_event("startup")
 async def startup_event():
     """Инициализация при старте приложения"""
-    global search_engine, processor, products_loaded, document_generator
+    global data_loader, search_engine, processor, products_loaded, document_generator
     
     print("=" * 70)
     print("🚀 Запуск RAG API...")
@@ -109,9 +187,12 @@ async def startup_event():
     try:
         # Загружаем данные
         print("📦 Загрузка данных о товарах...")
-        data_loader = DataLoader()
-        products_df = data_loader.get_products()
-        print(f"✓ Загружено продуктов: {len(products_df)}")
+        # CATALOG_BACKEND=sqlite: каталог на диске, общий для всех воркеров
+        catalog_backend = os.getenv("CATALOG_BACKEND", "pandas")
+        data_loader = DataLoader(backend=catalog_backend)
+        # sqlite: каталог не читается в память целиком, только число строк
+        products_count = data_loader.count_products()
+        print(f"✓ Загружено продуктов: {products_count}")
         
         # Инициализируем векторный поиск
         print("🔍 Инициализация векторного поиска...")
@@ -120,23 +201,34 @@ async def startup_event():
         
         search_engine = VectorSearchEngine(
             model_name=embedding_model,
-            index_dir=index_dir
+            index_dir=index_dir,
+            catalog=data_loader if catalog_backend == "sqlite" else None
         )
         
         # Загружаем или создаем индекс
-        if not search_engine.load_index():
+        try:
+            search_engine.load_index()
+            print("✓ Индекс загружен из кэша")
+        except FileNotFoundError:
             print("🔨 Создание индекса (это может занять некоторое время)...")
-            search_engine.build_index(products_df)
+            search_engine.build_index(data_loader.get_products(), force_rebuild=True)
             print("✓ Индекс создан и сохранен")
-        else:
-            print("✓ Индекс загружен из кэша")
         
         # Создаем гибридный процессор с новой архитектурой
         print("🤖 Инициализация гибридного процессора (новая архитектура)...")
         processor = HybridQueryProcessor(
             search_engine=search_engine,
             use_llm_parser=True,  # LLM парсер на входе с автоопределением CUDA/MPS/CPU
-            use_fallback_enhancement=True
+            use_fallback_enhancement=True,
+            data_loader=data_loader,
+            # Общий LLM воркер вместо своей копии модели в каждом процессе API
+            llm_worker_address=os.environ.get("LLM_WORKER_ADDRESS"),
+            # Бюджет времени на разбор запроса LLM (для p99 /search под нагрузкой)
+            llm_deadline_seconds=float(os.environ["LLM_DEADLINE_SECONDS"]) if os.environ.get("LLM_DEADLINE_SECONDS") else None,
+            # LLM грузится в фоне: API принимает запросы сразу, пока модель
+            # не готова, разбор идет через роутер и QueryEnhancer
+            # (LLM_LAZY_LOADING=0 — ждать загрузки модели при старте)
+            lazy_llm_loading=os.environ.get("LLM_LAZY_LOADING", "1") != "0"
         )
         
         # Инициализируем генератор документов
@@ -148,7 +240,7 @@ async def startup_event():
         print("✅ RAG API готов к работе!")
         print(f"📊 Модель эмбеддингов: {embedding_model}")
         print(f"🗂️  Индекс: {index_dir}")
-        print(f"📦 Товаров в базе: {len(products_df)}")
+        print(f"📦 Товаров в базе: {products_count}")
         print(f"📄 Документы: generated_documents/")
         print("=" * 70)
         
@@ -193,18 +285,42 @@ async def api_info():
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Проверка здоровья системы"""
-    llm_available = processor and hasattr(processor, 'request_parser') and processor.request_parser is not None
+    """Проверка здоровья системы и готовности LLM компонентов"""
+    llm_status = processor.llm_status if processor else "disabled"
     
     return HealthResponse(
         status="healthy" if products_loaded else "unhealthy",
         models_loaded=products_loaded,
-        products_count=len(search_engine.products) if search_engine and search_engine.products else 0,
+        products_count=search_engine.product_count() if search_engine else 0,
         embedding_model=search_engine.model_name if search_engine else "not loaded",
-        llm_available=llm_available
+        llm_available=llm_status == "ready",
+        llm_status=llm_status,
+        capabilities=processor.capabilities() if processor else {}
     )
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Метрики кэшей (результаты векторного поиска, разборы LLM), батчинга LLM и LLM сервера"""
+    parser = getattr(processor, 'request_parser', None) if processor else None
+    parse_cache = getattr(parser, 'parse_cache', None)
+    result_cache = search_engine.result_cache if search_engine else None
+    
+    return {
+        "search_results": result_cache.stats() if result_cache else None,
+        "llm_parse": parse_cache.stats() if parse_cache else None,
+        "llm_batching": scheduler_stats(),
+        "llm_backend": backend_stats()
+    }
+
+
+@app.get("/router/stats")
+async def router_stats():
+    """Доля запросов, разобранных без LLM, и задержка по маршрутам"""
+    router = getattr(processor, 'router', None) if processor else None
+    return router.stats() if router else {"total": 0, "routes": {}}
+
+
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest):
     """
@@ -229,9 +345,9 @@ async def search(request: SearchRequest):
     
     try:
         # Выполняем поиск через новую архитектуру (top_k определяется LLM)
-        result = processor.process_query(
-            query=request.query
-        )
+        # Блокирующий pipeline в пуле потоков: параллельные запросы
+        # попадают в очередь LLM одновременно и генерируются одним батчем
+        result = await run_in_threadpool(processor.process_query, query=request.query)
         
         # Формируем ответ в новом формате
         items_response = []
@@ -241,12 +357,7 @@ async def search(request: SearchRequest):
             items_response.append(SearchResultItem(
                 requested_item=item.get('requested_item', ''),
                 quantity=item.get('quantity', 1),
-                found_product=ProductInfo(
-                    id=found_product.get('id', 0),
-                    name=found_product.get('name', ''),
-                    cost=found_product.get('cost', 0.0),
-                    category=found_product.get('category', '')
-                ) if found_product else None,
+                found_product=found_product,
                 relevance_score=item.get('relevance_score', 0.0),
                 unit_price=item.get('unit_price', 0.0),
                 total_price=item.get('total_price', 0.0),
@@ -261,7 +372,9 @@ async def search(request: SearchRequest):
             total_items=result.get('total_items', 0),
             found_items=result.get('found_items', 0),
             total_cost=result.get('total_cost', 0.0),
-            currency=result.get('currency', 'RUB')
+            currency=result.get('currency', 'RUB'),
+            llm_fallback=result.get('llm_fallback'),
+            route=result.get('route')
         )
         
     except Exception as e:
@@ -295,6 +408,86 @@ async def search_get(
     return await search(request)
 
 
+@app.post("/rebuild-db", response_model=RebuildResponse)
+async def rebuild_db(request: RebuildRequest):
+    """
+    Обновляет каталог и индекс после загрузки прайс-листа
+    
+    server.js сохраняет прайс-лист в data_files/ и передает только имя
+    файла. В режиме replace ранее загруженные прайс-листы (uploaded_*.csv,
+    кроме текущего) удаляются. Каталог перечитывается из всех источников,
+    а индекс обновляется инкрементально: в энкодер уходят только новые и
+    переименованные товары, изменения цен применяются без пересчета
+    эмбеддингов.
+    """
+    if not products_loaded or not search_engine or not data_loader:
+        raise HTTPException(status_code=503, detail="Система не инициализирована")
+    
+    target = uploaded_file_path(request.csv_file) if request.csv_file else None
+    if target is not None and not target.is_file():
+        raise HTTPException(status_code=404, detail="Загруженный файл не найден")
+    
+    try:
+        diff = await run_in_threadpool(_rebuild_catalog, target, request.mode)
+        
+        return RebuildResponse(
+            message="База данных обновлена",
+            products_count=search_engine.product_count(),
+            changes=diff.summary()
+        )
+        
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка при обновлении базы: {str(e)}"
+        )
+
+
+def _rebuild_catalog(target: Optional[Path], mode: str):
+    """Пересобирает каталог и обновляет индекс (блокирующая часть /rebuild-db)"""
+    if mode == "replace":
+        for previous in DATA_FILES_DIR.glob(f"{UPLOAD_PREFIX}*.csv"):
+            if target is None or previous.resolve() != target:
+                previous.unlink()
+                print(f"🗑️ Удален ранее загруженный прайс-лист: {previous.name}")
+    
+    products_df = data_loader.combine_datasets()
+    return search_engine.update_index(products_df)
+
+
+@app.post("/prices/apply", response_model=PriceSheetResponse)
+async def apply_price_sheet(request: PriceSheetRequest):
+    """
+    Применяет прайс-лист с новыми ценами без пересборки индекса
+    
+    Обновляется только таблица цен (prices.npz): FAISS индекс и энкодер
+    не перезагружаются, итоговые суммы в /search сразу считаются по новым ценам.
+    Примененные цены сохраняются и после /rebuild-db. Принимается только
+    имя файла в data_files/, как и в /rebuild-db.
+    """
+    if not products_loaded or not search_engine:
+        raise HTTPException(status_code=503, detail="Система не инициализирована")
+    
+    target = uploaded_file_path(request.csv_file)
+    if not target.is_file():
+        raise HTTPException(status_code=404, detail="Загруженный файл не найден")
+    
+    try:
+        result = await run_in_threadpool(search_engine.apply_price_sheet, str(target))
+        return PriceSheetResponse(message="Цены обновлены", **result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ошибка при обновлении цен: {str(e)}"
+        )
+
+
 @app.get("/products/count")
 async def get_products_count():
     """Получить количество товаров в базе"""
@@ -302,25 +495,21 @@ async def get_products_count():
         raise HTTPException(status_code=503, detail="Система не инициализирована")
     
     return {
-        "count": len(search_engine.products) if search_engine.products else 0
+        "count": search_engine.product_count()
     }
 
 
 @app.get("/products/categories")
 async def get_categories():
     """Получить список категорий товаров"""
-    if not products_loaded or not search_engine:
+    if not products_loaded or not data_loader:
         raise HTTPException(status_code=503, detail="Система не инициализирована")
     
     try:
-        categories = set()
-        for product in search_engine.products:
-            category = product.get('category')
-            if category:
-                categories.add(category)
+        categories = data_loader.get_categories()
         
         return {
-            "categories": sorted(list(categories)),
+            "categories": categories,
             "count": len(categories)
         }
     except Exception as e:
@@ -346,7 +535,7 @@ async def generate_word_document(request: SearchRequest):
     
     try:
         # Выполняем поиск
-        result = processor.process_query(query=request.query)
+        result = await run_in_threadpool(processor.process_query, query=request.query)
         
         # Генерируем документ
         filepath = document_generator.generate_word(result)
@@ -385,7 +574,7 @@ async def generate_pdf_document(request: SearchRequest):
     
     try:
         # Выполняем поиск
-        result = processor.process_query(query=request.query)
+        result = await run_in_threadpool(processor.process_query, query=request.query)
         
         # Генерируем документ
         filepath = document_generator.generate_pdf(result)
@@ -494,7 +683,7 @@ async def generate_both_documents(request: SearchRequest):
     
     try:
         # Выполняем поиск
-        result = processor.process_query(query=request.query)
+        result = await run_in_threadpool(processor.process_query, query=request.query)
         
         # Генерируем документы
         files = document_generator.generate_both(result)
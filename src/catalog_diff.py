@@ -0,0 +1,120 @@
+"""
+Сравнение двух версий каталога для инкрементальной переиндексации
+
+Классифицирует изменения между предыдущим каталогом (например, товарами в
+индексе) и новой выгрузкой DataLoader:
+- added: новые товары (нужен эмбеддинг)
+- removed: удаленные товары
+- renamed: тот же товар с измененным текстом (нужен новый эмбеддинг)
+- price_changed: изменилась только цена (эмбеддинг не нужен)
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional
+
+from src.product_clustering import normalize_product_name
+
+
+_ARTICLE_RE = re.compile(r'арт\.?\s*([\w\-/]+)', re.IGNORECASE)
+
+
+def extract_article(name: str) -> Optional[str]:
+    """Извлекает артикул производителя ("арт. СМ010610") из названия"""
+    match = _ARTICLE_RE.search(str(name or ''))
+    return match.group(1).upper() if match else None
+
+
+@dataclass
+class CatalogDiff:
+    """Результат сравнения двух версий каталога"""
+    added: List[Dict] = field(default_factory=list)
+    removed: List[Dict] = field(default_factory=list)
+    renamed: List[Tuple[Dict, Dict]] = field(default_factory=list)        # (старый, новый)
+    price_changed: List[Tuple[Dict, Dict]] = field(default_factory=list)  # (старый, новый)
+    unchanged: int = 0
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.renamed or self.price_changed)
+
+    @property
+    def needs_encoding(self) -> List[Dict]:
+        """Товары, которые нужно отправить в энкодер"""
+        return self.added + [new for _, new in self.renamed]
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "renamed": len(self.renamed),
+            "price_changed": len(self.price_changed),
+            "unchanged": self.unchanged
+        }
+
+
+def _text_changed(old: Dict, new: Dict) -> bool:
+    """Изменился ли текст, по которому строится эмбеддинг"""
+    return old.get('name') != new.get('name') or old.get('category') != new.get('category')
+
+
+def _price_changed(old: Dict, new: Dict) -> bool:
+    return float(old.get('cost', 0) or 0) != float(new.get('cost', 0) or 0)
+
+
+def diff_catalogs(old_products: List[Dict], new_products: List[Dict]) -> CatalogDiff:
+    """
+    Сравнивает две версии каталога
+
+    Товары сопоставляются по очереди: по точному названию, затем по
+    нормализованному названию, затем по артикулу.
+
+    Args:
+        old_products: предыдущая версия (например, search_engine.products)
+        new_products: новая версия (DataLoader.load_all_products())
+
+    Returns:
+        CatalogDiff
+    """
+    diff = CatalogDiff()
+    pairs: List[Tuple[Dict, Dict]] = []
+
+    remaining_old = list(old_products)
+    remaining_new = list(new_products)
+
+    for key_func in (
+        lambda p: p.get('name'),
+        lambda p: normalize_product_name(p.get('name', '')),
+        lambda p: extract_article(p.get('name', '')),
+    ):
+        by_key: Dict[str, List[Dict]] = {}
+        for product in remaining_old:
+            key = key_func(product)
+            if key:
+                by_key.setdefault(key, []).append(product)
+
+        matched_old = set()
+        unmatched_new = []
+        for product in remaining_new:
+            candidates = by_key.get(key_func(product))
+            if candidates:
+                old = candidates.pop(0)
+                matched_old.add(id(old))
+                pairs.append((old, product))
+            else:
+                unmatched_new.append(product)
+
+        remaining_old = [p for p in remaining_old if id(p) not in matched_old]
+        remaining_new = unmatched_new
+
+    for old, new in pairs:
+        if _text_changed(old, new):
+            diff.renamed.append((old, new))
+        elif _price_changed(old, new):
+            diff.price_changed.append((old, new))
+        else:
+            diff.unchanged += 1
+
+    diff.added = remaining_new
+    diff.removed = remaining_old
+    return diff
@@ -0,0 +1,206 @@
+"""
+Бинарный снимок каталога для быстрого старта
+
+Хранит уже разобранный и объединенный каталог товаров, чтобы не парсить
+CSV при каждом запуске API/CLI. Снимок привязан к отпечаткам исходных
+файлов (размер, mtime, sha1) и пересоздается, если они изменились.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import List, Dict, Optional
+
+import pandas as pd
+
+
+# Увеличивать при изменении логики парсинга/объединения в DataLoader
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def file_sha1(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """SHA1 содержимого файла (читается блоками)"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def catalog_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Отпечаток соответствия ID и названий товаров каталога
+
+    Цены не входят: они меняются без пересборки индекса (см. price_table).
+    Индекс и каталог с одинаковым отпечатком назначают одни и те же ID
+    одним и тем же товарам.
+    """
+    pairs = sorted(zip(df['id'].astype('int64').tolist(), df['name'].astype(str).tolist()))
+    digest = hashlib.sha1()
+    for pid, name in pairs:
+        digest.update(f"{pid}\t{name}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CatalogSnapshot:
+    """
+    Снимок объединенного каталога на диске
+
+    Формат: Feather (если установлен pyarrow) или pickle. Рядом лежит
+    catalog_snapshot.json с отпечатками исходных файлов.
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Args:
+            cache_dir: директория для файлов снимка
+        """
+        self.cache_dir = Path(cache_dir)
+        self.meta_path = self.cache_dir / "catalog_snapshot.json"
+
+    @staticmethod
+    def _feather_available() -> bool:
+        try:
+            import pyarrow  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def _data_path(self, fmt: str) -> Path:
+        return self.cache_dir / f"catalog_snapshot.{fmt}"
+
+    def _read_meta(self) -> Optional[Dict]:
+        if not self.meta_path.exists():
+            return None
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, meta: Dict):
+        tmp_path = self.meta_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    @staticmethod
+    def fingerprint(sources: List[Path]) -> List[Dict]:
+        """Отпечатки исходных файлов (размер, mtime, sha1)"""
+        result = []
+        for path in sources:
+            stat = path.stat()
+            result.append({
+                "path": str(path.resolve()),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha1": file_sha1(path)
+            })
+        return result
+
+    def _sources_unchanged(self, stored: List[Dict], sources: List[Path]) -> bool:
+        """
+        Проверяет, что исходные файлы не изменились
+
+        Быстрая проверка по размеру и mtime; если совпал только размер
+        (например, файл скопирован заново), сравнивается sha1 содержимого.
+        """
+        if len(stored) != len(sources):
+            return False
+
+        refreshed = False
+        for entry, path in zip(stored, sources):
+            if entry["path"] != str(path.resolve()) or not path.exists():
+                return False
+            stat = path.stat()
+            if stat.st_size != entry["size"]:
+                return False
+            if stat.st_mtime_ns != entry["mtime_ns"]:
+                if file_sha1(path) != entry["sha1"]:
+                    return False
+                entry["mtime_ns"] = stat.st_mtime_ns
+                refreshed = True
+
+        if refreshed:
+            meta = self._read_meta()
+            if meta is not None:
+                meta["sources"] = stored
+                self._write_meta(meta)
+        return True
+
+    def is_fresh(self, sources: List[Path]) -> bool:
+        """
+        Проверяет, что снимок существует и соответствует текущим исходным файлам
+
+        Args:
+            sources: исходные CSV файлы каталога
+        """
+        meta = self._read_meta()
+        if not meta or meta.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            return False
+        if not self._data_path(meta["format"]).exists():
+            return False
+        try:
+            return self._sources_unchanged(meta["sources"], sources)
+        except (OSError, KeyError):
+            return False
+
+    def load(self, sources: List[Path]) -> Optional[pd.DataFrame]:
+        """
+        Загружает снимок, если он соответствует текущим исходным файлам
+
+        Args:
+            sources: исходные CSV файлы каталога
+
+        Returns:
+            DataFrame каталога или None (снимка нет или он устарел)
+        """
+        if not self.is_fresh(sources):
+            return None
+
+        meta = self._read_meta()
+        data_path = self._data_path(meta["format"])
+        try:
+            if meta["format"] == "feather":
+                return pd.read_feather(data_path)
+            return pd.read_pickle(data_path)
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать снимок каталога: {e}")
+            return None
+
+    def save(self, df: pd.DataFrame, sources: List[Path], fingerprints: Optional[List[Dict]] = None):
+        """
+        Атомарно сохраняет снимок каталога
+
+        Args:
+            df: объединенный каталог
+            sources: исходные файлы, из которых он получен
+            fingerprints: уже посчитанные отпечатки sources (см. fingerprint),
+                чтобы не хешировать файлы повторно
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        fmt = "feather" if self._feather_available() else "pkl"
+        data_path = self._data_path(fmt)
+        tmp_path = data_path.with_name(data_path.name + ".tmp")
+
+        frame = df.reset_index(drop=True)
+        if fmt == "feather":
+            frame.to_feather(tmp_path)
+        else:
+            frame.to_pickle(tmp_path)
+        os.replace(tmp_path, data_path)
+
+        self._write_meta({
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "format": fmt,
+            "rows": len(frame),
+            "catalog_fingerprint": catalog_fingerprint(frame),
+            "sources": fingerprints if fingerprints is not None else self.fingerprint(sources)
+        })
+
+    def catalog_fingerprint(self) -> Optional[str]:
+        """Отпечаток каталога из метаданных снимка (None для старых снимков)"""
+        meta = self._read_meta()
+        return meta.get("catalog_fingerprint") if meta else None
@@ -0,0 +1,218 @@
+"""
+Реестр источников каталога: поиск прайс-листов в директориях данных,
+определение их формата и стабильные ID товаров
+"""
+
+import csv
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable
+
+
+# Поддерживаемые форматы CSV (по заголовку)
+FORMAT_CHANGED = "changed"      # Товар,Цена,Категория (changed_50.csv)
+FORMAT_MATERIALS = "materials"  # Наименование МТР / работы / услуги,Стоимость
+FORMAT_SIMPLE = "simple"        # название,цена,описание (админка server.js)
+
+# Основные файлы загружаются первыми, чтобы их товары имели приоритет при дедупликации
+PRIMARY_SOURCES = ["changed_50.csv", "materials_50_items.csv"]
+
+
+@dataclass
+class CatalogSource:
+    """Файл-источник каталога"""
+    path: Path
+    format: str
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+
+def detect_source_format(path: Path) -> Optional[str]:
+    """
+    Определяет формат прайс-листа по заголовку
+
+    Args:
+        path: путь к CSV файлу
+
+    Returns:
+        str: один из FORMAT_* или None, если файл не является прайс-листом
+    """
+    try:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            header = next(csv.reader(f), [])
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return None
+
+    columns = [column.strip().lower() for column in header]
+    if not columns:
+        return None
+
+    if 'товар' in columns and 'цена' in columns:
+        return FORMAT_CHANGED
+    if columns[0].startswith('наименование') and 'стоимость' in columns:
+        return FORMAT_MATERIALS
+    if 'название' in columns and 'цена' in columns:
+        return FORMAT_SIMPLE
+    return None
+
+
+def discover_sources(data_dirs: Iterable[Path]) -> List[CatalogSource]:
+    """
+    Находит все поддерживаемые прайс-листы в директориях данных
+
+    Порядок детерминирован: сначала основные файлы (PRIMARY_SOURCES),
+    затем остальные в порядке директорий и по имени файла. Файлы с
+    одинаковым содержимым по разным путям не дублируются по пути, но
+    их товары будут отброшены при дедупликации по названию.
+
+    Args:
+        data_dirs: директории для поиска
+
+    Returns:
+        List источников в порядке приоритета
+    """
+    candidates: List[Path] = []
+    for data_dir in data_dirs:
+        data_dir = Path(data_dir)
+        if not data_dir.is_dir():
+            continue
+        primary = [data_dir / name for name in PRIMARY_SOURCES if (data_dir / name).is_file()]
+        others = sorted(
+            p for p in data_dir.glob('*.csv')
+            if p.is_file() and p.name not in PRIMARY_SOURCES
+        )
+        candidates.extend(primary)
+        candidates.extend(others)
+
+    # Основные файлы из всех директорий идут первыми
+    candidates.sort(key=lambda p: 0 if p.name in PRIMARY_SOURCES else 1)
+
+    sources = []
+    seen = set()
+    for path in candidates:
+        resolved = path.resolve()
+        if resolved in seen:
+            continue
+        seen.add(resolved)
+
+        fmt = detect_source_format(path)
+        if fmt is not None:
+            sources.append(CatalogSource(path=path, format=fmt))
+
+    return sources
+
+
+def registry_key(name: str) -> str:
+    """Название товара без различий в регистре, "ё" и пробелах"""
+    return ' '.join(str(name).lower().replace('ё', 'е').split())
+
+
+class ProductIdRegistry:
+    """
+    Стабильные ID товаров: название -> ID, сохраняется между запусками
+
+    Товар сохраняет свой ID при добавлении/удалении других источников и
+    при изменении регистра или пробелов в названии, новые товары получают
+    следующий свободный ID. Названия, которых больше нет в каталоге,
+    удаляются из реестра (prune), а их ID не выдаются повторно: next_id
+    только растет. Файл переписывается, только если реестр изменился.
+    """
+
+    def __init__(self, path: Path, legacy_path: Optional[Path] = None):
+        """
+        Args:
+            path: JSON файл реестра
+            legacy_path: прежнее расположение реестра; читается, если path
+                еще не создан
+        """
+        self.path = Path(path)
+        self.ids: Dict[str, int] = {}
+        self.next_id = 0
+        # Реестр изменился с момента чтения (или прочитан из legacy_path)
+        self.changed = False
+
+        source = self.path
+        if not source.exists() and legacy_path is not None and Path(legacy_path).exists():
+            source = Path(legacy_path)
+        if source.exists():
+            try:
+                with open(source, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.ids = {name: int(pid) for name, pid in data.get('ids', {}).items()}
+                self.next_id = int(data.get('next_id', 0))
+                self.changed = source != self.path
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Не удалось прочитать реестр ID товаров: {e}")
+
+    def assign(self, names: Iterable[str]) -> List[int]:
+        """
+        Возвращает ID для каждого названия, выдавая новые при необходимости
+
+        Название ищется точно, затем по registry_key; один ID не выдается
+        двум названиям из одного вызова.
+
+        Args:
+            names: названия товаров
+
+        Returns:
+            List[int]: ID в том же порядке
+        """
+        names = list(names)
+        result: List[Optional[int]] = [None] * len(names)
+        used = set()
+
+        # Сначала точные совпадения: они имеют приоритет над registry_key
+        for position, name in enumerate(names):
+            pid = self.ids.get(name)
+            if pid is not None and pid not in used:
+                result[position] = pid
+                used.add(pid)
+
+        by_key: Optional[Dict[str, int]] = None
+        for position, name in enumerate(names):
+            if result[position] is not None:
+                continue
+            if by_key is None:
+                by_key = {registry_key(known): known_id for known, known_id in self.ids.items()}
+            pid = by_key.get(registry_key(name))
+            if pid is None or pid in used:
+                pid = self.next_id
+                self.next_id += 1
+            self.ids[name] = pid
+            self.changed = True
+            result[position] = pid
+            used.add(pid)
+        return result
+
+    def prune(self, names: Iterable[str]) -> int:
+        """
+        Удаляет из реестра названия, которых нет среди names
+
+        Args:
+            names: названия товаров текущего каталога
+
+        Returns:
+            int: сколько названий удалено
+        """
+        keep = set(names)
+        stale = [name for name in self.ids if name not in keep]
+        for name in stale:
+            del self.ids[name]
+        if stale:
+            self.changed = True
+        return len(stale)
+
+    def save(self):
+        """Атомарно сохраняет реестр, если он изменился"""
+        if not self.changed and self.path.exists():
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"next_id": self.next_id, "ids": self.ids}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.changed = False
@@ -0,0 +1,239 @@
+"""
+SQLite-хранилище каталога с полнотекстовым поиском (FTS5)
+
+Каталог лежит на диске и читается через страничный кэш ОС, поэтому
+несколько процессов (воркеры uvicorn, CLI) разделяют одну копию, а не
+держат по DataFrame в каждом процессе.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable
+
+import pandas as pd
+
+from src.product_record import ProductRecord
+
+
+# Ограничение SQLite на число параметров в одном запросе
+_MAX_SQL_PARAMS = 900
+_FTS_TOKEN_RE = re.compile(r'\w+')
+
+
+def fts5_available() -> bool:
+    """Проверяет, собран ли sqlite3 с поддержкой FTS5"""
+    try:
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+class SQLiteCatalogStore:
+    """
+    Каталог товаров в SQLite
+
+    Таблицы:
+    - products(id, name, cost, category, name_norm, category_norm)
+    - products_fts: FTS5 индекс по названиям (если FTS5 доступен)
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: путь к файлу базы данных
+        """
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Соединение для текущего потока (только чтение каталога)
+
+        Если файл базы был атомарно подменен (build в другом процессе),
+        соединение переоткрывается.
+        """
+        inode = os.stat(self.db_path).st_ino
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'inode', None) != inode:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA query_only = ON')
+            self._local.conn = conn
+            self._local.inode = inode
+            self._local.has_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"
+            ).fetchone() is not None
+        return conn
+
+    def close(self):
+        """Закрывает соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def exists(self) -> bool:
+        return self.db_path.exists()
+
+    def build(self, df: pd.DataFrame):
+        """
+        Атомарно пересоздает базу из DataFrame каталога
+
+        База собирается во временном файле и подменяет старую через
+        os.replace, так что читатели видят либо старую, либо новую версию.
+
+        Args:
+            df: каталог с колонками id, name, cost, category
+        """
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.db_path.with_name(self.db_path.name + '.tmp')
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        conn = sqlite3.connect(str(tmp_path))
+        try:
+            conn.execute('''
+                CREATE TABLE products (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    cost REAL NOT NULL,
+                    category TEXT,
+                    name_norm TEXT,
+                    category_norm TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX idx_products_category ON products(category_norm)')
+
+            # SQLite lower() не работает с кириллицей, нормализуем в Python
+            rows = (
+                (int(pid), str(name), float(cost), str(category), str(name).lower(), str(category).lower())
+                for pid, name, cost, category in zip(
+                    df['id'], df['name'], df['cost'], df['category'].fillna('')
+                )
+            )
+            conn.executemany(
+                'INSERT INTO products (id, name, cost, category, name_norm, category_norm) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+            if fts5_available():
+                conn.execute('''
+                    CREATE VIRTUAL TABLE products_fts USING fts5(
+                        name, category, content='products', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )
+                ''')
+                conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.close()
+        os.replace(tmp_path, self.db_path)
+
+    def has_fts(self) -> bool:
+        self._connect()
+        return self._local.has_fts
+
+    @staticmethod
+    def _row_to_record(row: sqlite3.Row) -> ProductRecord:
+        return ProductRecord(row['name'], row['cost'], row['category'], row['id'])
+
+    def count(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM products').fetchone()[0]
+
+    def categories(self) -> List[str]:
+        """Непустые категории каталога"""
+        rows = self._connect().execute(
+            "SELECT DISTINCT category FROM products WHERE category != '' ORDER BY category"
+        )
+        return [row[0] for row in rows]
+
+    def load_dataframe(self) -> pd.DataFrame:
+        """Читает весь каталог (нужно для построения индекса)"""
+        return pd.read_sql_query(
+            'SELECT name, cost, category, id FROM products ORDER BY rowid',
+            self._connect()
+        )
+
+    def get_product_by_id(self, product_id: int) -> Optional[ProductRecord]:
+        row = self._connect().execute(
+            'SELECT id, name, cost, category FROM products WHERE id = ?', (int(product_id),)
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def get_products_by_ids(self, product_ids: Iterable[int]) -> List[ProductRecord]:
+        """
+        Товары по списку ID в исходном порядке (неизвестные ID пропускаются)
+        """
+        product_ids = [int(pid) for pid in product_ids]
+        found: Dict[int, ProductRecord] = {}
+        conn = self._connect()
+
+        unique_ids = list(dict.fromkeys(product_ids))
+        for start in range(0, len(unique_ids), _MAX_SQL_PARAMS):
+            chunk = unique_ids[start:start + _MAX_SQL_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(
+                f'SELECT id, name, cost, category FROM products WHERE id IN ({placeholders})',
+                chunk
+            ):
+                found[row['id']] = self._row_to_record(row)
+
+        return [found[pid] for pid in product_ids if pid in found]
+
+    def search_by_category(self, category: str) -> List[ProductRecord]:
+        """Подстрока категории без учета регистра (как DataLoader.search_by_category)"""
+        rows = self._connect().execute(
+            'SELECT id, name, cost, category FROM products '
+            'WHERE instr(category_norm, ?) > 0 ORDER BY rowid',
+            (category.lower(),)
+        )
+        return [self._row_to_record(row) for row in rows]
+
+    def search_text(self, query: str, limit: int = 10) -> List[ProductRecord]:
+        """
+        Лексический поиск по названиям (FTS5, ранжирование bm25)
+
+        Используется как быстрый fallback, когда векторный поиск недоступен.
+        Без FTS5 выполняется поиск по подстрокам всех слов запроса.
+
+        Args:
+            query: поисковый запрос
+            limit: максимум результатов
+
+        Returns:
+            List товаров в порядке релевантности
+        """
+        tokens = _FTS_TOKEN_RE.findall(query.lower())
+        if not tokens:
+            return []
+
+        conn = self._connect()
+        if self.has_fts():
+            # Каждое слово как префикс, слова объединяются через OR, bm25 ранжирует
+            match = ' OR '.join(f'"{token}"*' for token in tokens)
+            rows = conn.execute(
+                'SELECT p.id, p.name, p.cost, p.category FROM products_fts '
+                'JOIN products p ON p.id = products_fts.rowid '
+                'WHERE products_fts MATCH ? ORDER BY bm25(products_fts) LIMIT ?',
+                (match, limit)
+            )
+        else:
+            condition = ' AND '.join('instr(name_norm, ?) > 0' for _ in tokens)
+            rows = conn.execute(
+                f'SELECT id, name, cost, category FROM products WHERE {condition} LIMIT ?',
+                (*tokens, limit)
+            )
+        return [self._row_to_record(row) for row in rows]
@@ -2,18 +2,178 @@
 Модуль для загрузки и обработки данных из CSV файлов
 """
 
+import numpy as np
 import pandas as pd
+import csv
+import json
+import os
 import re
-from typing import List, Dict, Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Iterator, Tuple
 from pathlib import Path
 
+from src.catalog_snapshot import CatalogSnapshot, catalog_fingerprint
+from src.catalog_store import SQLiteCatalogStore
+from src.product_record import ProductRecord
+from src.catalog_sources import (
+    CatalogSource,
+    ProductIdRegistry,
+    discover_sources,
+    FORMAT_CHANGED,
+    FORMAT_MATERIALS,
+)
+
+
+# Регулярные выражения для парсинга прайс-листов.
+# В .str методы передаются строки шаблонов: со скомпилированным re.Pattern
+# pandas не может использовать нативные (pyarrow) строковые ядра.
+PRICE_NUMBER_PATTERN = r'(\d+(?:\.\d+)?)'
+NAME_PRICE_SUFFIX_PATTERN = r'\s*-\s*\d+\s*руб\.?\s*$'
+PRICE_NUMBER_RE = re.compile(PRICE_NUMBER_PATTERN)
+NAME_PRICE_SUFFIX_RE = re.compile(NAME_PRICE_SUFFIX_PATTERN)
+
+# Как часто backend="sqlite" проверяет, не изменились ли исходные CSV, секунд
+STORE_CHECK_INTERVAL = 60.0
+
+
+def iter_price_list_records(filepath, encoding: str = 'utf-8-sig') -> Iterator[Tuple[str, str]]:
+    """
+    Потоково читает прайс-лист формата materials_50_items.csv
+    
+    Записи разбираются по правилам модуля csv (кавычки, переносы строк и
+    запятые внутри названий) по мере чтения файла.
+    Поддерживаются варианты записей:
+    - "название, с запятыми\nи переносом,61263 руб."  (цена внутри кавычек)
+    - "название, с запятыми",61263 руб.
+    - название, с запятыми,1860 руб.                  (без кавычек)
+    
+    Args:
+        filepath: путь к CSV файлу
+        encoding: кодировка (utf-8-sig убирает BOM)
+        
+    Yields:
+        Tuple (название, строка с ценой); пробелы и переносы в названии схлопнуты
+    """
+    with open(filepath, 'r', encoding=encoding, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Пропускаем заголовок
+        
+        for row in reader:
+            if not row or not any(field.strip() for field in row):
+                continue
+            
+            if len(row) == 1:
+                # Цена внутри той же ячейки, после последней запятой
+                if ',' not in row[0]:
+                    continue
+                name, price = row[0].rsplit(',', 1)
+            else:
+                name, price = ','.join(row[:-1]), row[-1]
+            
+            yield ' '.join(name.split()), price.strip()
+
+
+def _load_source_worker(path: str, fmt: str) -> pd.DataFrame:
+    """Загружает один источник каталога (выполняется в процессе-воркере)"""
+    return DataLoader(use_snapshot=False).load_source(CatalogSource(Path(path), fmt))
+
+
+@dataclass(frozen=True)
+class _CatalogView:
+    """
+    Каталог в памяти и индексы выборок по нему
+
+    Подменяется целиком одним присваиванием (см. DataLoader._set_products):
+    /rebuild-db пересобирает каталог в пуле потоков, пока поиск читает
+    товары по ID, и записи с индексами должны относиться к одной версии.
+    """
+    df: pd.DataFrame
+    # Записи товаров в порядке строк df (общие для всех выборок)
+    records: List[ProductRecord]
+    # id -> позиция строки, категория -> позиции строк
+    id_index: Dict[int, int]
+    category_index: Dict[str, np.ndarray]
+    fingerprint: str
+
 
 class DataLoader:
     """Класс для загрузки и preprocessing данных о товарах"""
     
-    def __init__(self, data_dir: str = "."):
+    def __init__(
+        self,
+        data_dir: str = ".",
+        cache_dir: Optional[str] = None,
+        use_snapshot: bool = True,
+        source_dirs: Optional[List[str]] = None,
+        max_workers: Optional[int] = None,
+        parallel_min_bytes: int = 8 * 1024 * 1024,
+        backend: str = "pandas",
+        store_check_interval: float = STORE_CHECK_INTERVAL,
+        id_registry_path: Optional[str] = None
+    ):
+        """
+        Args:
+            data_dir: директория с CSV файлами
+            cache_dir: директория для снимка каталога (по умолчанию data/cache)
+            use_snapshot: использовать бинарный снимок каталога в get_products()
+            source_dirs: директории с прайс-листами (по умолчанию data_dir и data_dir/data_files)
+            max_workers: число процессов для параллельного разбора источников
+            parallel_min_bytes: суммарный размер источников, начиная с которого
+                разбор идет в отдельных процессах
+            backend: "pandas" (каталог в памяти) или "sqlite" (каталог в
+                cache_dir/catalog.sqlite, выборки по ID и категориям идут в
+                базу, DataFrame каталога в памяти не хранится)
+            store_check_interval: для backend="sqlite" — не чаще чем раз в
+                столько секунд проверять, не изменились ли исходные CSV
+            id_registry_path: реестр стабильных ID товаров (по умолчанию
+                cache_dir/product_ids.json)
+        """
+        if backend not in ("pandas", "sqlite"):
+            raise ValueError(f"Неизвестный backend каталога: {backend}")
         self.data_dir = Path(data_dir)
-        self.products_df = None
+        self.source_dirs = (
+            [Path(d) for d in source_dirs] if source_dirs is not None
+            else [self.data_dir, self.data_dir / "data_files"]
+        )
+        self.max_workers = max_workers
+        self.parallel_min_bytes = parallel_min_bytes
+        # Каталог в памяти для backend="pandas" (None — еще не загружен)
+        self._view: Optional[_CatalogView] = None
+        self.use_snapshot = use_snapshot
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else self.data_dir / "data" / "cache"
+        self.snapshot = CatalogSnapshot(self.cache_dir)
+        self.id_registry_path = (
+            Path(id_registry_path) if id_registry_path is not None
+            else self.cache_dir / "product_ids.json"
+        )
+        self.backend = backend
+        self.store = SQLiteCatalogStore(self.cache_dir / "catalog.sqlite") if backend == "sqlite" else None
+        self.store_check_interval = store_check_interval
+        self._store_checked_at: Optional[float] = None
+        self._store_lock = threading.Lock()
+        # Пересборка каталога (и SQLite базы) выполняется одним потоком за раз
+        self._combine_lock = threading.RLock()
+        # Происхождение товаров по источникам (для инкрементальной переиндексации)
+        self.provenance: List[Dict] = []
+        # Отпечаток ID и названий каталога в SQLite базе (см. catalog_fingerprint)
+        self._fingerprint: Optional[str] = None
+    
+    @property
+    def products_df(self) -> Optional[pd.DataFrame]:
+        """Каталог в памяти (backend="pandas"; None — еще не загружен)"""
+        view = self._view
+        return view.df if view is not None else None
+    
+    def discover_sources(self) -> List[CatalogSource]:
+        """Находит все поддерживаемые прайс-листы в директориях данных"""
+        return discover_sources(self.source_dirs)
+    
+    def _source_files(self) -> List[Path]:
+        """Исходные CSV файлы каталога"""
+        return [source.path for source in self.discover_sources()]
         
     def parse_price(self, price_str: str) -> float:
         """
@@ -33,7 +193,7 @@ class DataLoader:
         price_str = price_str.replace(',', '.')
         
         # Извлекаем первое число
-        match = re.search(r'(\d+(?:\.\d+)?)', price_str)
+        match = PRICE_NUMBER_RE.search(price_str)
         if match:
             return float(match.group(1))
         return 0.0
@@ -52,9 +212,50 @@ class DataLoader:
             return ""
         
         # Удаляем цену в конце строки (например, "- 61263 руб.")
-        name = re.sub(r'\s*-\s*\d+\s*руб\.?\s*$', '', str(name))
+        name = NAME_PRICE_SUFFIX_RE.sub('', str(name))
         return name.strip()
     
+    def parse_price_series(self, prices: pd.Series) -> pd.Series:
+        """
+        Векторизованная версия parse_price для целой колонки
+        
+        Результат совпадает с prices.apply(self.parse_price), но без вызова
+        Python-функции на каждую строку.
+        
+        Args:
+            prices: колонка с ценами (строки или числа)
+            
+        Returns:
+            pd.Series: цены в float64 (0.0 для пустых/нераспознанных)
+        """
+        # Целые числа: str(-5) -> '5' после извлечения, отсюда abs()
+        if pd.api.types.is_integer_dtype(prices.dtype):
+            return prices.abs().astype(float).fillna(0.0)
+        
+        text = prices.astype(str)
+        text = (
+            text.str.replace(' ', '', regex=False)
+                .str.replace('руб.', '', regex=False)
+                .str.replace('руб', '', regex=False)
+                .str.replace(',', '.', regex=False)
+        )
+        # NaN превращается в строку 'nan' без цифр и тоже дает 0.0
+        parsed = text.str.extract(PRICE_NUMBER_PATTERN, expand=False).astype(float)
+        return parsed.fillna(0.0)
+    
+    def clean_product_name_series(self, names: pd.Series) -> pd.Series:
+        """
+        Векторизованная версия clean_product_name для целой колонки
+        
+        Args:
+            names: колонка с названиями товаров
+            
+        Returns:
+            pd.Series: очищенные названия ("" для пустых)
+        """
+        cleaned = names.astype(str).str.replace(NAME_PRICE_SUFFIX_PATTERN, '', regex=True).str.strip()
+        return cleaned.mask(names.isna(), "")
+    
     def load_changed_csv(self, filepath: Optional[str] = None) -> pd.DataFrame:
         """
         Загружает данные из changed_50.csv
@@ -68,7 +269,7 @@ class DataLoader:
         if filepath is None:
             filepath = self.data_dir / "changed_50.csv"
         
-        df = pd.read_csv(filepath, encoding='utf-8')
+        df = pd.read_csv(filepath, encoding='utf-8-sig')
         
         # Переименовываем колонки для единообразия
         df = df.rename(columns={
@@ -78,8 +279,8 @@ class DataLoader:
         })
         
         # Очищаем названия и парсим цены
-        df['name'] = df['name'].apply(self.clean_product_name)
-        df['price'] = df['price'].apply(self.parse_price)
+        df['name'] = self.clean_product_name_series(df['name'])
+        df['price'] = self.parse_price_series(df['price'])
         
         return df
     
@@ -87,122 +288,334 @@ class DataLoader:
         """
         Загружает данные из materials_50_items.csv
         
+        Записи читаются потоково (iter_price_list_records), и повторы
+        названий внутри файла отбрасываются по мере чтения (остается первая
+        запись, как в combine_datasets). Уникальные записи собираются в один
+        DataFrame: дедупликация между источниками и выдача ID в
+        combine_datasets работают с каталогом целиком.
+        
         Args:
             filepath: путь к файлу (если None, использует стандартный путь)
             
         Returns:
-            DataFrame с колонками: name, price
+            DataFrame с колонками: name, price, category
         """
         if filepath is None:
             filepath = self.data_dir / "materials_50_items.csv"
         
-        # Читаем построчно для обработки нестандартного формата
+        seen = set()
         rows = []
-        with open(filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        current_name = ""
-        for i, line in enumerate(lines):
-            if i == 0:  # Пропускаем заголовок
+        for name, price in iter_price_list_records(filepath):
+            if name in seen:
                 continue
-            
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Если строка начинается с кавычки, это начало записи
-            if line.startswith('"'):
-                # Извлекаем всё содержимое между кавычками
-                parts = line.split('",')
-                if len(parts) == 2:
-                    # Название и цена в одной строке
-                    name_part = parts[0].strip('"')
-                    price_part = parts[1].strip()
-                    
-                    # Разделяем название и цену внутри name_part (они через запятую)
-                    if ',' in name_part:
-                        name_price_split = name_part.rsplit(',', 1)
-                        if len(name_price_split) == 2:
-                            name = name_price_split[0].strip()
-                            price = name_price_split[1].strip()
-                        else:
-                            name = name_part
-                            price = price_part
-                    else:
-                        name = name_part
-                        price = price_part
-                    
-                    rows.append({'name': name, 'price': price})
-            else:
-                # Строка без кавычек - простой формат через запятую
-                parts = line.rsplit(',', 1)
-                if len(parts) == 2:
-                    rows.append({'name': parts[0].strip(), 'price': parts[1].strip()})
+            seen.add(name)
+            rows.append((name, price))
         
-        df = pd.DataFrame(rows)
+        return self._prepare_materials_frame(rows)
+    
+    def _prepare_materials_frame(self, rows: List[Tuple[str, str]]) -> pd.DataFrame:
+        """Парсит цены и категории для записей прайс-листа"""
+        df = pd.DataFrame(rows, columns=['name', 'price'])
         
         # Парсим цены
-        df['price'] = df['price'].apply(self.parse_price)
+        df['price'] = self.parse_price_series(df['price'])
         
         # Очищаем названия
-        df['name'] = df['name'].apply(lambda x: str(x).strip() if not pd.isna(x) else "")
+        df['name'] = df['name'].fillna("").astype(str).str.strip()
         
         # Извлекаем категорию из названия (первое слово)
-        df['category'] = df['name'].apply(lambda x: x.split()[0] if x else "Неизвестно")
+        df['category'] = df['name'].str.split(n=1).str[0].fillna("Неизвестно").astype(str)
         
         return df
     
-    def combine_datasets(self) -> pd.DataFrame:
+    def load_simple_csv(self, filepath: str) -> pd.DataFrame:
         """
-        Объединяет данные из обоих CSV файлов
+        Загружает прайс-лист, сконвертированный админкой (название,цена,описание)
         
+        Args:
+            filepath: путь к файлу
+            
         Returns:
-            DataFrame с объединенными данными
+            DataFrame с колонками: name, price, category
         """
-        df1 = self.load_changed_csv()
-        df2 = self.load_materials_csv()
+        df = pd.read_csv(filepath, encoding='utf-8-sig')
+        df.columns = [str(c).strip().lower() for c in df.columns]
+        df = df.rename(columns={'название': 'name', 'цена': 'price'})[['name', 'price']]
         
-        # Объединяем датасеты
-        combined = pd.concat([df1, df2], ignore_index=True)
+        df['name'] = self.clean_product_name_series(df['name'])
+        df['price'] = self.parse_price_series(df['price'])
+        df['category'] = df['name'].str.split(n=1).str[0].fillna("Неизвестно").astype(str)
         
-        # Удаляем дубликаты по названию
-        combined = combined.drop_duplicates(subset=['name'], keep='first')
+        return df
+    
+    def load_source(self, source: CatalogSource) -> pd.DataFrame:
+        """
+        Загружает один источник каталога в зависимости от его формата
         
-        # Добавляем ID для каждого товара
-        combined['id'] = range(len(combined))
+        Args:
+            source: источник из discover_sources()
+            
+        Returns:
+            DataFrame с колонками: name, price, category
+        """
+        if source.format == FORMAT_CHANGED:
+            df = self.load_changed_csv(source.path)
+        elif source.format == FORMAT_MATERIALS:
+            df = self.load_materials_csv(source.path)
+        else:
+            df = self.load_simple_csv(source.path)
+        return df[['name', 'price', 'category']]
+    
+    def _load_sources(self, sources: List[CatalogSource]) -> List[pd.DataFrame]:
+        """
+        Разбирает источники, большие наборы - параллельно в процессах
+        
+        Порядок результатов совпадает с порядком sources независимо от того,
+        какой воркер закончил первым.
+        """
+        total_bytes = sum(source.path.stat().st_size for source in sources)
+        workers = self.max_workers or min(len(sources), os.cpu_count() or 1)
+        
+        if len(sources) < 2 or workers < 2 or total_bytes < self.parallel_min_bytes:
+            return [self.load_source(source) for source in sources]
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(
+                _load_source_worker,
+                [str(source.path) for source in sources],
+                [source.format for source in sources]
+            ))
+    
+    def combine_datasets(self) -> pd.DataFrame:
+        """
+        Объединяет данные из всех найденных прайс-листов
+        
+        Источники: changed_50.csv, materials_50_items.csv и все поддерживаемые
+        CSV из data_files/ (см. discover_sources). Дубликаты по названию
+        удаляются с приоритетом более раннего источника, ID товаров
+        стабильны между запусками (реестр id_registry_path).
         
-        # Убираем пустые названия
+        Параллельные вызовы (например, /rebuild-db и первая выборка)
+        выполняются по очереди; новый каталог публикуется целиком.
+        
+        Returns:
+            DataFrame с объединенными данными (пустой, если прайс-листов нет)
+        """
+        with self._combine_lock:
+            return self._combine_datasets()
+    
+    def _combine_datasets(self) -> pd.DataFrame:
+        """combine_datasets под _combine_lock"""
+        sources = self.discover_sources()
+        frames = self._load_sources(sources)
+        # Каждый источник хешируется один раз: для снимка и для provenance
+        fingerprints = CatalogSnapshot.fingerprint([source.path for source in sources])
+        
+        # Объединяем датасеты, запоминая источник каждой строки
+        for position, frame in enumerate(frames):
+            frame['_source'] = position
+        if frames:
+            combined = pd.concat(frames, ignore_index=True)
+        else:
+            print("⚠️ Не найдено ни одного прайс-листа, каталог пуст")
+            combined = pd.DataFrame({
+                'name': pd.Series(dtype=object),
+                'price': pd.Series(dtype=float),
+                'category': pd.Series(dtype=object),
+                '_source': pd.Series(dtype=np.int64)
+            })
+        
+        # Удаляем дубликаты по названию и пустые названия
+        combined = combined.drop_duplicates(subset=['name'], keep='first')
         combined = combined[combined['name'].str.len() > 0]
         
+        # Стабильные ID: товар сохраняет ID при изменении набора источников
+        registry = ProductIdRegistry(self.id_registry_path, legacy_path=self.data_dir / "data" / "product_ids.json")
+        names = combined['name'].tolist()
+        combined['id'] = registry.assign(names)
+        registry.prune(names)
+        try:
+            registry.save()
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить реестр ID товаров: {e}")
+        
+        self.provenance = self._build_provenance(sources, frames, combined, fingerprints)
+        combined = combined.drop(columns=['_source'])
+        
         # Переименовываем 'price' в 'cost' для совместимости с LLMValidator
         if 'price' in combined.columns:
             combined = combined.rename(columns={'price': 'cost'})
         
-        self.products_df = combined
+        if self.store is None:
+            self._set_products(combined)
+        
+        if self.use_snapshot or self.store is not None:
+            try:
+                self.snapshot.save(combined, [source.path for source in sources], fingerprints)
+                self._save_provenance()
+            except OSError as e:
+                print(f"⚠️ Не удалось сохранить снимок каталога: {e}")
+        
+        if self.store is not None:
+            self.store.build(combined)
+            # Отпечаток меняется после подмены базы: читатели не сопоставят старые строки с новым индексом
+            self._fingerprint = catalog_fingerprint(combined)
+            self._store_checked_at = time.monotonic()
+        
         return combined
     
+    def _ensure_store(self) -> SQLiteCatalogStore:
+        """
+        Возвращает SQLite-хранилище, пересобирая его при изменении источников
+        
+        Свежесть определяется по снимку каталога, который пишется вместе с
+        базой, и проверяется не чаще раза в store_check_interval секунд:
+        проверка читает заголовки и отпечатки всех источников, поэтому не
+        выполняется на каждой выборке.
+        """
+        with self._store_lock:
+            checked_at = self._store_checked_at
+            if checked_at is not None and time.monotonic() - checked_at < self.store_check_interval:
+                return self.store
+            if not self.store.exists() or not self.snapshot.is_fresh(self._source_files()):
+                self.combine_datasets()
+            else:
+                # База могла быть пересобрана другим процессом
+                self._fingerprint = self.snapshot.catalog_fingerprint()
+                self._store_checked_at = time.monotonic()
+        return self.store
+    
+    def _build_provenance(
+        self,
+        sources: List[CatalogSource],
+        frames: List[pd.DataFrame],
+        combined: pd.DataFrame,
+        fingerprints: List[Dict]
+    ) -> List[Dict]:
+        """
+        Описывает, какие товары попали в каталог из каждого источника
+        
+        Args:
+            fingerprints: отпечатки источников (CatalogSnapshot.fingerprint)
+        """
+        ids_by_source = combined.groupby('_source')['id'].apply(list).to_dict()
+        
+        provenance = []
+        for position, (source, frame, fingerprint) in enumerate(zip(sources, frames, fingerprints)):
+            provenance.append({
+                "path": str(source.path),
+                "format": source.format,
+                "size": fingerprint["size"],
+                "mtime_ns": fingerprint["mtime_ns"],
+                "sha1": fingerprint["sha1"],
+                "rows": len(frame),
+                "product_ids": [int(pid) for pid in ids_by_source.get(position, [])]
+            })
+        return provenance
+    
+    def _save_provenance(self):
+        """Сохраняет происхождение товаров рядом со снимком каталога"""
+        path = self.cache_dir / "catalog_sources.json"
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.provenance, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    
+    def _load_provenance(self) -> List[Dict]:
+        """Загружает происхождение товаров, сохраненное вместе со снимком"""
+        path = self.cache_dir / "catalog_sources.json"
+        if not path.exists():
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
     def get_products(self) -> pd.DataFrame:
         """
         Возвращает загруженные данные о товарах
         
+        Если исходные CSV не менялись с прошлого запуска, каталог читается
+        из бинарного снимка одним чтением; иначе CSV разбираются заново и
+        снимок пересоздается. Для backend="sqlite" каталог читается из базы
+        целиком при каждом вызове и не кэшируется (нужен только для
+        построения индекса).
+        
         Returns:
             DataFrame с товарами
         """
-        if self.products_df is None:
-            return self.combine_datasets()
-        return self.products_df
+        if self.store is not None:
+            return self._ensure_store().load_dataframe()
+        return self._catalog_view().df
+    
+    def _catalog_view(self) -> _CatalogView:
+        """Текущая версия каталога в памяти (загружается при первом обращении)"""
+        view = self._view
+        if view is not None:
+            return view
+        with self._combine_lock:
+            if self._view is None:
+                cached = self.snapshot.load(self._source_files()) if self.use_snapshot else None
+                if cached is not None:
+                    self._set_products(cached)
+                    self.provenance = self._load_provenance()
+                else:
+                    self._combine_datasets()
+            return self._view
+    
+    def _set_products(self, df: pd.DataFrame):
+        """Строит индексы для быстрых выборок и публикует каталог одним присваиванием"""
+        categories = df['category'].fillna('').astype(str).str.lower()
+        self._view = _CatalogView(
+            df=df,
+            records=ProductRecord.from_frame(df),
+            id_index={int(pid): pos for pos, pid in enumerate(df['id'].tolist())},
+            category_index={
+                key: positions
+                for key, positions in categories.groupby(categories.values, sort=False).indices.items()
+            },
+            fingerprint=catalog_fingerprint(df)
+        )
     
-    def load_all_products(self) -> List[Dict]:
+    def catalog_fingerprint(self) -> Optional[str]:
         """
-        Загружает все товары в виде списка словарей
+        Отпечаток ID и названий текущего каталога
+        
+        Поисковый движок сохраняет отпечаток каталога, по которому построен
+        индекс: строки каталога подставляются в результаты по ID только если
+        отпечатки совпадают.
         
         Returns:
-            List[Dict]: список словарей с товарами
+            str или None (SQLite база собрана снимком без отпечатка)
         """
-        df = self.get_products()
-        return df.to_dict('records')
+        if self.store is not None:
+            self._ensure_store()
+            return self._fingerprint
+        return self._catalog_view().fingerprint
+    
+    def count_products(self) -> int:
+        """Число товаров в каталоге"""
+        if self.store is not None:
+            return self._ensure_store().count()
+        return len(self.get_products())
     
-    def get_product_by_id(self, product_id: int) -> Optional[Dict]:
+    def get_categories(self) -> List[str]:
+        """Непустые категории каталога (по алфавиту)"""
+        if self.store is not None:
+            return self._ensure_store().categories()
+        categories = self.get_products()['category'].fillna('').astype(str)
+        return sorted(set(categories[categories != ''].tolist()))
+    
+    def load_all_products(self) -> List[ProductRecord]:
+        """
+        Загружает все товары в виде списка записей
+        
+        Returns:
+            List[ProductRecord]: товары (поддерживают доступ как к словарю)
+        """
+        if self.store is not None:
+            return ProductRecord.from_frame(self.get_products())
+        return list(self._catalog_view().records)
+    
+    def get_product_by_id(self, product_id: int) -> Optional[ProductRecord]:
         """
         Получает товар по ID
         
@@ -210,17 +623,36 @@ class DataLoader:
             product_id: ID товара
             
         Returns:
-            Dict с данными товара или None
+            ProductRecord или None
         """
-        if self.products_df is None:
-            self.combine_datasets()
+        if self.store is not None:
+            return self._ensure_store().get_product_by_id(product_id)
         
-        product = self.products_df[self.products_df['id'] == product_id]
-        if len(product) > 0:
-            return product.iloc[0].to_dict()
-        return None
+        view = self._catalog_view()
+        
+        pos = view.id_index.get(product_id)
+        if pos is None:
+            return None
+        return view.records[pos]
     
-    def search_by_category(self, category: str) -> List[Dict]:
+    def get_products_by_ids(self, product_ids: List[int]) -> List[ProductRecord]:
+        """
+        Получает несколько товаров по ID без обращения к DataFrame
+        
+        Args:
+            product_ids: список ID товаров
+            
+        Returns:
+            List товаров в порядке product_ids (неизвестные ID пропускаются)
+        """
+        if self.store is not None:
+            return self._ensure_store().get_products_by_ids(product_ids)
+        
+        view = self._catalog_view()
+        
+        return [view.records[view.id_index[pid]] for pid in product_ids if pid in view.id_index]
+    
+    def search_by_category(self, category: str) -> List[ProductRecord]:
         """
         Поиск товаров по категории
         
@@ -228,16 +660,45 @@ class DataLoader:
             category: название категории
             
         Returns:
-            List словарей с товарами
+            List товаров
         """
-        if self.products_df is None:
-            self.combine_datasets()
+        if self.store is not None:
+            return self._ensure_store().search_by_category(category)
+        
+        view = self._catalog_view()
+        
+        # Поиск подстроки с игнорированием регистра по уникальным категориям,
+        # а не по всем строкам каталога
+        key = category.lower()
+        matched = [
+            positions
+            for name, positions in view.category_index.items()
+            if key in name
+        ]
+        if not matched:
+            return []
+        
+        positions = np.sort(np.concatenate(matched))
+        return [view.records[pos] for pos in positions.tolist()]
+
+    
+    def search_text(self, query: str, limit: int = 10) -> List[ProductRecord]:
+        """
+        Лексический поиск по названиям (FTS5)
         
-        # Поиск с игнорированием регистра
-        mask = self.products_df['category'].str.contains(category, case=False, na=False)
-        results = self.products_df[mask]
+        Доступен только для backend="sqlite"; используется как быстрый
+        fallback, когда векторный поиск недоступен.
         
-        return results.to_dict('records')
+        Args:
+            query: поисковый запрос
+            limit: максимум результатов
+            
+        Returns:
+            List словарей с товарами в порядке релевантности
+        """
+        if self.store is None:
+            raise RuntimeError('Лексический поиск доступен только для backend="sqlite"')
+        return self._ensure_store().search_text(query, limit)
 
 
 if __name__ == "__main__":
@@ -2,12 +2,19 @@
 Гибридный процессор запросов с декомпозицией для сложных запросов
 """
 
+import threading
+import time
+from multiprocessing import AuthenticationError
 from typing import List, Dict, Tuple, Optional
 from src.llm_preprocessor import LLMQueryPreprocessor
 from src.llm_request_parser import LLMRequestParser
+from src.llm_worker import LLMWorkerClient, LLMWorkerError
 from src.query_enhancement import QueryEnhancer
+from src.query_router import QueryRouter
 from src.llm_validator import LLMValidator, IterativeSearchValidator
+from src.validation_prompt import item_candidates
 from src.search_engine import VectorSearchEngine
+from src.data_loader import DataLoader
 from src.cost_calculator import create_response_json
 
 
@@ -26,7 +33,13 @@ class HybridQueryProcessor:
         search_engine: VectorSearchEngine,
         use_llm_parser: bool = True,
         llm_model_path: str = "./Qwen/Qwen3-4B-Instruct-2507",
-        use_fallback_enhancement: bool = True
+        use_fallback_enhancement: bool = True,
+        data_loader: Optional[DataLoader] = None,
+        llm_dtype: Optional[str] = None,
+        llm_worker_address: Optional[str] = None,
+        llm_deadline_seconds: Optional[float] = None,
+        use_router: bool = True,
+        lazy_llm_loading: bool = False
     ):
         """
         Args:
@@ -34,19 +47,51 @@ class HybridQueryProcessor:
             use_llm_parser: использовать ли LLM для парсинга запроса на входе
             llm_model_path: путь к LLM модели
             use_fallback_enhancement: использовать ли QueryEnhancer как fallback
+            data_loader: каталог товаров; если задан, найденные товары
+                подтягиваются из него по ID (актуальные цены и названия)
+            llm_dtype: точность LLM на CPU ('float32' / 'bfloat16' / 'int8'),
+                None — переменная окружения LLM_CPU_DTYPE или float32
+            llm_worker_address: адрес LLM воркера (см. llm_worker); если задан,
+                запрос разбирает воркер, а модель в этом процессе не загружается.
+                Если воркер не ответил на ping при запуске, llm_status = "failed";
+                если он недоступен или упал на запросе, запрос разбирается
+                эвристикой, а в ответе llm_fallback = "backend"
+            llm_deadline_seconds: бюджет времени на разбор запроса LLM; при
+                превышении используется эвристический разбор, а в ответе
+                llm_fallback = "deadline"
+            use_router: разбирать простые запросы ("Гайка М6") эвристикой без
+                LLM, если ее уверенность выше порога (см. query_router)
+            lazy_llm_loading: загружать LLM парсер в фоновом потоке; пока он
+                не готов, запросы разбираются роутером и QueryEnhancer, а в
+                ответе llm_fallback = "loading" (состояние — llm_status)
         """
         self.search_engine = search_engine
+        self.data_loader = data_loader
         self.use_llm_parser = use_llm_parser
+        self.llm_deadline_seconds = llm_deadline_seconds
         
-        # LLM парсер запросов (главный компонент на входе)
+        # LLM парсер запросов (главный компонент на входе):
+        # "disabled" / "loading" / "ready" / "failed"
+        self.request_parser = None
+        self.llm_status = "disabled"
+        self.llm_error: Optional[str] = None
+        self._llm_ready = threading.Event()
         if use_llm_parser:
-            self.request_parser = LLMRequestParser(
-                model_path=llm_model_path,
-                device=None  # Автоопределение: CUDA > MPS > CPU
-            )
-            print("✓ LLM Request Parser активирован")
+            self.llm_status = "loading"
+            loader_args = (llm_model_path, llm_dtype, llm_worker_address)
+            if lazy_llm_loading:
+                print("⏳ LLM Request Parser загружается в фоне (до готовности — эвристики)")
+                threading.Thread(
+                    target=self._load_request_parser, args=loader_args,
+                    kwargs={"background": True}, name="llm-loader", daemon=True
+                ).start()
+            else:
+                self._load_request_parser(*loader_args)
         else:
-            self.request_parser = None
+            self._llm_ready.set()
+        
+        # Роутер простых запросов (имеет смысл только при LLM парсере)
+        self.router = QueryRouter() if use_router and use_llm_parser else None
         
         # Query enhancer как fallback
         if use_fallback_enhancement:
@@ -55,6 +100,62 @@ class HybridQueryProcessor:
         else:
             self.query_enhancer = None
     
+    def _load_request_parser(
+        self,
+        model_path: str,
+        dtype: Optional[str],
+        worker_address: Optional[str],
+        background: bool = False
+    ):
+        """
+        Создает LLM парсер; при фоновой загрузке ошибка не пробрасывается,
+        а сохраняется в llm_error (запросы продолжают идти через эвристики)
+        """
+        try:
+            if worker_address:
+                parser = LLMWorkerClient(worker_address)
+                if not parser.ping():
+                    raise ConnectionError(f"LLM воркер {worker_address} не отвечает")
+                print(f"✓ LLM Request Parser: воркер {worker_address}")
+            else:
+                parser = LLMRequestParser(
+                    model_path=model_path,
+                    device=None,  # Автоопределение: CUDA > MPS > CPU
+                    dtype=dtype
+                )
+                print("✓ LLM Request Parser активирован")
+        except Exception as e:
+            self.llm_status = "failed"
+            self.llm_error = f"{type(e).__name__}: {e}"
+            self._llm_ready.set()
+            if not background:
+                raise
+            print(f"❌ Не удалось загрузить LLM Request Parser: {e}")
+            return
+        
+        self.request_parser = parser
+        self.llm_status = "ready"
+        self._llm_ready.set()
+    
+    def wait_for_llm(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждет окончания загрузки LLM парсера
+        
+        Returns:
+            True, если парсер готов к работе
+        """
+        self._llm_ready.wait(timeout)
+        return self.llm_status == "ready"
+    
+    def capabilities(self) -> Dict[str, str]:
+        """Состояние компонентов разбора запросов (ready / loading / failed / disabled)"""
+        return {
+            "vector_search": "ready",
+            "llm_parser": self.llm_status,
+            "router": "ready" if self.router else "disabled",
+            "query_enhancer": "ready" if self.query_enhancer else "disabled"
+        }
+    
     def process_query(
         self, 
         query: str, 
@@ -80,14 +181,39 @@ class HybridQueryProcessor:
         print(f"{'='*70}")
         print(f"Запрос: {query}")
         print(f"{'='*70}")
+        start = time.perf_counter()
+        
+        # Простой запрос разбирается без LLM, если эвристика в нем уверена
+        decision = self.router.route(query) if self.router else None
         
         # === ШАГ 1: LLM ПАРСИНГ ЗАПРОСА ===
-        if self.use_llm_parser and self.request_parser:
+        items_to_search = None
+        if decision is not None and not decision.use_llm:
+            print(f"\n⚡ Шаг 1: простой запрос, разбор без LLM (уверенность {decision.confidence:.0%})")
+            items_to_search = decision.parsed['items']
+            llm_fallback = None
+            route = "fast"
+        elif self.use_llm_parser and self.request_parser:
             print("\n🤖 Шаг 1: LLM анализирует запрос...")
-            parsed_request = self.request_parser.parse_request(query)
-            print(self.request_parser.format_result(parsed_request))
-            items_to_search = parsed_request.get('items', [])
+            try:
+                parsed_request = self.request_parser.parse_request(
+                    query, deadline_seconds=self.llm_deadline_seconds
+                )
+            except (OSError, EOFError, AuthenticationError, LLMWorkerError) as e:
+                # LLM воркер недоступен или упал на запросе — отвечаем эвристикой, а не 500
+                print(f"⚠️ LLM воркер: {e}")
+                llm_fallback = "backend"
+            else:
+                print(self.request_parser.format_result(parsed_request))
+                items_to_search = parsed_request.get('items', [])
+                llm_fallback = parsed_request.get('fallback')
+                route = "llm"
         else:
+            # LLM парсер еще загружается — отвечаем эвристикой, а не ошибкой
+            llm_fallback = "loading" if self.llm_status == "loading" else None
+        
+        if items_to_search is None:
+            route = "heuristic"
             # Fallback на Query Enhancer
             print("\n🔍 Шаг 1: Эвристический анализ запроса...")
             if self.query_enhancer:
@@ -106,19 +232,23 @@ class HybridQueryProcessor:
         all_results = []
         total_cost = 0
         
-        for i, item_spec in enumerate(items_to_search, 1):
+        # Поиск в векторной БД с индивидуальным top_k (динамический top_k от LLM)
+        searches = [
+            self.search_engine.search(item_spec.get('name', ''), top_k=item_spec.get('top_k', 3))
+            for item_spec in items_to_search
+        ]
+        searches = self._refresh_from_catalog(searches)
+        
+        for i, (item_spec, search_results) in enumerate(zip(items_to_search, searches), 1):
             item_name = item_spec.get('name', '')
             quantity = item_spec.get('quantity', 1)
             specs = item_spec.get('specifications', '')
-            top_k = item_spec.get('top_k', 3)  # Динамический top_k от LLM
+            top_k = item_spec.get('top_k', 3)
             
             print(f"\n{i}. Поиск: {item_name}")
             print(f"   Количество: {quantity} шт.")
             print(f"   Поиск альтернатив: {top_k}")
             
-            # Поиск в векторной БД с индивидуальным top_k
-            search_results = self.search_engine.search(item_name, top_k=top_k)
-            
             if search_results:
                 # Берем лучший результат
                 best_product, best_score = search_results[0]
@@ -145,7 +275,9 @@ class HybridQueryProcessor:
                             "score": float(score)
                         }
                         for prod, score in search_results[1:min(3, len(search_results))]
-                    ]
+                    ],
+                    # Все найденные товары позиции для валидации (см. validation_items)
+                    "candidates": item_candidates(item_name, search_results)
                 })
             else:
                 print(f"   ❌ Товар не найден")
@@ -157,7 +289,8 @@ class HybridQueryProcessor:
                     "unit_price": 0,
                     "total_price": 0,
                     "specifications": specs,
-                    "alternatives": []
+                    "alternatives": [],
+                    "candidates": []
                 })
         
         # === ШАГ 3: ФОРМИРОВАНИЕ ОТВЕТА ===
@@ -172,9 +305,48 @@ class HybridQueryProcessor:
             "total_items": len(items_to_search),
             "found_items": sum(1 for r in all_results if r['found_product'] is not None),
             "total_cost": total_cost,
-            "currency": "RUB"
+            "currency": "RUB",
+            "llm_fallback": llm_fallback,
+            "route": route
         }
         
+        if self.router:
+            self.router.record(route, time.perf_counter() - start)
+        
         return response
+    
+    @staticmethod
+    def validation_items(response: Dict) -> List[Dict]:
+        """
+        Кандидаты всех позиций ответа process_query для LLMValidator
+
+        У каждого кандидата есть requested_item, поэтому в промпте валидации
+        кандидаты одной позиции не вытесняют кандидатов другой.
+        """
+        return [
+            candidate
+            for item in response.get('items', [])
+            for candidate in item.get('candidates', [])
+        ]
+    
+    def _refresh_from_catalog(
+        self,
+        searches: List[List[Tuple[Dict, float]]]
+    ) -> List[List[Tuple[Dict, float]]]:
+        """
+        Заменяет товары из индекса актуальными строками каталога
+        
+        Все ID запрашиваются у DataLoader одним вызовом get_products_by_ids.
+        Замена выполняется, только если индекс построен по той же версии
+        каталога (см. VectorSearchEngine.replace_from_catalog), и только для
+        строк с тем же названием; остальные товары остаются как в индексе.
+        Цены берутся из таблицы цен поискового движка (обновляется
+        прайс-листами без перезагрузки индекса).
+        """
+        if self.data_loader is None:
+            return searches
         
-        return all_results
+        # Один запрос к каталогу на все позиции, затем разбиение обратно
+        flat = [hit for results in searches for hit in results]
+        replaced = iter(self.search_engine.replace_from_catalog(flat, self.data_loader))
+        return [[next(replaced) for _ in results] for results in searches]
@@ -0,0 +1,450 @@
+"""
+Генерация JSON по схеме (constrained decoding)
+
+LLM компоненты просят у модели JSON и потом выискивают его в ответе
+регулярным выражением. Модель при этом может дописать текст после JSON,
+начать ответ с ```json или сломать скобки — тогда весь бюджет токенов уже
+потрачен, а разбор падает в эвристику.
+
+Здесь на каждом шаге генерации запрещаются токены, с которыми текст
+перестает быть префиксом JSON нужной схемы, а сразу после закрытия
+корневого объекта разрешен только EOS — генерация останавливается.
+
+Поддерживается подмножество JSON Schema, которого хватает промптам
+проекта: object (properties, required; других ключей нет), array (items,
+minItems, maxItems), string (maxLength), integer (minimum, maximum),
+number. Числа пишутся без ведущих нулей, как требует JSON. Пробелов между
+токенами JSON подряд не больше _MAX_WHITESPACE_RUN, поэтому при
+ограниченных maxItems и maxLength длина ответа ограничена схемой.
+"""
+
+import re
+import threading
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+_WHITESPACE = frozenset(b' \t\n\r')
+_DIGITS = frozenset(b'0123456789')
+_ESCAPES = frozenset(b'"\\/bfnrt')
+# Длиннее чисел в ответах не бывает; ограничение не дает модели зациклиться на цифрах
+_MAX_NUMBER_LENGTH = 16
+# Пробельных символов подряд между токенами JSON (перевод строки и отступ)
+_MAX_WHITESPACE_RUN = 16
+
+# Состояние разбора — кортеж кадров (вершина стека последняя):
+#   ('value', schema)                              ожидается значение
+#   ('obj', schema, used_keys, phase, key)         phase: start / key / colon / next
+#   ('key', schema, used_keys, partial)            внутри имени ключа
+#   ('arr', schema, count, phase)                  phase: start / item / next
+#   ('str', escaped, chars, max_chars, pending)    внутри строки; pending — ждем байтов UTF-8
+#   ('num', schema, text)                          внутри числа
+#   ('ws', count)                                  пробелы перед следующим токеном
+# Пустой кортеж — корневое значение закрыто.
+State = Tuple[tuple, ...]
+
+
+def _integer_reachable(text: bytes, schema: Dict[str, Any], final: bool) -> bool:
+    """
+    Есть ли у префикса целого числа продолжение в пределах minimum / maximum
+
+    Args:
+        text: начало числа ("-", "-1", "12"...)
+        schema: схема integer
+        final: число закончилось, продолжений нет
+    """
+    minimum = schema.get('minimum')
+    maximum = schema.get('maximum')
+    if minimum is None and maximum is None:
+        return True
+
+    sign = -1 if text.startswith(b'-') else 1
+    digits = text.lstrip(b'-')
+    if not digits:
+        # Только знак минус: достижимы все числа <= -1
+        upper = -1 if maximum is None else min(-1, maximum)
+        return minimum is None or minimum <= upper
+
+    magnitude = int(digits)
+    # Продолжения: magnitude * 10^k + [0, 10^k - 1]; после "0" цифр нет
+    extra = 0 if final or magnitude == 0 else _MAX_NUMBER_LENGTH - len(text)
+    for k in range(extra + 1):
+        scale = 10 ** k
+        low, high = magnitude * scale, magnitude * scale + scale - 1
+        if sign < 0:
+            low, high = -high, -low
+        if (maximum is None or low <= maximum) and (minimum is None or high >= minimum):
+            return True
+    return False
+
+
+class JsonSchemaMatcher:
+    """
+    Автомат, проверяющий, что последовательность байтов — префикс JSON схемы
+
+    Состояния неизменяемые, поэтому одно состояние можно проверять со
+    многими кандидатами-токенами без копирования.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        """
+        Args:
+            schema: схема корневого значения
+        """
+        self.schema = schema
+
+    def initial_state(self) -> State:
+        return (('value', self.schema),)
+
+    @staticmethod
+    def is_complete(state: Optional[State]) -> bool:
+        """Корневое значение полностью сгенерировано"""
+        return state == ()
+
+    def advance(self, state: State, data: bytes) -> Optional[State]:
+        """
+        Состояние после байтов data
+
+        Returns:
+            новое состояние или None, если data нарушает схему
+        """
+        for byte in data:
+            state = self._step(state, byte)
+            if state is None:
+                return None
+        return state
+
+    def _step(self, state: State, byte: int) -> Optional[State]:
+        if not state:
+            return None
+
+        frame = state[-1]
+        rest = state[:-1]
+        kind = frame[0]
+
+        if kind == 'str':
+            return self._step_string(rest, frame, byte)
+
+        if kind == 'ws':
+            if byte in _WHITESPACE:
+                return rest + (('ws', frame[1] + 1),) if frame[1] < _MAX_WHITESPACE_RUN else None
+            # Пробелы закончились: байт обрабатывает кадр под ними
+            return self._step(rest, byte)
+
+        if kind == 'num':
+            _, schema, text = frame
+            integer = schema.get('type') == 'integer'
+            if byte in _DIGITS and len(text) < _MAX_NUMBER_LENGTH:
+                # JSON не допускает ведущих нулей: после "0" / "-0" цифр нет
+                if text.lstrip(b'-') == b'0':
+                    return None
+                text += bytes((byte,))
+                if integer and not _integer_reachable(text, schema, final=False):
+                    return None
+                return rest + (('num', schema, text),)
+            if byte == ord('.') and not integer and b'.' not in text and text[-1] in _DIGITS:
+                return rest + (('num', schema, text + b'.'),)
+            if text[-1] not in _DIGITS:
+                return None
+            if integer and not _integer_reachable(text, schema, final=True):
+                return None
+            # Число закончилось: байт обрабатывает родительский кадр
+            return self._step(rest, byte)
+
+        if kind == 'value':
+            if byte in _WHITESPACE:
+                return state + (('ws', 1),)
+            return self._start_value(rest, frame[1], byte)
+
+        if kind == 'key':
+            return self._step_key(rest, frame, byte)
+
+        if kind == 'obj':
+            return self._step_object(rest, frame, byte)
+
+        if kind == 'arr':
+            return self._step_array(rest, frame, byte)
+
+        return None
+
+    def _start_value(self, stack: State, schema: Dict[str, Any], byte: int) -> Optional[State]:
+        value_type = schema.get('type')
+        if value_type == 'object' and byte == ord('{'):
+            return stack + (('obj', schema, frozenset(), 'start', None),)
+        if value_type == 'array' and byte == ord('['):
+            return stack + (('arr', schema, 0, 'start'),)
+        if value_type == 'string' and byte == ord('"'):
+            return stack + (('str', False, 0, schema.get('maxLength'), 0),)
+        if value_type in ('integer', 'number') and (byte in _DIGITS or byte == ord('-')):
+            text = bytes((byte,))
+            if value_type == 'integer' and not _integer_reachable(text, schema, final=False):
+                return None
+            return stack + (('num', schema, text),)
+        return None
+
+    def _step_string(self, rest: State, frame: tuple, byte: int) -> Optional[State]:
+        _, escaped, chars, max_chars, pending = frame
+
+        if pending:
+            # Продолжение многобайтового символа UTF-8
+            if 0x80 <= byte < 0xC0:
+                return rest + (('str', False, chars, max_chars, pending - 1),)
+            return None
+        if escaped:
+            return rest + (('str', False, chars + 1, max_chars, 0),) if byte in _ESCAPES else None
+        if byte == ord('"'):
+            return rest
+        if max_chars is not None and chars >= max_chars:
+            return None
+        if byte == ord('\\'):
+            return rest + (('str', True, chars, max_chars, 0),)
+        if byte < 0x20:
+            return None
+        if byte < 0x80:
+            return rest + (('str', False, chars + 1, max_chars, 0),)
+        if 0xC2 <= byte < 0xE0:
+            pending = 1
+        elif 0xE0 <= byte < 0xF0:
+            pending = 2
+        elif 0xF0 <= byte < 0xF5:
+            pending = 3
+        else:
+            return None
+        return rest + (('str', False, chars + 1, max_chars, pending),)
+
+    def _step_key(self, rest: State, frame: tuple, byte: int) -> Optional[State]:
+        _, schema, used, partial = frame
+        if byte == ord('"'):
+            key = partial.decode('utf-8', errors='replace')
+            if key not in schema.get('properties', {}) or key in used:
+                return None
+            # rest[-1] — кадр объекта, которому принадлежит ключ
+            return rest[:-1] + (('obj', schema, used | {key}, 'colon', key),)
+        if byte == ord('\\'):
+            return None
+        partial += bytes((byte,))
+        if any(candidate.startswith(partial) for candidate in self._free_keys(schema, used)):
+            return rest + (('key', schema, used, partial),)
+        return None
+
+    @staticmethod
+    def _free_keys(schema: Dict[str, Any], used: frozenset) -> Iterable[bytes]:
+        return (key.encode('utf-8') for key in schema.get('properties', {}) if key not in used)
+
+    def _step_object(self, rest: State, frame: tuple, byte: int) -> Optional[State]:
+        _, schema, used, phase, key = frame
+        if byte in _WHITESPACE:
+            return rest + (frame, ('ws', 1))
+
+        if phase in ('start', 'key') and byte == ord('"'):
+            if not any(True for _ in self._free_keys(schema, used)):
+                return None
+            return rest + (frame, ('key', schema, used, b''))
+
+        if phase == 'colon' and byte == ord(':'):
+            return rest + (
+                ('obj', schema, used, 'next', None),
+                ('value', schema['properties'][key])
+            )
+
+        if phase == 'next' and byte == ord(','):
+            if not any(True for _ in self._free_keys(schema, used)):
+                return None
+            return rest + (('obj', schema, used, 'key', None),)
+
+        if phase in ('start', 'next') and byte == ord('}'):
+            if all(name in used for name in schema.get('required', ())):
+                return rest
+            return None
+
+        return None
+
+    def _step_array(self, rest: State, frame: tuple, byte: int) -> Optional[State]:
+        _, schema, count, phase = frame
+        if byte in _WHITESPACE:
+            return rest + (frame, ('ws', 1))
+
+        can_close = count >= schema.get('minItems', 0)
+
+        if phase == 'next':
+            if byte == ord(','):
+                max_items = schema.get('maxItems')
+                if max_items is not None and count >= max_items:
+                    return None
+                return rest + (('arr', schema, count, 'item'),)
+            if byte == ord(']') and can_close:
+                return rest
+            return None
+
+        if phase == 'start' and byte == ord(']'):
+            return rest if can_close else None
+
+        return self._start_value(rest + (('arr', schema, count + 1, 'next'),), schema['items'], byte)
+
+
+def _byte_decoder() -> Dict[str, int]:
+    """Обратное отображение byte-level BPE (GPT-2/Qwen): символ токена -> байт"""
+    printable = (
+        list(range(ord('!'), ord('~') + 1))
+        + list(range(ord('¡'), ord('¬') + 1))
+        + list(range(ord('®'), ord('ÿ') + 1))
+    )
+    byte_values = printable[:]
+    chars = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in byte_values:
+            byte_values.append(byte)
+            chars.append(256 + extra)
+            extra += 1
+    return {chr(char): byte for byte, char in zip(byte_values, chars)}
+
+
+_SENTENCEPIECE_BYTE = re.compile(r'^<0x([0-9A-Fa-f]{2})>$')
+
+_vocabularies: "weakref.WeakKeyDictionary[Any, List[Optional[bytes]]]" = weakref.WeakKeyDictionary()
+_vocabularies_lock = threading.Lock()
+
+
+def vocabulary_bytes(tokenizer: Any) -> List[Optional[bytes]]:
+    """
+    Байты, которые добавляет в текст каждый токен словаря
+
+    Для специальных токенов — None. Считается один раз на токенизатор.
+    """
+    with _vocabularies_lock:
+        vocabulary = _vocabularies.get(tokenizer)
+        if vocabulary is not None:
+            return vocabulary
+
+        decoder = _byte_decoder()
+        special_ids = set(tokenizer.all_special_ids)
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+
+        vocabulary = []
+        for token_id, token in enumerate(tokens):
+            if token is None or token_id in special_ids:
+                vocabulary.append(None)
+            elif all(char in decoder for char in token):
+                vocabulary.append(bytes(decoder[char] for char in token))
+            else:
+                byte_token = _SENTENCEPIECE_BYTE.match(token)
+                if byte_token:
+                    vocabulary.append(bytes((int(byte_token.group(1), 16),)))
+                else:
+                    vocabulary.append(token.replace('▁', ' ').encode('utf-8'))
+
+        _vocabularies[tokenizer] = vocabulary
+        return vocabulary
+
+
+class JsonSchemaLogitsProcessor:
+    """
+    LogitsProcessor для model.generate: оставляет только токены, с которыми
+    ответ остается префиксом JSON схемы, а после корневого объекта — EOS
+
+    Экземпляр хранит состояние строк батча и используется для одного
+    вызова generate.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        schema: Dict[str, Any],
+        eos_token_ids: Iterable[int],
+        top_candidates: int = 64
+    ):
+        """
+        Args:
+            tokenizer: токенизатор модели
+            schema: схема ответа
+            eos_token_ids: токены, на которых generate останавливается
+            top_candidates: сколько самых вероятных токенов проверять
+                сначала (остальной словарь проверяется, только если среди
+                них нет допустимых)
+        """
+        self.matcher = JsonSchemaMatcher(schema)
+        self.vocabulary = vocabulary_bytes(tokenizer)
+        self.eos_token_ids = sorted(set(eos_token_ids))
+        self.top_candidates = top_candidates
+        self._prompt_length: Optional[int] = None
+        # По строке батча: (сгенерированные токены, состояния после 0..n токенов)
+        self._history: List[Tuple[List[int], List[Optional[State]]]] = []
+
+    def _accepts(self, state: State, token_id: int) -> bool:
+        data = self.vocabulary[token_id] if token_id < len(self.vocabulary) else None
+        return bool(data) and self.matcher.advance(state, data) is not None
+
+    def _allowed_tokens(self, state: State, scores: Any) -> List[int]:
+        import torch
+
+        if self.matcher.is_complete(state):
+            return self.eos_token_ids
+
+        top = min(self.top_candidates, scores.shape[-1])
+        candidates = torch.topk(scores, top).indices.tolist()
+        allowed = [token_id for token_id in candidates if self._accepts(state, token_id)]
+        if allowed:
+            return allowed
+
+        # Среди вероятных токенов нет допустимых — проверяем словарь по убыванию
+        order = torch.argsort(scores, descending=True).tolist()
+        for start in range(top, len(order), 4096):
+            allowed = [token_id for token_id in order[start:start + 4096] if self._accepts(state, token_id)]
+            if allowed:
+                return allowed
+        return self.eos_token_ids
+
+    def _row_state(self, row: int, generated: List[int]) -> Optional[State]:
+        """
+        Состояние строки после сгенерированных токенов
+
+        Хранится история состояний по токенам: при speculative decoding
+        процессор вызывается для нескольких позиций подряд и после отката
+        непринятых токенов, поэтому состояние ищется по общему префиксу.
+        """
+        tokens, states = self._history[row]
+        common = 0
+        limit = min(len(tokens), len(generated))
+        while common < limit and tokens[common] == generated[common]:
+            common += 1
+        del tokens[common:]
+        del states[common + 1:]
+
+        for token_id in generated[common:]:
+            state = states[-1]
+            # Закрытое (пустое) и сломанное (None) состояния не меняются
+            if state:
+                data = self.vocabulary[token_id] if token_id < len(self.vocabulary) else None
+                state = self.matcher.advance(state, data) if data else None
+            tokens.append(token_id)
+            states.append(state)
+        return states[-1]
+
+    def __call__(self, input_ids: Any, scores: Any) -> Any:
+        import torch
+
+        if self._prompt_length is None:
+            self._prompt_length = input_ids.shape[1]
+            self._history = [([], [self.matcher.initial_state()]) for _ in range(input_ids.shape[0])]
+
+        mask = torch.full_like(scores, float('-inf'))
+        for row in range(input_ids.shape[0]):
+            state = self._row_state(row, input_ids[row, self._prompt_length:].tolist())
+            if state is None:
+                # Не должно случаться; строку оставляем без ограничений
+                mask[row] = 0
+            else:
+                mask[row, self._allowed_tokens(state, scores[row])] = 0
+        return scores + mask
+
+
+def json_logits_processor(
+    tokenizer: Any,
+    schema: Dict[str, Any],
+    eos_token_ids: Iterable[int]
+) -> Any:
+    """LogitsProcessorList с ограничением по схеме для передачи в model.generate"""
+    from transformers import LogitsProcessorList
+
+    return LogitsProcessorList([JsonSchemaLogitsProcessor(tokenizer, schema, eos_token_ids)])
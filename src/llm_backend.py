@@ -0,0 +1,309 @@
+"""
+Удаленный LLM бэкенд: локальный OpenAI-совместимый сервер
+
+Вместо загрузки Qwen через transformers в процесс API LLMRequestParser и
+LLMValidator могут отправлять запросы на локальный сервер с OpenAI API
+(llama.cpp server с квантованной GGUF моделью, vLLM-CPU и т.п.) — в
+процессе API тогда не загружаются веса LLM (torch по-прежнему нужен
+векторному поиску: sentence-transformers).
+
+Соединения с сервером переиспользуются (keep-alive пул requests), число
+одновременных запросов ограничено семафором (лишние ждут в очереди, а не
+перегружают сервер). Ответ читается потоком (stream=True): при истечении
+дедлайна соединение закрывается, и сервер прекращает генерацию. JSON
+схема ответа передается в response_format (structured output сервера).
+
+Запуск сервера и API:
+    llama-server -m qwen3-4b-instruct-q4_k_m.gguf --port 8080 --parallel 4
+    LLM_BACKEND_URL=http://127.0.0.1:8080 uvicorn src.api.main:app
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.llm_scheduler import DeadlineExceeded
+
+
+# Одновременных запросов к серверу по умолчанию (обычно = --parallel сервера)
+DEFAULT_CONCURRENCY = 4
+
+# Таймаут установки соединения с сервером, секунд
+CONNECT_TIMEOUT = 5.0
+
+
+class LLMBackendError(RuntimeError):
+    """Сервер LLM недоступен или вернул ошибку"""
+
+
+def normalize_base_url(base_url: str) -> str:
+    """Адрес сервера без завершающего / и /v1 (пути API дописываются клиентом)"""
+    base_url = base_url.rstrip('/')
+    if base_url.endswith('/v1'):
+        base_url = base_url[:-3]
+    return base_url
+
+
+class OpenAICompatibleBackend:
+    """
+    Клиент chat completions OpenAI-совместимого сервера
+
+    Используйте get_backend(base_url, model): пул соединений и лимит
+    параллельности общие для всех компонентов процесса.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: float = 300.0
+    ):
+        """
+        Args:
+            base_url: адрес сервера (например, http://127.0.0.1:8080)
+            model: имя модели в запросе (None — модель, загруженная в сервер)
+            api_key: ключ для заголовка Authorization (по умолчанию LLM_BACKEND_API_KEY)
+            max_concurrency: максимум одновременных запросов к серверу
+            timeout: таймаут ответа сервера без дедлайна, секунд
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = normalize_base_url(base_url)
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        # Пул keep-alive соединений не меньше лимита параллельности
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        api_key = api_key or os.environ.get("LLM_BACKEND_API_KEY")
+        if api_key:
+            self._session.headers["Authorization"] = f"Bearer {api_key}"
+
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._deadlines = 0
+        self._in_flight = 0
+        self._total_seconds = 0.0
+
+    @property
+    def model_id(self) -> str:
+        """Идентификатор модели для версий кэшей"""
+        return f"{self.base_url}#{self.model or ''}"
+
+    def chat(
+        self,
+        system: str,
+        user: str,
+        json_schema: Optional[Dict] = None,
+        deadline: Optional[float] = None,
+        **generation_kwargs
+    ) -> str:
+        """
+        Генерирует ответ на одно сообщение пользователя
+
+        Args:
+            system: системное сообщение
+            user: сообщение пользователя
+            json_schema: JSON схема ответа (structured output сервера)
+            deadline: дедлайн по time.monotonic (None — без дедлайна)
+            **generation_kwargs: параметры в формате transformers generate
+                (max_new_tokens, temperature, top_p, do_sample)
+
+        Returns:
+            Текст ответа модели
+
+        Raises:
+            DeadlineExceeded: ответ не получен до дедлайна
+            LLMBackendError: сервер недоступен, вернул ошибку или не ответил
+                за timeout (без дедлайна)
+        """
+        payload = {
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user}
+            ],
+            "stream": True,
+            **self._sampling_params(generation_kwargs)
+        }
+        if self.model:
+            payload["model"] = self.model
+        if json_schema is not None:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "strict": True, "schema": json_schema}
+            }
+
+        # Ожидание свободного слота тоже входит в бюджет вызова
+        wait = self.timeout if deadline is None else max(deadline - time.monotonic(), 0.0)
+        if not self._slots.acquire(timeout=wait):
+            if deadline is None:
+                self._count(error=True)
+                raise LLMBackendError(f"Нет свободного слота LLM сервера за {self.timeout:g} с")
+            self._count(deadline_exceeded=True)
+            raise DeadlineExceeded("Нет свободного слота LLM сервера до дедлайна")
+
+        start = time.perf_counter()
+        with self._stats_lock:
+            self._in_flight += 1
+        try:
+            text = self._stream(payload, deadline)
+        except DeadlineExceeded:
+            self._count(deadline_exceeded=True)
+            raise
+        except LLMBackendError:
+            self._count(error=True)
+            raise
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+        self._count(seconds=time.perf_counter() - start)
+        return text
+
+    @staticmethod
+    def _sampling_params(generation_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Параметры transformers generate → параметры chat completions"""
+        params = {"max_tokens": generation_kwargs.get("max_new_tokens", 512)}
+        if generation_kwargs.get("do_sample", False):
+            params["temperature"] = generation_kwargs.get("temperature", 1.0)
+            params["top_p"] = generation_kwargs.get("top_p", 1.0)
+        else:
+            params["temperature"] = 0.0
+        return params
+
+    def _read_timeout(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Генерация LLM не уложилась в дедлайн")
+        return min(self.timeout, remaining)
+
+    def _timeout_error(self, deadline: Optional[float]) -> Exception:
+        """
+        Ошибка для таймаута сокета: DeadlineExceeded, только если истек дедлайн
+
+        Без дедлайна (или при таймауте соединения раньше дедлайна) сервер
+        считается недоступным — LLMBackendError.
+        """
+        if deadline is not None and time.monotonic() >= deadline:
+            return DeadlineExceeded("LLM сервер не ответил до дедлайна")
+        return LLMBackendError(f"LLM сервер {self.base_url} не ответил вовремя (таймаут {self.timeout:g} с)")
+
+    def _stream(self, payload: Dict, deadline: Optional[float]) -> str:
+        """Отправляет запрос и собирает ответ из server-sent events"""
+        import requests
+
+        read_timeout = self._read_timeout(deadline)
+        try:
+            response = self._session.post(
+                f"{self.base_url}/v1/chat/completions",
+                json=payload,
+                stream=True,
+                timeout=(min(CONNECT_TIMEOUT, read_timeout), read_timeout)
+            )
+        except requests.Timeout:
+            raise self._timeout_error(deadline)
+        except requests.RequestException as e:
+            raise LLMBackendError(f"LLM сервер {self.base_url} недоступен: {e}")
+
+        # Закрытие соединения посреди потока останавливает генерацию на сервере
+        with response:
+            if response.status_code != 200:
+                raise LLMBackendError(f"LLM сервер вернул {response.status_code}: {response.text[:200]}")
+
+            parts: List[str] = []
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise DeadlineExceeded("Генерация LLM не уложилась в дедлайн")
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    for choice in chunk.get("choices", []):
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            parts.append(content)
+            except requests.Timeout:
+                raise self._timeout_error(deadline)
+            except (requests.RequestException, ValueError) as e:
+                raise LLMBackendError(f"Обрыв ответа LLM сервера: {e}")
+
+        return "".join(parts)
+
+    def ping(self) -> bool:
+        """Доступен ли сервер (GET /v1/models)"""
+        import requests
+
+        try:
+            return self._session.get(f"{self.base_url}/v1/models", timeout=CONNECT_TIMEOUT).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _count(self, seconds: float = 0.0, error: bool = False, deadline_exceeded: bool = False):
+        with self._stats_lock:
+            self._requests += 1
+            self._errors += error
+            self._deadlines += deadline_exceeded
+            self._total_seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики запросов к серверу"""
+        with self._stats_lock:
+            succeeded = self._requests - self._errors - self._deadlines
+            return {
+                "base_url": self.base_url,
+                "model": self.model,
+                "requests": self._requests,
+                "errors": self._errors,
+                "deadline_exceeded": self._deadlines,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "avg_seconds": self._total_seconds / succeeded if succeeded else 0.0
+            }
+
+    def close(self):
+        """Закрывает пул соединений"""
+        self._session.close()
+
+
+_backends: Dict[Tuple[str, Optional[str]], OpenAICompatibleBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(base_url: str, model: Optional[str] = None) -> OpenAICompatibleBackend:
+    """
+    Общий клиент сервера (один пул соединений на адрес и модель)
+
+    Лимит параллельности — LLM_BACKEND_CONCURRENCY (по умолчанию
+    DEFAULT_CONCURRENCY).
+    """
+    key = (normalize_base_url(base_url), model)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            concurrency = int(os.environ.get("LLM_BACKEND_CONCURRENCY", DEFAULT_CONCURRENCY))
+            backend = OpenAICompatibleBackend(base_url, model=model, max_concurrency=concurrency)
+            _backends[key] = backend
+        return backend
+
+
+def backend_stats() -> List[Dict[str, Any]]:
+    """Метрики всех клиентов LLM серверов процесса"""
+    with _backends_lock:
+        backends = list(_backends.values())
+    return [backend.stats() for backend in backends]
@@ -1,13 +1,32 @@
 """
 Модуль для работы с LLM (Qwen) для генерации ответов
+
+Выбор товаров из кандидатов (select_products) по умолчанию идет без
+генерации: для каждой пары (запрос, кандидат) LLM отвечает "Да"/"Нет", и
+по логитам следующего токена за один прямой проход на батч считается
+вероятность "Да". Кандидаты с вероятностью не ниже порога возвращаются по
+убыванию вероятности. Режим "generate" — прежний: модель пишет номера
+товаров через запятую.
 """
 
+import math
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
 from typing import List, Dict, Optional
 import json
 import re
 
+from src.model_registry import acquire_model
+from src.llm_scheduler import DeadlineExceeded, deadline_after, describe_budget, get_scheduler, render_chat
+
+
+# Режимы выбора товаров: оценка по логитам или генерация номеров
+SELECTION_MODES = ("score", "generate")
+
+SCORING_SYSTEM_PROMPT = "Ты - ассистент для поиска строительных материалов и комплектующих."
+
+# Варианты ответа при оценке; сравниваются логиты их первых токенов
+SCORING_ANSWERS = ("Да", "Нет")
+
 
 class LLMGenerator:
     """Класс для генерации ответов с помощью Qwen LLM"""
@@ -15,7 +34,11 @@ class LLMGenerator:
     def __init__(
         self,
         model_path: str = "./Qwen/Qwen3-4B-Instruct-2507",
-        device: str = None
+        device: str = None,
+        dtype: Optional[str] = None,
+        deadline_seconds: Optional[float] = None,
+        selection_mode: str = "score",
+        score_threshold: float = 0.5
     ):
         """
         Инициализация LLM
@@ -23,8 +46,25 @@ class LLMGenerator:
         Args:
             model_path: путь к модели Qwen
             device: устройство (cuda/cpu/mps)
+            dtype: точность весов ('float32' / 'bfloat16' / 'int8' на CPU) или None
+                (LLM_CPU_DTYPE / по устройству, см. model_registry)
+            deadline_seconds: бюджет времени на select_products (None = без ограничения)
+            selection_mode: "score" — ранжирование кандидатов по вероятности
+                ответа "Да" (один прямой проход), "generate" — генерация номеров
+            score_threshold: минимальная вероятность "Да" (среди "Да"/"Нет")
+                для выбора кандидата в режиме "score"
+        
+        Raises:
+            ValueError: неизвестный selection_mode
         """
+        if selection_mode not in SELECTION_MODES:
+            raise ValueError(f"Неизвестный selection_mode: {selection_mode} (допустимые: {', '.join(SELECTION_MODES)})")
+        
         self.model_path = model_path
+        self.deadline_seconds = deadline_seconds
+        self.selection_mode = selection_mode
+        self.score_threshold = score_threshold
+        self._answer_token_ids = None
         
         # Определяем устройство
         if device is None:
@@ -39,25 +79,20 @@ class LLMGenerator:
         
         print(f"Загрузка модели с {model_path} на {self.device}...")
         
-        # Загружаем токенайзер и модель
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            model_path,
-            trust_remote_code=True
-        )
-        
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16 if self.device != "cpu" else torch.float32,
-            device_map="auto" if self.device != "cpu" else None,
-            trust_remote_code=True
-        )
-        
-        if self.device == "cpu":
-            self.model = self.model.to(self.device)
-        
-        self.model.eval()
+        # Модель и токенайзер из общего реестра (одна копия на процесс)
+        self._model_handle = acquire_model(model_path, device=self.device, dtype=dtype)
+        self.model = self._model_handle.model
+        self.tokenizer = self._model_handle.tokenizer
         print("Модель загружена успешно!")
     
+    def close(self):
+        """Освобождает ссылку на модель в реестре"""
+        if self._model_handle is not None:
+            self._model_handle.release()
+            self._model_handle = None
+        self.model = None
+        self.tokenizer = None
+    
     def create_prompt(
         self,
         query: str,
@@ -106,11 +141,75 @@ class LLMGenerator:
         
         return prompt
     
+    def create_scoring_prompt(self, query: str, candidate: Dict) -> str:
+        """
+        Промпт оценки одного кандидата (в chat template, ответ — "Да" или "Нет")
+        
+        Args:
+            query: запрос пользователя
+            candidate: товар из векторного поиска
+            
+        Returns:
+            str: промпт для модели
+        """
+        name = candidate.get('name', '')
+        category = candidate.get('category', '')
+        price = candidate.get('price', candidate.get('cost', 0))
+        user = f"""Запрос пользователя: "{query}"
+
+Товар: {name}
+Категория: {category}
+Цена: {price} руб.
+
+Подходит ли этот товар под запрос (сам запрошенный товар или необходимый компонент запрошенного комплекта)?
+Ответь одним словом: Да или Нет."""
+        return render_chat(self.tokenizer, SCORING_SYSTEM_PROMPT, user)
+    
+    def _scoring_token_ids(self) -> tuple:
+        """Первые токены ответов SCORING_ANSWERS ("Да", "Нет")"""
+        if self._answer_token_ids is None:
+            self._answer_token_ids = tuple(
+                self.tokenizer.encode(answer, add_special_tokens=False)[0]
+                for answer in SCORING_ANSWERS
+            )
+        return self._answer_token_ids
+    
+    def score_candidates(
+        self,
+        query: str,
+        candidates: List[Dict],
+        deadline: Optional[float] = None
+    ) -> List[float]:
+        """
+        Вероятность того, что кандидат подходит под запрос
+        
+        Все пары (запрос, кандидат) оцениваются батчами за один прямой
+        проход без генерации (см. LLMScheduler.score).
+        
+        Args:
+            query: запрос пользователя
+            candidates: кандидаты
+            deadline: дедлайн по time.monotonic() (см. llm_scheduler.deadline_after)
+            
+        Returns:
+            List[float]: P("Да") / (P("Да") + P("Нет")) для каждого кандидата
+        
+        Raises:
+            DeadlineExceeded: оценка не получена до дедлайна
+        """
+        prompts = [self.create_scoring_prompt(query, candidate) for candidate in candidates]
+        log_probs = get_scheduler(self.model, self.tokenizer).score(
+            prompts, self._scoring_token_ids(), max_length=4096, deadline=deadline
+        )
+        # Сигмоида разности log-вероятностей = нормировка на два ответа
+        return [1.0 / (1.0 + math.exp(no - yes)) for yes, no in log_probs]
+    
     def generate(
         self,
         prompt: str,
         max_new_tokens: int = 100,
-        temperature: float = 0.1
+        temperature: float = 0.1,
+        deadline: Optional[float] = None
     ) -> str:
         """
         Генерирует ответ от LLM
@@ -119,33 +218,24 @@ class LLMGenerator:
             prompt: промпт для модели
             max_new_tokens: максимальное количество токенов
             temperature: температура генерации
+            deadline: дедлайн по time.monotonic() (см. llm_scheduler.deadline_after)
             
         Returns:
             str: сгенерированный текст
+        
+        Raises:
+            DeadlineExceeded: ответ не получен до дедлайна
         """
-        # Токенизация
-        inputs = self.tokenizer(
+        # Генерация через общий планировщик: параллельные запросы идут одним батчем
+        generated_text = get_scheduler(self.model, self.tokenizer).generate(
             prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=4096
-        ).to(self.device)
-        
-        # Генерация
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                do_sample=temperature > 0,
-                top_p=0.9,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
-        
-        # Декодирование
-        generated_text = self.tokenizer.decode(
-            outputs[0][inputs['input_ids'].shape[1]:],
-            skip_special_tokens=True
+            max_length=4096,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            do_sample=temperature > 0,
+            top_p=0.9,
+            pad_token_id=self.tokenizer.eos_token_id,
+            deadline=deadline
         )
         
         return generated_text.strip()
@@ -175,27 +265,52 @@ class LLMGenerator:
         self,
         query: str,
         candidates: List[Dict],
-        max_candidates: int = 10
+        max_candidates: int = 10,
+        deadline_seconds: Optional[float] = None
     ) -> List[Dict]:
         """
         Выбирает подходящие товары с помощью LLM
         
+        В режиме "score" кандидаты ранжируются по вероятности ответа "Да"
+        (один прямой проход вместо генерации), иначе LLM генерирует номера
+        выбранных товаров.
+        
         Args:
             query: запрос пользователя
             candidates: список кандидатов
             max_candidates: максимальное количество кандидатов
+            deadline_seconds: бюджет времени на выбор (None = self.deadline_seconds)
             
         Returns:
-            List[Dict]: выбранные товары
+            List[Dict]: выбранные товары; пустой список, если LLM не
+            уложилась в бюджет (вызывающий код берет результаты поиска)
         """
         if not candidates:
             return []
         
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        deadline = deadline_after(deadline_seconds)
+        
+        if self.selection_mode == "score":
+            candidates = candidates[:max_candidates]
+            try:
+                scores = self.score_candidates(query, candidates, deadline=deadline)
+            except DeadlineExceeded:
+                print(f"⏱️ LLM не уложилась в {describe_budget(deadline_seconds)}, выбор по результатам поиска")
+                return []
+            ranked = sorted(zip(candidates, scores), key=lambda pair: -pair[1])
+            return [candidate for candidate, score in ranked if score >= self.score_threshold]
+        
         # Создаем промпт
         prompt = self.create_prompt(query, candidates, max_candidates)
         
         # Генерируем ответ
-        llm_response = self.generate(prompt)
+        try:
+            llm_response = self.generate(prompt, deadline=deadline)
+        except DeadlineExceeded:
+            print(f"⏱️ LLM не уложилась в {describe_budget(deadline_seconds)}, выбор по результатам поиска")
+            return []
         
         # Извлекаем индексы
         selected_indices = self.extract_selected_indices(llm_response)
@@ -7,22 +7,75 @@ import re
 from typing import List, Dict, Optional
 from pathlib import Path
 
+from src.llm_scheduler import DeadlineExceeded, deadline_after, describe_budget, get_scheduler, render_chat
+
+
+DECOMPOSITION_SYSTEM_PROMPT = "Ты - помощник для разбиения запросов на компоненты."
+
+# Статическая часть промпта декомпозиции (запрос дописывается в конец).
+# KV-кэш этого блока считается один раз на модель.
+DECOMPOSITION_INSTRUCTIONS = """Ты - эксперт по анализу запросов на поиск строительных материалов.
+
+Задача: разбей сложный запрос на отдельные компоненты для поиска.
+
+Правила:
+1. Извлеки каждый отдельный товар из запроса
+2. Сохрани важные параметры (размеры, материал)
+3. Для крепежа (винты, гайки) используй стандартные обозначения (М6, М8, М10)
+4. Верни результат в виде JSON списка строк
+
+Пример 1:
+Запрос: "Комплект для монтажа короба 200x200: короб, крышка, винты и гайки"
+Результат: ["Короб 200x200", "Крышка 200", "Винт М6", "Гайка М6"]
+
+Пример 2:
+Запрос: "Лоток перфорированный 600 мм"
+Результат: ["Лоток перфорированный 600 мм"]
+
+Пример 3:
+Запрос: "Гайка М6"
+Результат: ["Гайка М6"]
+
+Запрос: """
+
+DECOMPOSITION_GENERATION_KWARGS = {
+    "max_new_tokens": 256,
+    "temperature": 0.1,
+    "do_sample": False,
+}
+
 
 class LLMQueryPreprocessor:
     """
     Использует LLM для разбиения сложных запросов на компоненты
     """
     
-    def __init__(self, model_path: str = "./Qwen/Qwen3-4B-Instruct-2507", use_llm: bool = True):
+    def __init__(
+        self,
+        model_path: str = "./Qwen/Qwen3-4B-Instruct-2507",
+        use_llm: bool = True,
+        use_prefix_cache: bool = True,
+        dtype: Optional[str] = None,
+        deadline_seconds: Optional[float] = None
+    ):
         """
         Args:
             model_path: путь к модели Qwen
             use_llm: пытаться ли загружать LLM (False = сразу использовать простой парсер)
+            use_prefix_cache: переиспользовать KV-кэш статической части промпта
+            dtype: точность весов ('float32' / 'bfloat16' / 'int8' на CPU) или None
+                (LLM_CPU_DTYPE / по устройству, см. model_registry)
+            deadline_seconds: бюджет времени на декомпозицию; если LLM не
+                успевает, используется простой парсер (None = без ограничения)
         """
         self.model_path = Path(model_path)
         self.model = None
         self.tokenizer = None
+        self._model_handle = None
         self.use_llm = use_llm
+        self.use_prefix_cache = use_prefix_cache
+        self.dtype = dtype
+        self.deadline_seconds = deadline_seconds
         
         if use_llm:
             self._load_model()
@@ -39,31 +92,15 @@ class LLMQueryPreprocessor:
             return
         
         try:
-            from transformers import AutoModelForCausalLM, AutoTokenizer
-            import torch
+            from src.model_registry import acquire_model
             
             print(f"Загрузка LLM модели из {self.model_path}...")
             
-            # Сначала пытаемся загрузить токенизатор
-            try:
-                self.tokenizer = AutoTokenizer.from_pretrained(
-                    str(self.model_path),
-                    trust_remote_code=True
-                )
-                print("✓ Токенизатор загружен")
-            except Exception as e:
-                print(f"⚠️ Ошибка загрузки токенизатора: {e}")
-                raise
-            
-            # Затем загружаем модель
+            # Модель из общего реестра: другие LLM компоненты используют ту же копию
             try:
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    str(self.model_path),
-                    device_map="cpu",
-                    torch_dtype=torch.float32,
-                    trust_remote_code=True,
-                    low_cpu_mem_usage=True
-                )
+                self._model_handle = acquire_model(self.model_path, device="cpu", dtype=self.dtype)
+                self.model = self._model_handle.model
+                self.tokenizer = self._model_handle.tokenizer
                 print("✓ LLM модель загружена успешно")
             except Exception as e:
                 print(f"⚠️ Ошибка загрузки модели: {e}")
@@ -100,12 +137,21 @@ class LLMQueryPreprocessor:
             self.model = None
             self.tokenizer = None
     
-    def decompose_query(self, query: str) -> List[str]:
+    def close(self):
+        """Освобождает ссылку на модель в реестре"""
+        if self._model_handle is not None:
+            self._model_handle.release()
+            self._model_handle = None
+        self.model = None
+        self.tokenizer = None
+    
+    def decompose_query(self, query: str, deadline_seconds: Optional[float] = None) -> List[str]:
         """
         Разбивает запрос на компоненты используя LLM
         
         Args:
             query: исходный запрос
+            deadline_seconds: бюджет времени на этот вызов (None = self.deadline_seconds)
             
         Returns:
             List[str]: список компонентов
@@ -114,60 +160,11 @@ class LLMQueryPreprocessor:
         if self.model is None or self.tokenizer is None:
             return self._simple_decompose(query)
         
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        
         try:
-            # Промпт для LLM
-            prompt = f"""Ты - эксперт по анализу запросов на поиск строительных материалов.
-
-Задача: разбей сложный запрос на отдельные компоненты для поиска.
-
-Правила:
-1. Извлеки каждый отдельный товар из запроса
-2. Сохрани важные параметры (размеры, материал)
-3. Для крепежа (винты, гайки) используй стандартные обозначения (М6, М8, М10)
-4. Верни результат в виде JSON списка строк
-
-Пример 1:
-Запрос: "Комплект для монтажа короба 200x200: короб, крышка, винты и гайки"
-Результат: ["Короб 200x200", "Крышка 200", "Винт М6", "Гайка М6"]
-
-Пример 2:
-Запрос: "Лоток перфорированный 600 мм"
-Результат: ["Лоток перфорированный 600 мм"]
-
-Пример 3:
-Запрос: "Гайка М6"
-Результат: ["Гайка М6"]
-
-Запрос: "{query}"
-Результат:"""
-
-            # Генерация
-            messages = [
-                {"role": "system", "content": "Ты - помощник для разбиения запросов на компоненты."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-            
-            generated_ids = self.model.generate(
-                **model_inputs,
-                max_new_tokens=256,
-                temperature=0.1,
-                do_sample=False
-            )
-            
-            generated_ids = [
-                output_ids[len(input_ids):] 
-                for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-            ]
-            
-            response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+            response = self._generate(f"\"{query}\"\nРезультат:", deadline=deadline_after(deadline_seconds))
             
             # Парсим JSON ответ
             components = self._parse_llm_response(response)
@@ -182,11 +179,33 @@ class LLMQueryPreprocessor:
                 print("⚠️ LLM не смог распарсить ответ, используется простой парсер")
                 return self._simple_decompose(query)
                 
+        except DeadlineExceeded:
+            print(f"⏱️ LLM не уложилась в {describe_budget(deadline_seconds)}, используется простой парсер")
+            return self._simple_decompose(query)
         except Exception as e:
             print(f"⚠️ Ошибка при использовании LLM для декомпозиции: {e}")
             print("Переключение на простой парсер...")
             return self._simple_decompose(query)
     
+    def _generate(self, variable_part: str, deadline: Optional[float] = None) -> str:
+        """
+        Генерирует ответ на промпт декомпозиции через общий планировщик модели
+        
+        Параллельные запросы объединяются в батч (см. llm_scheduler); если
+        запрос один, KV-кэш инструкций с примерами берется готовым (см.
+        prefix_cache).
+        """
+        prefix_parts = (
+            (DECOMPOSITION_SYSTEM_PROMPT, DECOMPOSITION_INSTRUCTIONS, variable_part)
+            if self.use_prefix_cache else None
+        )
+        return get_scheduler(self.model, self.tokenizer).generate(
+            render_chat(self.tokenizer, DECOMPOSITION_SYSTEM_PROMPT, DECOMPOSITION_INSTRUCTIONS + variable_part),
+            prefix_parts=prefix_parts,
+            deadline=deadline,
+            **DECOMPOSITION_GENERATION_KWARGS
+        )
+    
     def _parse_llm_response(self, response: str) -> Optional[List[str]]:
         """Парсит ответ LLM"""
         try:
@@ -3,10 +3,101 @@ LLM-парсер запросов: анализирует запрос и выд
 """
 
 import json
+import os
 import re
 from typing import List, Dict, Optional
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
+
+from src.llm_backend import LLMBackendError, get_backend
+from src.model_registry import acquire_model, normalize_model_path
+from src.parse_cache import ParseCache, make_version
+from src.llm_scheduler import (
+    DeadlineExceeded, attach_draft_model, deadline_after, describe_budget, get_scheduler, render_chat
+)
+
+
+SYSTEM_PROMPT = "Ты - эксперт по анализу запросов для поиска товаров. Отвечаешь только в формате JSON."
+
+# Статические инструкции промпта; запрос пользователя дописывается в конец.
+# KV-кэш системного сообщения и этого блока считается один раз на модель.
+PROMPT_INSTRUCTIONS = """Ты - эксперт по анализу запросов для поиска электротехнической продукции.
+
+Твоя задача: разобрать запрос пользователя и выдать структурированный список товаров с количеством.
+
+ПРАВИЛА:
+1. Определи ВСЕ товары, которые нужны пользователю
+2. Укажи точное количество каждого товара
+3. Определи top_k (количество альтернатив для поиска, 1-10):
+   - Для товаров с точными размерами и спецификациями: 2-3
+   - Для стандартного крепежа (винты, гайки, шайбы): 5-7
+   - Для общих запросов без точных характеристик: 3-5
+4. Для комплектов монтажа используй стандарты:
+   - Короб/лоток: 1 шт, top_k: 3
+   - Крышка: 1 шт, top_k: 3
+   - Винты: 4 шт, top_k: 5 (стандарт для монтажа)
+   - Гайки: 4 шт, top_k: 5 (если нужны)
+   - Шайбы: 4 шт, top_k: 5 (если нужны)
+5. Сохраняй спецификации (размеры, резьбу, материал)
+
+ФОРМАТ ОТВЕТА (только JSON, без дополнительного текста):
+{
+    "items": [
+        {"name": "название товара", "quantity": число, "specifications": "технические характеристики", "top_k": 1-10},
+        ...
+    ],
+    "confidence": 0.0-1.0,
+    "analysis": "краткий анализ запроса"
+}
+
+ЗАПРОС ПОЛЬЗОВАТЕЛЯ:
+"""
+
+# Максимум позиций в разборе одного запроса
+MAX_REQUEST_ITEMS = 20
+
+# Допустимые значения top_k и quantity (ограничиваются схемой и после разбора)
+MIN_TOP_K, MAX_TOP_K = 1, 10
+MIN_QUANTITY, MAX_QUANTITY = 1, 1_000_000
+
+# Схема ответа для constrained decoding (повторяет ФОРМАТ ОТВЕТА из инструкций)
+REQUEST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": MAX_REQUEST_ITEMS,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "maxLength": 200},
+                    "quantity": {"type": "integer", "minimum": MIN_QUANTITY, "maximum": MAX_QUANTITY},
+                    "specifications": {"type": "string", "maxLength": 200},
+                    "top_k": {"type": "integer", "minimum": MIN_TOP_K, "maximum": MAX_TOP_K}
+                },
+                "required": ["name", "quantity", "top_k"]
+            }
+        },
+        "confidence": {"type": "number"},
+        "analysis": {"type": "string", "maxLength": 300}
+    },
+    "required": ["items"]
+}
+
+# Параметры генерации (входят в версию кэша разбора). Жадное декодирование:
+# разбор кэшируется на диске, и один запрос должен всегда давать один ответ
+GENERATION_KWARGS = {
+    "max_new_tokens": 512,
+    "do_sample": False,
+}
+
+
+def _clamp_int(value, low: int, high: int, default: int) -> int:
+    """Целое значение поля в пределах [low, high] (default, если это не число)"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    return min(max(value, low), high)
 
 
 class LLMRequestParser:
@@ -32,7 +123,16 @@ class LLMRequestParser:
     def __init__(
         self,
         model_path: str = "Qwen/Qwen3-4B-Instruct-2507",
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        parse_cache_path: Optional[str] = "data/cache/parse_cache.sqlite",
+        parse_cache_ttl: float = 7 * 24 * 3600,
+        use_prefix_cache: bool = True,
+        use_constrained_decoding: bool = True,
+        dtype: Optional[str] = None,
+        deadline_seconds: Optional[float] = None,
+        draft_model_path: Optional[str] = None,
+        backend_url: Optional[str] = None,
+        backend_model: Optional[str] = None
     ):
         """
         Инициализация LLM парсера
@@ -40,14 +140,65 @@ class LLMRequestParser:
         Args:
             model_path: путь к LLM модели
             device: устройство ('cuda', 'mps', 'cpu') или None для автоопределения
+            parse_cache_path: файл персистентного кэша разборов (None = без кэша)
+            parse_cache_ttl: время жизни записи кэша в секундах
+            use_prefix_cache: переиспользовать KV-кэш статической части промпта
+            use_constrained_decoding: генерировать только JSON схемы REQUEST_SCHEMA
+                с остановкой после закрытия корневого объекта
+            dtype: точность весов ('float32' / 'bfloat16' / 'int8' на CPU) или None
+                (LLM_CPU_DTYPE / по устройству, см. model_registry)
+            deadline_seconds: бюджет времени на разбор одного запроса; если
+                LLM не успевает, возвращается эвристический разбор (None = без ограничения)
+            draft_model_path: малая модель того же семейства для speculative decoding
+                (по умолчанию LLM_DRAFT_MODEL; None = без draft модели)
+            backend_url: адрес OpenAI-совместимого сервера (по умолчанию
+                LLM_BACKEND_URL); если задан, модель в процесс не загружается
+                (см. llm_backend)
+            backend_model: имя модели на сервере (по умолчанию LLM_BACKEND_MODEL)
         """
         self.model_path = model_path
-        self.device = self._detect_device(device)
+        self.draft_model_path = draft_model_path or os.environ.get("LLM_DRAFT_MODEL")
+        self.dtype = dtype
+        self.deadline_seconds = deadline_seconds
+        self.use_prefix_cache = use_prefix_cache
+        self.use_constrained_decoding = use_constrained_decoding
         self.model = None
         self.tokenizer = None
+        self._model_handle = None
+        self._draft_handle = None
         
-        print(f"🖥️  Используется устройство: {self.device}")
-        self._load_model()
+        backend_url = backend_url or os.environ.get("LLM_BACKEND_URL")
+        self.backend = None
+        if backend_url:
+            self.backend = get_backend(backend_url, backend_model or os.environ.get("LLM_BACKEND_MODEL"))
+            self.device = "remote"
+            print(f"✓ LLM парсер: сервер {self.backend.base_url}")
+        else:
+            self.device = self._detect_device(device)
+            print(f"🖥️  Используется устройство: {self.device}")
+            self._load_model()
+        
+        self.parse_cache = None
+        if parse_cache_path:
+            self.parse_cache = ParseCache(
+                parse_cache_path,
+                version=self.cache_version(),
+                ttl_seconds=parse_cache_ttl
+            )
+    
+    def cache_version(self) -> str:
+        """
+        Версия для ключа кэша разборов: модель, текст промпта, параметры генерации и схема
+        
+        Любая правка _build_prompt, SYSTEM_PROMPT или REQUEST_SCHEMA меняет версию.
+        """
+        return make_version(
+            self.backend.model_id if self.backend else normalize_model_path(self.model_path),
+            SYSTEM_PROMPT,
+            self._build_prompt("{user_query}"),
+            json.dumps(GENERATION_KWARGS, sort_keys=True),
+            json.dumps(REQUEST_SCHEMA, sort_keys=True) if self.use_constrained_decoding else ""
+        )
     
     def _detect_device(self, device: Optional[str] = None) -> str:
         """
@@ -64,6 +215,8 @@ class LLMRequestParser:
         if device:
             return device
         
+        import torch
+        
         # Проверяем CUDA (NVIDIA GPU)
         if torch.cuda.is_available():
             print("✓ Обнаружена CUDA (NVIDIA GPU)")
@@ -79,61 +232,84 @@ class LLMRequestParser:
         return "cpu"
     
     def _load_model(self):
-        """Загружает LLM модель с поддержкой CUDA/MPS/CPU"""
+        """Получает LLM модель из общего реестра (float16 на GPU, на CPU — self.dtype или float32)"""
         print(f"Загрузка LLM парсера из {self.model_path}...")
         
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.model_path,
-            trust_remote_code=True
-        )
-        print("✓ Токенизатор загружен")
-        
-        # Определяем dtype в зависимости от устройства
-        if self.device == "cuda":
-            torch_dtype = torch.float16
-            device_map = "auto"
-        elif self.device == "mps":
-            torch_dtype = torch.float16
-            device_map = None
-        else:  # CPU
-            torch_dtype = torch.float32
-            device_map = None
-        
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_path,
-            device_map=device_map if self.device == "cuda" else None,
-            torch_dtype=torch_dtype,
-            trust_remote_code=True
-        )
-        
-        # Явно переносим на устройство если не используем device_map
-        if self.device != "cuda":
-            self.model = self.model.to(self.device)
+        self._model_handle = acquire_model(self.model_path, device=self.device, dtype=self.dtype)
+        self.model = self._model_handle.model
+        self.tokenizer = self._model_handle.tokenizer
         
         print(f"✓ LLM парсер загружен на {self.device}")
+        
+        if self.draft_model_path:
+            try:
+                self._draft_handle = attach_draft_model(
+                    self.model, self.tokenizer, self.draft_model_path,
+                    device=self.device, dtype=self.dtype
+                )
+            except Exception as e:
+                print(f"⚠️ Не удалось загрузить draft модель {self.draft_model_path}: {e}")
     
-    def parse_request(self, user_query: str) -> Dict:
+    def close(self):
+        """Освобождает ссылки на модели в реестре"""
+        if self._draft_handle is not None:
+            self._draft_handle.release()
+            self._draft_handle = None
+        if self._model_handle is not None:
+            self._model_handle.release()
+            self._model_handle = None
+        self.model = None
+        self.tokenizer = None
+        self.backend = None  # Клиент сервера общий для процесса, не закрывается
+    
+    def parse_request(self, user_query: str, deadline_seconds: Optional[float] = None) -> Dict:
         """
         Парсит запрос пользователя и возвращает структурированный список товаров
         
         Args:
             user_query: запрос пользователя
+            deadline_seconds: бюджет времени на этот вызов (None = self.deadline_seconds)
             
         Returns:
             Dict с ключами:
                 - items: List[Dict] - список товаров с количеством
                 - confidence: float - уверенность в разборе (0-1)
                 - analysis: str - краткий анализ запроса
+                - fallback: "deadline" - только если LLM не уложилась в бюджет
+                  и разбор эвристический; "backend" - LLM сервер недоступен
         """
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        deadline = deadline_after(deadline_seconds)
+        
+        if self.parse_cache is not None:
+            cached = self.parse_cache.get(user_query)
+            if cached is not None:
+                return cached
+        
         prompt = self._build_prompt(user_query)
         
         # Генерация ответа от LLM
-        response = self._generate(prompt)
+        try:
+            response = self._generate(prompt, deadline=deadline)
+        except DeadlineExceeded:
+            print(f"⏱️ LLM не уложилась в {describe_budget(deadline_seconds)}, эвристический разбор")
+            result = self._heuristic_parse(user_query)
+            result['fallback'] = 'deadline'
+            return result
+        except LLMBackendError as e:
+            print(f"⚠️ {e}, эвристический разбор")
+            result = self._heuristic_parse(user_query)
+            result['fallback'] = 'backend'
+            return result
         
         # Парсинг JSON из ответа
         parsed = self._parse_response(response)
         
         if parsed:
+            # В кэш попадает только проверенный ответ LLM, не эвристика
+            if self.parse_cache is not None:
+                self.parse_cache.put(user_query, parsed)
             return parsed
         else:
             # Fallback: эвристический парсинг
@@ -141,88 +317,80 @@ class LLMRequestParser:
     
     def _build_prompt(self, user_query: str) -> str:
         """Создает промпт для LLM"""
-        prompt = f"""Ты - эксперт по анализу запросов для поиска электротехнической продукции.
-
-Твоя задача: разобрать запрос пользователя и выдать структурированный список товаров с количеством.
-
-ПРАВИЛА:
-1. Определи ВСЕ товары, которые нужны пользователю
-2. Укажи точное количество каждого товара
-3. Определи top_k (количество альтернатив для поиска, 1-10):
-   - Для товаров с точными размерами и спецификациями: 2-3
-   - Для стандартного крепежа (винты, гайки, шайбы): 5-7
-   - Для общих запросов без точных характеристик: 3-5
-4. Для комплектов монтажа используй стандарты:
-   - Короб/лоток: 1 шт, top_k: 3
-   - Крышка: 1 шт, top_k: 3
-   - Винты: 4 шт, top_k: 5 (стандарт для монтажа)
-   - Гайки: 4 шт, top_k: 5 (если нужны)
-   - Шайбы: 4 шт, top_k: 5 (если нужны)
-5. Сохраняй спецификации (размеры, резьбу, материал)
-
-ФОРМАТ ОТВЕТА (только JSON, без дополнительного текста):
-{{
-    "items": [
-        {{"name": "название товара", "quantity": число, "specifications": "технические характеристики", "top_k": 1-10}},
-        ...
-    ],
-    "confidence": 0.0-1.0,
-    "analysis": "краткий анализ запроса"
-}}
-
-ЗАПРОС ПОЛЬЗОВАТЕЛЯ:
-{user_query}
+        return PROMPT_INSTRUCTIONS + self._prompt_suffix(user_query)
+    
+    @staticmethod
+    def _prompt_suffix(user_query: str) -> str:
+        """Переменная часть промпта (после статических инструкций)"""
+        return f"""{user_query}
 
 ОТВЕТ (только JSON):"""
-        
-        return prompt
     
-    def _generate(self, prompt: str) -> str:
-        """Генерирует ответ от LLM"""
-        messages = [
-            {"role": "system", "content": "Ты - эксперт по анализу запросов для поиска товаров. Отвечаешь только в формате JSON."},
-            {"role": "user", "content": prompt}
-        ]
+    def _generate(self, prompt: str, deadline: Optional[float] = None) -> str:
+        """
+        Генерирует ответ от LLM через общий планировщик модели
         
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
+        Параллельные запросы объединяются в батч (см. llm_scheduler). Если
+        запрос в батче один и prompt начинается со статических инструкций,
+        KV-кэш системного сообщения и инструкций берется готовым (см.
+        prefix_cache), и prefill выполняется только для запроса пользователя.
         
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.device)
+        С constrained decoding модель может выдать только JSON по
+        REQUEST_SCHEMA и останавливается сразу после закрывающей скобки.
         
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=512,
-            temperature=0.3,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=self.tokenizer.eos_token_id
-        )
+        С удаленным бэкендом запрос уходит на OpenAI-совместимый сервер,
+        а схема ответа передается ему как structured output.
         
-        generated_ids = [
-            output_ids[len(input_ids):] 
-            for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
+        Raises:
+            DeadlineExceeded: ответ не получен до deadline (time.monotonic)
+            LLMBackendError: сервер недоступен или вернул ошибку
+        """
+        json_schema = REQUEST_SCHEMA if self.use_constrained_decoding else None
+        if self.backend is not None:
+            return self.backend.chat(
+                SYSTEM_PROMPT, prompt, json_schema=json_schema, deadline=deadline, **GENERATION_KWARGS
+            )
+        
+        prefix_parts = None
+        if self.use_prefix_cache and prompt.startswith(PROMPT_INSTRUCTIONS):
+            prefix_parts = (SYSTEM_PROMPT, PROMPT_INSTRUCTIONS, prompt[len(PROMPT_INSTRUCTIONS):])
         
-        response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        return response
+        return get_scheduler(self.model, self.tokenizer).generate(
+            render_chat(self.tokenizer, SYSTEM_PROMPT, prompt),
+            prefix_parts=prefix_parts,
+            json_schema=json_schema,
+            deadline=deadline,
+            **GENERATION_KWARGS,
+            pad_token_id=self.tokenizer.eos_token_id
+        )
     
     def _parse_response(self, response: str) -> Optional[Dict]:
-        """Парсит JSON из ответа LLM"""
+        """
+        Парсит JSON из ответа LLM
+        
+        С constrained decoding ответ — это сам JSON по REQUEST_SCHEMA и
+        разбирается целиком; иначе JSON ищется в тексте ответа. Ответ,
+        обрезанный по max_new_tokens, не разбирается (None). top_k и
+        quantity приводятся к пределам схемы: сервер или ответ без
+        constrained decoding может их нарушить.
+        """
         try:
-            # Ищем JSON в ответе
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(0))
-                
+            if self.use_constrained_decoding:
+                data = json.loads(response)
+            else:
+                # Ищем JSON в ответе
+                json_match = re.search(r'\{.*\}', response, re.DOTALL)
+                data = json.loads(json_match.group(0)) if json_match else None
+            
+            if isinstance(data, dict):
                 # Валидация структуры
                 if 'items' in data and isinstance(data['items'], list):
                     # Проверяем каждый товар
                     for item in data['items']:
-                        if 'name' not in item or 'quantity' not in item:
+                        if not isinstance(item, dict) or 'name' not in item or 'quantity' not in item:
                             return None
+                        item['quantity'] = _clamp_int(item['quantity'], MIN_QUANTITY, MAX_QUANTITY, 1)
+                        item['top_k'] = _clamp_int(item.get('top_k'), MIN_TOP_K, MAX_TOP_K, 3)
                     
                     return data
             
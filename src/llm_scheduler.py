@@ -0,0 +1,509 @@
+"""
+Планировщик генерации LLM с динамическим батчингом
+
+Каждый вызов model.generate с батчем из одного промпта на CPU сводится к
+умножениям матрицы на вектор, а параллельные пользователи ждут друг друга.
+Планировщик собирает ожидающие промпты от LLMRequestParser, LLMValidator,
+LLMQueryPreprocessor и LLMGenerator в батчи с левым паддингом и выполняет
+их в отдельном потоке; результат каждого вызова возвращается через Future.
+
+Одиночный запрос (в очереди больше никого нет) выполняется с
+переиспользованием KV-кэша статического префикса (см. prefix_cache).
+
+Если к планировщику подключена draft модель (set_draft_model), одиночные
+запросы генерируются через assisted (speculative) decoding: маленькая
+модель того же семейства предлагает токены, основная проверяет их за один
+проход. При жадной генерации результат совпадает с обычной генерацией.
+
+Кроме генерации планировщик выполняет оценку (score): для каждого промпта
+один прямой проход без цикла декодирования и log-вероятности заданных
+токенов в следующей позиции (например, "Да" / "Нет" для ранжирования
+кандидатов). Такие запросы батчатся так же, как генерация.
+
+У запроса может быть дедлайн (time.monotonic()): запрос, не начавший
+выполняться до дедлайна, отменяется, генерация батча останавливается,
+когда истекли дедлайны всех его запросов, а generate() возвращает
+управление вызывающему коду вовремя, выбрасывая DeadlineExceeded.
+"""
+
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.json_constraint import json_logits_processor
+from src.prefix_cache import generate_with_prefix
+
+
+class DeadlineExceeded(TimeoutError):
+    """Генерация не уложилась в дедлайн вызова"""
+
+
+def deadline_after(seconds: Optional[float]) -> Optional[float]:
+    """Дедлайн (по time.monotonic) через seconds секунд; None — без дедлайна"""
+    return None if seconds is None else time.monotonic() + seconds
+
+
+def describe_budget(seconds: Optional[float]) -> str:
+    """Бюджет времени для сообщений в лог ("2.5 с"; без дедлайна — таймаут бэкенда)"""
+    return "отведенное время" if seconds is None else f"{seconds:.1f} с"
+
+
+class _DeadlineCriteria:
+    """StoppingCriteria: останавливает генерацию по истечении дедлайна"""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+
+    def __call__(self, input_ids: Any, scores: Any, **kwargs) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+@dataclass
+class GenerationRequest:
+    """Промпт, ожидающий генерации"""
+    text: str
+    generate_kwargs: Dict[str, Any]
+    # (system, static_user, variable_user) для генерации с кэшем префикса
+    prefix_parts: Optional[Tuple[str, str, str]] = None
+    max_length: Optional[int] = None
+    # Схема JSON ответа для constrained decoding (см. json_constraint)
+    json_schema: Optional[Dict[str, Any]] = None
+    # Дедлайн по time.monotonic(); дедлайн не влияет на состав батча
+    deadline: Optional[float] = None
+    # Токены для оценки: вместо генерации — их log-вероятности в следующей позиции
+    score_token_ids: Optional[Tuple[int, ...]] = None
+    future: Future = field(default_factory=Future)
+
+    @property
+    def batch_key(self) -> Tuple:
+        """В один батч попадают только запросы с одинаковыми параметрами генерации"""
+        # Схемы — константы модулей, поэтому сравниваются по id
+        return (self.max_length, id(self.json_schema), self.score_token_ids) + tuple(
+            (name, repr(value)) for name, value in sorted(self.generate_kwargs.items())
+        )
+
+
+def render_chat(tokenizer: Any, system: str, user: str) -> str:
+    """Текст промпта в chat template модели"""
+    return tokenizer.apply_chat_template(
+        [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user}
+        ],
+        tokenize=False,
+        add_generation_prompt=True
+    )
+
+
+class LLMScheduler:
+    """
+    Очередь генерации для одной модели
+
+    Используйте get_scheduler(model, tokenizer): очередь общая для всех
+    компонентов, работающих с этой моделью.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        tokenizer: Any,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0
+    ):
+        """
+        Args:
+            model: модель transformers
+            tokenizer: ее токенизатор
+            max_batch_size: максимальный размер батча
+            max_wait_ms: сколько ждать новых запросов после первого в батче
+        """
+        self._model_ref = weakref.ref(model)
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue[Optional[GenerationRequest]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._max_batch_seen = 0
+
+        self._draft_ref = None
+        self._speculative = 0
+
+        self._worker = threading.Thread(target=self._run, name="llm-scheduler", daemon=True)
+        self._worker.start()
+
+    @property
+    def model(self) -> Any:
+        return self._model_ref()
+
+    @property
+    def pad_token_id(self) -> int:
+        """Токен паддинга батча (eos, если у токенизатора нет pad_token)"""
+        if self.tokenizer.pad_token_id is not None:
+            return self.tokenizer.pad_token_id
+        return self.tokenizer.eos_token_id
+
+    @property
+    def draft_model(self) -> Any:
+        return self._draft_ref() if self._draft_ref is not None else None
+
+    def set_draft_model(self, draft_model: Any):
+        """
+        Подключает draft модель для speculative decoding (None — отключает)
+
+        Draft модель должна использовать тот же токенизатор, что и основная
+        (например, Qwen3-0.6B для Qwen3-4B). Хранится слабая ссылка: модель
+        принадлежит реестру.
+        """
+        self._draft_ref = weakref.ref(draft_model) if draft_model is not None else None
+
+    def submit(
+        self,
+        text: str,
+        prefix_parts: Optional[Tuple[str, str, str]] = None,
+        max_length: Optional[int] = None,
+        json_schema: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None,
+        **generate_kwargs
+    ) -> Future:
+        """
+        Ставит промпт в очередь
+
+        Args:
+            text: полный текст промпта (уже в chat template, если нужен)
+            prefix_parts: (system, static_user, variable_user) — если запрос
+                окажется в батче один, генерация пойдет с кэшем префикса
+            max_length: обрезка промпта по длине в токенах
+            json_schema: схема JSON ответа — генерация ограничивается ей и
+                останавливается после закрытия корневого объекта
+            deadline: дедлайн по time.monotonic() (см. deadline_after)
+            **generate_kwargs: параметры model.generate
+
+        Returns:
+            Future со сгенерированным текстом
+        """
+        request = GenerationRequest(text, generate_kwargs, prefix_parts, max_length, json_schema, deadline)
+        self._queue.put(request)
+        return request.future
+
+    def generate(
+        self,
+        text: str,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> str:
+        """
+        submit(...) с ожиданием результата
+
+        Raises:
+            DeadlineExceeded: результат не получен до дедлайна (запрос
+                отменяется, если еще не начал выполняться)
+        """
+        future = self.submit(text, deadline=deadline, **kwargs)
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceeded("Генерация LLM не уложилась в дедлайн")
+
+    def score(
+        self,
+        texts: List[str],
+        token_ids: Tuple[int, ...],
+        max_length: Optional[int] = None,
+        deadline: Optional[float] = None
+    ) -> List[List[float]]:
+        """
+        Log-вероятности токенов token_ids в позиции после каждого промпта
+
+        Один прямой проход на батч без генерации; промпты ставятся в очередь
+        вместе и батчатся (не больше max_batch_size в одном проходе).
+
+        Args:
+            texts: промпты (уже в chat template, если нужен)
+            token_ids: оцениваемые токены
+            max_length: обрезка промптов по длине в токенах
+            deadline: дедлайн по time.monotonic() (см. deadline_after)
+
+        Returns:
+            Для каждого промпта список log-вероятностей в порядке token_ids
+
+        Raises:
+            DeadlineExceeded: оценка не получена до дедлайна
+        """
+        token_ids = tuple(token_ids)
+        futures = []
+        for text in texts:
+            request = GenerationRequest(
+                text, {}, max_length=max_length, deadline=deadline, score_token_ids=token_ids
+            )
+            self._queue.put(request)
+            futures.append(request.future)
+
+        results = []
+        for future in futures:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            try:
+                results.append(future.result(timeout=timeout))
+            except FutureTimeoutError:
+                for pending in futures:
+                    pending.cancel()
+                raise DeadlineExceeded("Оценка LLM не уложилась в дедлайн")
+        return results
+
+    def close(self):
+        """Останавливает поток планировщика (запросы в очереди будут выполнены)"""
+        self._queue.put(None)
+        if threading.current_thread() is not self._worker:
+            self._worker.join()
+
+    def _collect_batch(self, first: GenerationRequest) -> Tuple[List[GenerationRequest], bool]:
+        """Добирает запросы, пришедшие в течение max_wait после первого"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect_batch(first)
+
+            groups: Dict[Tuple, List[GenerationRequest]] = {}
+            for request in batch:
+                groups.setdefault(request.batch_key, []).append(request)
+
+            for group in groups.values():
+                pending = [r for r in group if r.future.set_running_or_notify_cancel()]
+                pending = self._drop_expired(pending)
+                if not pending:
+                    continue
+                with self._stats_lock:
+                    self._batches += 1
+                    self._requests += len(pending)
+                    self._max_batch_seen = max(self._max_batch_seen, len(pending))
+                try:
+                    results = self._execute(pending)
+                except Exception as e:
+                    for request in pending:
+                        request.future.set_exception(e)
+                    continue
+                for request, result in zip(pending, results):
+                    request.future.set_result(result)
+
+    @staticmethod
+    def _drop_expired(requests: List[GenerationRequest]) -> List[GenerationRequest]:
+        """Завершает запросы, дедлайн которых истек в очереди; возвращает остальные"""
+        now = time.monotonic()
+        alive = []
+        for request in requests:
+            if request.deadline is not None and request.deadline <= now:
+                request.future.set_exception(DeadlineExceeded("Дедлайн истек в очереди LLM"))
+            else:
+                alive.append(request)
+        return alive
+
+    def _execute(self, batch: List[GenerationRequest]) -> List[Any]:
+        """Генерирует ответы (или оценки) для батча с одинаковыми параметрами"""
+        import torch
+
+        model = self.model
+        if model is None:
+            raise RuntimeError("Модель выгружена")
+
+        if batch[0].score_token_ids is not None:
+            return self._score(model, batch)
+
+        # Assisted decoding работает только для батча из одного запроса и
+        # ведет собственный KV-кэш, поэтому кэш префикса в этом случае не используется
+        draft = self.draft_model if len(batch) == 1 else None
+
+        if draft is None and len(batch) == 1 and batch[0].prefix_parts is not None:
+            response = generate_with_prefix(
+                model, self.tokenizer, *batch[0].prefix_parts, **self._generate_kwargs(model, batch)
+            )
+            if response is not None:
+                return [response]
+
+        kwargs = self._generate_kwargs(model, batch)
+        if draft is not None:
+            kwargs["assistant_model"] = draft
+            with self._stats_lock:
+                self._speculative += 1
+
+        inputs = self._encode([request.text for request in batch], batch[0].max_length, model.device)
+        kwargs.setdefault("pad_token_id", self.pad_token_id)
+
+        with torch.no_grad():
+            outputs = model.generate(**inputs, **kwargs)
+
+        prompt_length = inputs["input_ids"].shape[1]
+        return [
+            self.tokenizer.decode(row[prompt_length:], skip_special_tokens=True)
+            for row in outputs
+        ]
+
+    def _encode(self, texts: List[str], max_length: Optional[int], device: Any) -> Dict[str, Any]:
+        """
+        Токенизирует батч с паддингом слева
+
+        Слева — чтобы новые токены всех строк шли с одной позиции. Паддинг
+        делается здесь, а не настройкой padding_side / pad_token общего
+        токенизатора: тот же токенизатор используют другие компоненты.
+        """
+        import torch
+
+        encoded = self.tokenizer(
+            texts,
+            truncation=max_length is not None,
+            max_length=max_length
+        )["input_ids"]
+
+        width = max(len(ids) for ids in encoded)
+        input_ids = torch.full((len(encoded), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(encoded), width), dtype=torch.long)
+        for row, ids in enumerate(encoded):
+            if ids:
+                input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+                attention_mask[row, width - len(ids):] = 1
+        return {"input_ids": input_ids.to(device), "attention_mask": attention_mask.to(device)}
+
+    def _score(self, model: Any, batch: List[GenerationRequest]) -> List[List[float]]:
+        """Log-вероятности score_token_ids после каждого промпта за один прямой проход"""
+        import torch
+
+        inputs = self._encode([request.text for request in batch], batch[0].max_length, model.device)
+        # С левым паддингом позиции реальных токенов начинаются с 0, как в generate
+        position_ids = (inputs["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+
+        with torch.no_grad():
+            # Голова модели только для последней позиции: полные логиты
+            # [batch, длина, словарь] заняли бы сотни мегабайт
+            hidden = model.base_model(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                position_ids=position_ids,
+                use_cache=False
+            ).last_hidden_state[:, -1, :]
+            logits = model.get_output_embeddings()(hidden).float()
+            log_probs = torch.log_softmax(logits, dim=-1)
+
+        token_ids = torch.tensor(batch[0].score_token_ids, device=log_probs.device)
+        return log_probs[:, token_ids].tolist()
+
+    def _generate_kwargs(self, model: Any, batch: List[GenerationRequest]) -> Dict[str, Any]:
+        """Параметры model.generate для одного вызова (процессор схемы хранит состояние)"""
+        request = batch[0]
+        kwargs = dict(request.generate_kwargs)
+
+        deadlines = [r.deadline for r in batch]
+        if all(deadline is not None for deadline in deadlines):
+            # Батч останавливается, когда ответ не нужен уже никому из его запросов
+            from transformers import StoppingCriteriaList
+            kwargs["stopping_criteria"] = StoppingCriteriaList([_DeadlineCriteria(max(deadlines))])
+
+        if request.json_schema is not None:
+            eos_token_id = kwargs.get("eos_token_id", model.generation_config.eos_token_id)
+            if eos_token_id is None:
+                eos_token_id = self.tokenizer.eos_token_id
+            if isinstance(eos_token_id, int):
+                eos_token_id = [eos_token_id]
+            kwargs["logits_processor"] = json_logits_processor(self.tokenizer, request.json_schema, eos_token_id)
+        return kwargs
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики батчинга"""
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "max_batch_size": self._max_batch_seen,
+                "speculative": self._speculative,
+                "queued": self._queue.qsize()
+            }
+
+
+_schedulers: "weakref.WeakKeyDictionary[Any, LLMScheduler]" = weakref.WeakKeyDictionary()
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(model: Any, tokenizer: Any, **options) -> LLMScheduler:
+    """
+    Общий планировщик для модели (создается при первом обращении)
+
+    Args:
+        model: модель transformers
+        tokenizer: ее токенизатор
+        **options: max_batch_size / max_wait_ms для нового планировщика
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(model)
+        if scheduler is None:
+            scheduler = LLMScheduler(model, tokenizer, **options)
+            _schedulers[model] = scheduler
+        return scheduler
+
+
+def release_scheduler(model: Any):
+    """
+    Останавливает поток планировщика модели (вызывается при выгрузке модели)
+
+    Поток держит планировщик, поэтому без остановки он переживал бы модель.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.pop(model, None)
+    if scheduler is not None:
+        scheduler.close()
+
+
+def attach_draft_model(
+    model: Any,
+    tokenizer: Any,
+    draft_model_path: str,
+    device: str = "cpu",
+    dtype: Optional[str] = None
+):
+    """
+    Загружает draft модель из реестра и подключает ее к планировщику модели
+
+    Returns:
+        ModelHandle draft модели (освободить через release())
+    """
+    from src.model_registry import acquire_model
+
+    handle = acquire_model(draft_model_path, device=device, dtype=dtype)
+    get_scheduler(model, tokenizer).set_draft_model(handle.model)
+    print(f"✓ Speculative decoding: draft модель {draft_model_path}")
+    return handle
+
+
+def scheduler_stats() -> List[Dict[str, Any]]:
+    """Метрики батчинга всех планировщиков процесса"""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return [scheduler.stats() for scheduler in schedulers]
@@ -4,10 +4,119 @@ LLM Validator - финальная обработка результатов п
 """
 
 import json
+import os
 import re
 from typing import List, Dict, Optional, Any, Tuple
 from pathlib import Path
 
+from src.llm_backend import LLMBackendError, get_backend
+from src.llm_scheduler import (
+    DeadlineExceeded, attach_draft_model, deadline_after, describe_budget, get_scheduler, render_chat
+)
+from src.validation_prompt import (
+    DEFAULT_CANDIDATES_PER_ITEM,
+    DEFAULT_PROMPT_TOKEN_BUDGET,
+    PromptBudgetExceeded,
+    ValidationPromptBuilder,
+    estimate_prompt_tokens,
+    item_candidates
+)
+
+
+VALIDATION_SYSTEM_PROMPT = "Ты - эксперт по подбору строительных материалов."
+
+# Статическая часть промпта валидации. Инструкции и формат ответа идут до
+# запроса и списка товаров, чтобы KV-кэш этого блока считался один раз.
+VALIDATION_INSTRUCTIONS = """Ты - эксперт по подбору строительных материалов и комплектующих.
+
+Задача: проанализируй запрос пользователя и найденные товары. Определи:
+1. Какие товары соответствуют запросу
+2. Сколько единиц каждого товара нужно
+3. Чего не хватает (если что-то нужно, но не найдено)
+
+ИНСТРУКЦИИ:
+- Для комплектов (короб + крышка + крепеж): обычно нужны 1 короб, 1 крышка, 4 винта, 4 гайки
+- Для монтажа коробов 200x200: 4 винта М6 и 4 гайки М6
+- Для монтажа лотков: количество зависит от длины (обычно каждые 50см - 1 крепление)
+- Если пользователь указал количество явно - используй его
+- Если не указано - рассчитай стандартное количество
+
+ФОРМАТ ОТВЕТА (JSON):
+{
+  "analysis": "краткий анализ запроса",
+  "selected_items": [
+    {
+      "item_index": 0,  // индекс товара из списка (начиная с 0)
+      "name": "название товара",
+      "quantity": 2,  // сколько единиц нужно
+      "unit_price": 150,  // цена за единицу
+      "total_price": 300,  // общая стоимость (quantity * unit_price)
+      "reason": "почему выбран и почему такое количество"
+    }
+  ],
+  "missing_items": [
+    // список того, чего не хватает (если нужно)
+    {
+      "description": "что нужно найти",
+      "reason": "почему это нужно"
+    }
+  ],
+  "total_cost": 1500,  // общая стоимость всех выбранных товаров
+  "confidence": 0.9  // уверенность в результате (0.0-1.0)
+}
+
+"""
+
+# Максимум выбранных и недостающих позиций в ответе валидатора
+MAX_SELECTED_ITEMS = 20
+MAX_MISSING_ITEMS = 10
+
+# Схема ответа валидатора для constrained decoding
+VALIDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analysis": {"type": "string", "maxLength": 300},
+        "selected_items": {
+            "type": "array",
+            "maxItems": MAX_SELECTED_ITEMS,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item_index": {"type": "integer"},
+                    "name": {"type": "string", "maxLength": 200},
+                    "quantity": {"type": "integer"},
+                    "unit_price": {"type": "number"},
+                    "total_price": {"type": "number"},
+                    "reason": {"type": "string", "maxLength": 200}
+                },
+                "required": ["item_index", "quantity"]
+            }
+        },
+        "missing_items": {
+            "type": "array",
+            "maxItems": MAX_MISSING_ITEMS,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "description": {"type": "string", "maxLength": 200},
+                    "reason": {"type": "string", "maxLength": 200}
+                },
+                "required": ["description"]
+            }
+        },
+        "total_cost": {"type": "number"},
+        "confidence": {"type": "number"}
+    },
+    "required": ["selected_items", "total_cost"]
+}
+
+VALIDATION_GENERATION_KWARGS = {
+    "max_new_tokens": 1024,
+    "temperature": 0.3,
+    "do_sample": True,
+    "top_p": 0.9,
+}
+
 
 class LLMValidator:
     """
@@ -23,19 +132,61 @@ class LLMValidator:
     def __init__(
         self, 
         model_path: str = "./Qwen/Qwen3-4B-Instruct-2507",
-        use_llm: bool = True
+        use_llm: bool = True,
+        use_prefix_cache: bool = True,
+        use_constrained_decoding: bool = True,
+        dtype: Optional[str] = None,
+        deadline_seconds: Optional[float] = None,
+        draft_model_path: Optional[str] = None,
+        backend_url: Optional[str] = None,
+        backend_model: Optional[str] = None,
+        prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+        candidates_per_item: int = DEFAULT_CANDIDATES_PER_ITEM
     ):
         """
         Args:
             model_path: путь к LLM модели
             use_llm: использовать ли LLM (False = простые эвристики)
+            use_prefix_cache: переиспользовать KV-кэш статической части промпта
+            use_constrained_decoding: генерировать только JSON схемы VALIDATION_SCHEMA
+            dtype: точность весов ('float32' / 'bfloat16' / 'int8' на CPU) или None
+                (LLM_CPU_DTYPE / по устройству, см. model_registry)
+            deadline_seconds: бюджет времени на одну валидацию; если LLM не
+                успевает, возвращается эвристический результат (None = без ограничения)
+            draft_model_path: малая модель для speculative decoding
+                (по умолчанию LLM_DRAFT_MODEL; None = без draft модели)
+            backend_url: адрес OpenAI-совместимого сервера (по умолчанию
+                LLM_BACKEND_URL) вместо локальной модели (см. llm_backend)
+            backend_model: имя модели на сервере (по умолчанию LLM_BACKEND_MODEL)
+            prompt_token_budget: максимум токенов промпта валидации; лишние
+                кандидаты отбрасываются (см. validation_prompt)
+            candidates_per_item: лучших кандидатов на одну запрошенную позицию
         """
         self.model_path = Path(model_path)
         self.model = None
         self.tokenizer = None
+        self._model_handle = None
+        self._draft_handle = None
+        self.draft_model_path = draft_model_path or os.environ.get("LLM_DRAFT_MODEL")
         self.use_llm = use_llm
+        self.use_prefix_cache = use_prefix_cache
+        self.use_constrained_decoding = use_constrained_decoding
+        self.dtype = dtype
+        self.deadline_seconds = deadline_seconds
+        self.prompt_builder = ValidationPromptBuilder(
+            VALIDATION_INSTRUCTIONS,
+            system_prompt=VALIDATION_SYSTEM_PROMPT,
+            count_tokens=self._count_tokens,
+            token_budget=prompt_token_budget,
+            candidates_per_item=candidates_per_item
+        )
         
-        if use_llm and self.model_path.exists():
+        backend_url = backend_url or os.environ.get("LLM_BACKEND_URL")
+        self.backend = None
+        if use_llm and backend_url:
+            self.backend = get_backend(backend_url, backend_model or os.environ.get("LLM_BACKEND_MODEL"))
+            print(f"✓ LLM валидатор: сервер {self.backend.base_url}")
+        elif use_llm and self.model_path.exists():
             self._load_model()
         else:
             print("📝 LLM Validator работает в режиме эвристик (без LLM)")
@@ -43,36 +194,60 @@ class LLMValidator:
     def _load_model(self):
         """Загрузка LLM модели"""
         try:
-            from transformers import AutoModelForCausalLM, AutoTokenizer
-            import torch
+            from src.model_registry import acquire_model
             
             print(f"Загрузка LLM валидатора из {self.model_path}...")
             
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                str(self.model_path),
-                trust_remote_code=True
-            )
-            
-            self.model = AutoModelForCausalLM.from_pretrained(
-                str(self.model_path),
-                device_map="cpu",
-                torch_dtype=torch.float32,
-                trust_remote_code=True,
-                low_cpu_mem_usage=True
-            )
+            # Модель из общего реестра: другие LLM компоненты используют ту же копию
+            self._model_handle = acquire_model(self.model_path, device="cpu", dtype=self.dtype)
+            self.model = self._model_handle.model
+            self.tokenizer = self._model_handle.tokenizer
             print("✓ LLM валидатор загружен")
             
+            if self.draft_model_path:
+                try:
+                    self._draft_handle = attach_draft_model(
+                        self.model, self.tokenizer, self.draft_model_path, dtype=self.dtype
+                    )
+                except Exception as e:
+                    print(f"⚠️ Не удалось загрузить draft модель {self.draft_model_path}: {e}")
+            
         except Exception as e:
             print(f"⚠️ Не удалось загрузить LLM валидатор: {e}")
             print("Будут использоваться простые эвристики")
             self.model = None
             self.tokenizer = None
     
+    def close(self):
+        """Освобождает ссылки на модели в реестре"""
+        if self._draft_handle is not None:
+            self._draft_handle.release()
+            self._draft_handle = None
+        if self._model_handle is not None:
+            self._model_handle.release()
+            self._model_handle = None
+        self.model = None
+        self.tokenizer = None
+        self.backend = None
+    
+    def _count_tokens(self, user: str) -> int:
+        """
+        Токены промпта в chat template (системное сообщение + сообщение user)
+
+        Считаются токенизатором модели по отрендеренному шаблону или
+        оценкой (удаленный бэкенд).
+        """
+        if self.tokenizer is None:
+            return estimate_prompt_tokens(VALIDATION_SYSTEM_PROMPT, user)
+        prompt = render_chat(self.tokenizer, VALIDATION_SYSTEM_PROMPT, user)
+        return len(self.tokenizer(prompt, add_special_tokens=False)['input_ids'])
+    
     def validate_and_calculate(
         self,
         original_query: str,
         found_items: List[Dict[str, Any]],
-        max_iterations: int = 2
+        max_iterations: int = 2,
+        deadline_seconds: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Главный метод: валидирует результаты и рассчитывает стоимость
@@ -81,16 +256,40 @@ class LLMValidator:
             original_query: исходный запрос пользователя
             found_items: найденные товары [{"name": ..., "cost": ...}, ...]
             max_iterations: максимум итераций для дополнительного поиска
+            deadline_seconds: бюджет времени на этот вызов (None = self.deadline_seconds)
             
         Returns:
-            Dict с результатами валидации, расчётами и возможными дополнительными запросами
+            Dict с результатами валидации, расчётами и возможными дополнительными
+            запросами; fallback = "deadline", если LLM не уложилась в бюджет
+            времени, "prompt_budget", если товары не помещаются в бюджет токенов,
+            "backend", если LLM сервер недоступен или вернул ошибку
         """
-        if self.model is None or self.tokenizer is None:
+        if self.backend is None and (self.model is None or self.tokenizer is None):
             # Режим эвристик
             return self._heuristic_validation(original_query, found_items)
         
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        
         try:
-            return self._llm_validation(original_query, found_items, max_iterations)
+            return self._llm_validation(
+                original_query, found_items, max_iterations, deadline=deadline_after(deadline_seconds)
+            )
+        except DeadlineExceeded:
+            print(f"⏱️ LLM валидация не уложилась в {describe_budget(deadline_seconds)}, используем эвристики")
+            result = self._heuristic_validation(original_query, found_items)
+            result['fallback'] = 'deadline'
+            return result
+        except PromptBudgetExceeded as e:
+            print(f"📏 {e}, используем эвристики")
+            result = self._heuristic_validation(original_query, found_items)
+            result['fallback'] = 'prompt_budget'
+            return result
+        except LLMBackendError as e:
+            print(f"⚠️ {e}, используем эвристики")
+            result = self._heuristic_validation(original_query, found_items)
+            result['fallback'] = 'backend'
+            return result
         except Exception as e:
             print(f"⚠️ Ошибка LLM валидации: {e}")
             return self._heuristic_validation(original_query, found_items)
@@ -99,94 +298,26 @@ class LLMValidator:
         self,
         original_query: str,
         found_items: List[Dict[str, Any]],
-        max_iterations: int
+        max_iterations: int,
+        deadline: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Валидация через LLM
-        """
-        # Форматируем найденные товары
-        items_text = "\n".join([
-            f"{i+1}. {item['name']} - {item.get('cost', 'N/A')} руб."
-            for i, item in enumerate(found_items)
-        ])
-        
-        prompt = f"""Ты - эксперт по подбору строительных материалов и комплектующих.
-
-Задача: проанализируй запрос пользователя и найденные товары. Определи:
-1. Какие товары соответствуют запросу
-2. Сколько единиц каждого товара нужно
-3. Чего не хватает (если что-то нужно, но не найдено)
-
-ЗАПРОС ПОЛЬЗОВАТЕЛЯ:
-{original_query}
-
-НАЙДЕННЫЕ ТОВАРЫ:
-{items_text}
-
-ИНСТРУКЦИИ:
-- Для комплектов (короб + крышка + крепеж): обычно нужны 1 короб, 1 крышка, 4 винта, 4 гайки
-- Для монтажа коробов 200x200: 4 винта М6 и 4 гайки М6
-- Для монтажа лотков: количество зависит от длины (обычно каждые 50см - 1 крепление)
-- Если пользователь указал количество явно - используй его
-- Если не указано - рассчитай стандартное количество
-
-ФОРМАТ ОТВЕТА (JSON):
-{{
-  "analysis": "краткий анализ запроса",
-  "selected_items": [
-    {{
-      "item_index": 0,  // индекс товара из списка (начиная с 0)
-      "name": "название товара",
-      "quantity": 2,  // сколько единиц нужно
-      "unit_price": 150,  // цена за единицу
-      "total_price": 300,  // общая стоимость (quantity * unit_price)
-      "reason": "почему выбран и почему такое количество"
-    }}
-  ],
-  "missing_items": [
-    // список того, чего не хватает (если нужно)
-    {{
-      "description": "что нужно найти",
-      "reason": "почему это нужно"
-    }}
-  ],
-  "total_cost": 1500,  // общая стоимость всех выбранных товаров
-  "confidence": 0.9  // уверенность в результате (0.0-1.0)
-}}
-
-JSON:"""
-
-        # Генерация ответа
-        messages = [
-            {"role": "system", "content": "Ты - эксперт по подбору строительных материалов."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
         
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+        В промпт попадают только лучшие кандидаты без дубликатов в пределах
+        бюджета токенов (см. validation_prompt).
         
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=1024,
-            temperature=0.3,
-            do_sample=True,
-            top_p=0.9
-        )
-        
-        generated_ids = [
-            output_ids[len(input_ids):] 
-            for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
+        Raises:
+            PromptBudgetExceeded: промпт не помещается в бюджет токенов
+        """
+        variable_part, kept, tokens = self.prompt_builder.build(original_query, found_items)
+        if len(kept) < len(found_items):
+            print(f"✂️ В промпт валидации: {len(kept)} из {len(found_items)} товаров ({tokens} токенов)")
         
-        response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        response = self._generate(VALIDATION_INSTRUCTIONS, variable_part, deadline=deadline)
         
         # Парсим JSON ответ
-        result = self._parse_llm_validation_response(response, found_items)
+        result = self._parse_llm_validation_response(response, found_items, kept)
         
         if result:
             print(f"✓ LLM валидация: найдено {len(result['selected_items'])} релевантных товаров")
@@ -197,27 +328,72 @@ JSON:"""
             print("⚠️ Не удалось распарсить ответ LLM, используем эвристики")
             return self._heuristic_validation(original_query, found_items)
     
+    def _generate(self, static_part: str, variable_part: str, deadline: Optional[float] = None) -> str:
+        """
+        Генерирует ответ валидатора через общий планировщик модели
+        
+        Параллельные запросы объединяются в батч (см. llm_scheduler); если
+        запрос один, KV-кэш системного сообщения и статических инструкций
+        берется готовым (см. prefix_cache). С constrained decoding ответ
+        ограничен VALIDATION_SCHEMA и заканчивается на закрывающей скобке.
+        С удаленным бэкендом запрос уходит на OpenAI-совместимый сервер.
+        
+        Raises:
+            DeadlineExceeded: ответ не получен до deadline (time.monotonic)
+            LLMBackendError: сервер недоступен или вернул ошибку
+        """
+        json_schema = VALIDATION_SCHEMA if self.use_constrained_decoding else None
+        if self.backend is not None:
+            return self.backend.chat(
+                VALIDATION_SYSTEM_PROMPT, static_part + variable_part,
+                json_schema=json_schema, deadline=deadline, **VALIDATION_GENERATION_KWARGS
+            )
+        
+        prefix_parts = (
+            (VALIDATION_SYSTEM_PROMPT, static_part, variable_part)
+            if self.use_prefix_cache else None
+        )
+        return get_scheduler(self.model, self.tokenizer).generate(
+            render_chat(self.tokenizer, VALIDATION_SYSTEM_PROMPT, static_part + variable_part),
+            prefix_parts=prefix_parts,
+            json_schema=json_schema,
+            deadline=deadline,
+            **VALIDATION_GENERATION_KWARGS
+        )
+    
     def _parse_llm_validation_response(
         self, 
         response: str, 
-        found_items: List[Dict]
+        found_items: List[Dict],
+        kept: Optional[List[int]] = None
     ) -> Optional[Dict]:
         """
         Парсит JSON ответ от LLM
+        
+        kept — индексы found_items в порядке товаров промпта: item_index
+        ответа переводится в индекс found_items. С constrained decoding
+        ответ — это сам JSON по VALIDATION_SCHEMA и разбирается целиком.
         """
+        if kept is None:
+            kept = list(range(len(found_items)))
+        
         try:
-            # Ищем JSON в ответе
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(0))
-                
+            if self.use_constrained_decoding:
+                data = json.loads(response)
+            else:
+                # Ищем JSON в ответе
+                json_match = re.search(r'\{.*\}', response, re.DOTALL)
+                data = json.loads(json_match.group(0)) if json_match else None
+            
+            if isinstance(data, dict):
                 # Валидируем структуру
                 if 'selected_items' in data and 'total_cost' in data:
                     # Добавляем полные данные о товарах
                     for item in data['selected_items']:
                         idx = item.get('item_index', -1)
-                        if 0 <= idx < len(found_items):
-                            item['full_data'] = found_items[idx]
+                        if isinstance(idx, int) and 0 <= idx < len(kept):
+                            item['item_index'] = kept[idx]
+                            item['full_data'] = found_items[kept[idx]]
                     
                     return data
             
@@ -357,7 +533,8 @@ class IterativeSearchValidator(LLMValidator):
         
         Args:
             original_query: исходный запрос
-            initial_items: начальные найденные товары
+            initial_items: начальные найденные товары с requested_item (см.
+                HybridQueryProcessor.validation_items / item_candidates)
             max_iterations: максимум итераций дополнительного поиска
             items_per_search: сколько товаров искать в каждой итерации
             
@@ -401,20 +578,15 @@ class IterativeSearchValidator(LLMValidator):
                     top_k=items_per_search
                 )
                 
-                # Добавляем новые товары (если их еще нет)
-                for product, score in search_results:
-                    product_dict = {
-                        'id': product.id,
-                        'name': product.name,
-                        'cost': product.cost,
-                        'similarity': score
-                    }
-                    
-                    # Проверяем дубликаты
-                    if not any(item['id'] == product.id for item in all_found_items):
+                # Добавляем новые товары (если их еще нет у этой позиции)
+                for product_dict in item_candidates(search_query, search_results):
+                    if not any(
+                        item['id'] == product_dict['id'] and item.get('requested_item') == search_query
+                        for item in all_found_items
+                    ):
                         all_found_items.append(product_dict)
                         new_items_found = True
-                        print(f"      ✓ Добавлен: {product.name} ({score:.2f})")
+                        print(f"      ✓ Добавлен: {product_dict['name']} ({product_dict['similarity']:.2f})")
             
             if not new_items_found:
                 print("⚠️ Новых товаров не найдено, завершаем поиск")
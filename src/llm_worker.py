@@ -0,0 +1,375 @@
+"""
+Отдельный процесс с LLM и клиент к нему
+
+Каждый процесс API, создающий HybridQueryProcessor, загружает свою копию
+Qwen, поэтому несколько воркеров uvicorn не помещаются в память. LLM
+воркер — отдельный процесс, который один держит модель и обслуживает
+разбор запросов, валидацию и выбор товаров через локальный сокет (Unix
+socket или 127.0.0.1:порт, multiprocessing.connection с HMAC
+аутентификацией). Запросы от разных клиентов выполняются в отдельных
+потоках и батчатся общим планировщиком модели (см. llm_scheduler).
+
+LLMWorkerClient реализует интерфейсы parse_request / format_result
+(LLMRequestParser), validate_and_calculate (LLMValidator) и
+select_products (LLMGenerator), поэтому подставляется вместо них.
+
+multiprocessing.connection передает объекты через pickle, поэтому любой,
+кто знает ключ и может подключиться к сокету, выполняет код в воркере.
+Ключа по умолчанию нет: он берется из LLM_WORKER_AUTHKEY или из файла
+ключа (LLM_WORKER_AUTHKEY_FILE, по умолчанию data/cache/llm_worker.key,
+создается командой --generate-key с правами 0600). TCP адреса допускаются
+только на loopback, если явно не задан LLM_WORKER_ALLOW_REMOTE=1.
+
+Запуск воркера:
+    python -m src.llm_worker --generate-key
+    python -m src.llm_worker --address /tmp/tcp-mpit-llm.sock --model ./Qwen/Qwen3-4B-Instruct-2507
+
+API с воркером:
+    LLM_WORKER_ADDRESS=/tmp/tcp-mpit-llm.sock uvicorn src.api.main:app --workers 4
+"""
+
+import ipaddress
+import os
+import secrets
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+
+DEFAULT_ADDRESS = "/tmp/tcp-mpit-llm.sock"
+
+# Файл ключа HMAC рукопожатия (если не задан LLM_WORKER_AUTHKEY);
+# сервер и клиенты должны использовать одинаковый ключ
+DEFAULT_AUTHKEY_FILE = "data/cache/llm_worker.key"
+
+Address = Union[str, Tuple[str, int]]
+
+# Запас сверх deadline_seconds вызова на передачу ответа и эвристический
+# разбор в воркере, секунд
+DEADLINE_GRACE_SECONDS = 2.0
+
+
+class LLMWorkerError(RuntimeError):
+    """Ошибка, возникшая в LLM воркере при выполнении запроса"""
+
+
+def _is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address: str, allow_remote: Optional[bool] = None) -> Address:
+    """
+    Адрес воркера из строки
+
+    "host:port" — TCP, иначе путь к Unix сокету.
+
+    Args:
+        address: адрес
+        allow_remote: разрешить TCP адрес не на loopback (по умолчанию
+            LLM_WORKER_ALLOW_REMOTE=1)
+
+    Raises:
+        ValueError: TCP адрес не на loopback без явного разрешения
+    """
+    host, sep, port = address.rpartition(':')
+    if not (sep and port.isdigit() and '/' not in address):
+        return address
+
+    host = host.strip('[]') or '127.0.0.1'
+    if allow_remote is None:
+        allow_remote = os.environ.get("LLM_WORKER_ALLOW_REMOTE") == "1"
+    if not allow_remote and not _is_loopback(host):
+        raise ValueError(
+            f"Адрес LLM воркера {address} не на loopback; протокол выполняет код "
+            f"из сообщений, для сетевого адреса задайте LLM_WORKER_ALLOW_REMOTE=1"
+        )
+    return (host, int(port))
+
+
+def authkey_file() -> Path:
+    """Путь к файлу ключа (LLM_WORKER_AUTHKEY_FILE или DEFAULT_AUTHKEY_FILE)"""
+    return Path(os.environ.get("LLM_WORKER_AUTHKEY_FILE", DEFAULT_AUTHKEY_FILE))
+
+
+def generate_authkey(path: Optional[Path] = None) -> Path:
+    """
+    Создает файл со случайным ключом (права 0600), если его еще нет
+
+    Returns:
+        Путь к файлу ключа
+    """
+    path = Path(path) if path is not None else authkey_file()
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(secrets.token_hex(32))
+    os.replace(tmp_path, path)
+    return path
+
+
+def _authkey(authkey: Optional[str]) -> bytes:
+    """
+    Ключ аутентификации: аргумент, LLM_WORKER_AUTHKEY или файл ключа
+
+    Raises:
+        LLMWorkerError: ключ не задан (ключа по умолчанию нет)
+    """
+    key = authkey or os.environ.get("LLM_WORKER_AUTHKEY")
+    if not key:
+        path = authkey_file()
+        try:
+            key = path.read_text(encoding='utf-8').strip()
+        except OSError:
+            key = ""
+    if not key:
+        raise LLMWorkerError(
+            f"Не задан ключ LLM воркера: укажите LLM_WORKER_AUTHKEY или создайте "
+            f"{authkey_file()} командой python -m src.llm_worker --generate-key"
+        )
+    return key.encode('utf-8')
+
+
+class LLMWorkerServer:
+    """
+    Процесс-владелец LLM: принимает запросы клиентов и выполняет их
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        model_path: str = "./Qwen/Qwen3-4B-Instruct-2507",
+        dtype: Optional[str] = None,
+        authkey: Optional[str] = None
+    ):
+        """
+        Args:
+            address: путь к Unix сокету или "host:port"
+            model_path: путь к LLM модели (общая для всех компонентов)
+            dtype: точность модели (см. model_registry)
+            authkey: ключ аутентификации клиентов (по умолчанию LLM_WORKER_AUTHKEY
+                или файл ключа)
+
+        Raises:
+            LLMWorkerError: ключ не задан
+            ValueError: TCP адрес не на loopback без LLM_WORKER_ALLOW_REMOTE=1
+        """
+        from src.llm_request_parser import LLMRequestParser
+        from src.llm_validator import LLMValidator
+        from src.llm_generator import LLMGenerator
+
+        # Адрес и ключ проверяются до загрузки модели
+        self.address = parse_address(address)
+        self.authkey = _authkey(authkey)
+
+        # Все компоненты получают одну копию модели из реестра
+        self.parser = LLMRequestParser(model_path=model_path, device=None, dtype=dtype)
+        self.validator = LLMValidator(model_path=model_path, dtype=dtype)
+        self.generator = LLMGenerator(model_path, dtype=dtype)
+
+        self._methods: Dict[str, Callable] = {
+            "ping": lambda: "pong",
+            "parse_request": self.parser.parse_request,
+            "validate_and_calculate": self.validator.validate_and_calculate,
+            "select_products": self.generator.select_products,
+        }
+
+    def serve_forever(self):
+        """Принимает соединения; каждое обслуживается в отдельном потоке"""
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # Сокет, оставшийся от упавшего воркера
+            os.unlink(self.address)
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"✅ LLM воркер слушает {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"⚠️ Не удалось принять соединение: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                handler = self._methods.get(method)
+                if handler is None:
+                    conn.send(("error", f"Неизвестный метод: {method}"))
+                    continue
+                try:
+                    result = handler(*args, **kwargs)
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+                    continue
+                conn.send(("ok", result))
+
+
+class LLMWorkerClient:
+    """
+    Клиент LLM воркера с интерфейсом LLM компонентов
+
+    У каждого потока свое соединение (запросы в одном соединении идут
+    последовательно); при обрыве соединение открывается заново.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        authkey: Optional[str] = None,
+        timeout: float = 300.0
+    ):
+        """
+        Args:
+            address: путь к Unix сокету или "host:port"
+            authkey: ключ аутентификации (по умолчанию LLM_WORKER_AUTHKEY
+                или файл ключа)
+            timeout: сколько ждать ответа воркера, секунд (для вызовов с
+                deadline_seconds — не дольше бюджета плюс DEADLINE_GRACE_SECONDS)
+
+        Raises:
+            LLMWorkerError: ключ не задан
+            ValueError: TCP адрес не на loopback без LLM_WORKER_ALLOW_REMOTE=1
+        """
+        self.address = parse_address(address)
+        self.authkey = _authkey(authkey)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def _timeout_for(self, deadline_seconds: Optional[float]) -> float:
+        """Сколько ждать ответа на вызов с бюджетом deadline_seconds"""
+        if deadline_seconds is None:
+            return self.timeout
+        return min(self.timeout, max(deadline_seconds, 0.0) + DEADLINE_GRACE_SECONDS)
+
+    def _call(self, method: str, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Выполняет метод в воркере
+
+        Args:
+            method: имя метода воркера
+            timeout: сколько ждать ответа (None = self.timeout)
+
+        Raises:
+            LLMWorkerError: метод завершился ошибкой в воркере
+            TimeoutError: воркер не ответил за timeout
+            ConnectionError / OSError: воркер недоступен
+        """
+        if timeout is None:
+            timeout = self.timeout
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((method, args, kwargs))
+                if not conn.poll(timeout):
+                    # Ответ может прийти позже и перепутаться со следующим запросом
+                    self._drop_connection()
+                    raise TimeoutError(f"LLM воркер не ответил за {timeout:.0f} с")
+                status, payload = conn.recv()
+                break
+            except (EOFError, ConnectionError, BrokenPipeError):
+                # Воркер перезапускался: одна повторная попытка с новым соединением
+                self._drop_connection()
+                if attempt:
+                    raise ConnectionError(f"LLM воркер {self.address} недоступен")
+
+        if status == "error":
+            raise LLMWorkerError(payload)
+        return payload
+
+    def ping(self) -> bool:
+        """Доступен ли воркер"""
+        try:
+            return self._call("ping") == "pong"
+        except (OSError, AuthenticationError, LLMWorkerError):
+            return False
+
+    def parse_request(self, user_query: str, deadline_seconds: Optional[float] = None) -> Dict:
+        """См. LLMRequestParser.parse_request"""
+        return self._call(
+            "parse_request", user_query, deadline_seconds,
+            timeout=self._timeout_for(deadline_seconds)
+        )
+
+    def format_result(self, parsed_result: Dict) -> str:
+        """См. LLMRequestParser.format_result (выполняется локально)"""
+        from src.llm_request_parser import LLMRequestParser
+        return LLMRequestParser.format_result(self, parsed_result)
+
+    def validate_and_calculate(
+        self,
+        original_query: str,
+        found_items: List[Dict[str, Any]],
+        max_iterations: int = 2,
+        deadline_seconds: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """См. LLMValidator.validate_and_calculate"""
+        return self._call(
+            "validate_and_calculate", original_query, found_items, max_iterations, deadline_seconds,
+            timeout=self._timeout_for(deadline_seconds)
+        )
+
+    def select_products(
+        self,
+        query: str,
+        candidates: List[Dict],
+        max_candidates: int = 10,
+        deadline_seconds: Optional[float] = None
+    ) -> List[Dict]:
+        """См. LLMGenerator.select_products"""
+        return self._call(
+            "select_products", query, candidates, max_candidates, deadline_seconds,
+            timeout=self._timeout_for(deadline_seconds)
+        )
+
+    def close(self):
+        """Закрывает соединение текущего потока"""
+        self._drop_connection()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LLM воркер: одна копия модели для всех процессов API")
+    parser.add_argument("--address", default=os.environ.get("LLM_WORKER_ADDRESS", DEFAULT_ADDRESS),
+                        help="Путь к Unix сокету или host:port")
+    parser.add_argument("--model", default="./Qwen/Qwen3-4B-Instruct-2507", help="Путь к LLM модели")
+    parser.add_argument("--dtype", default=None, help="float32 / bfloat16 / int8 (по умолчанию LLM_CPU_DTYPE)")
+    parser.add_argument("--generate-key", action="store_true",
+                        help="Создать файл ключа (LLM_WORKER_AUTHKEY_FILE) и выйти")
+    args = parser.parse_args()
+
+    if args.generate_key:
+        print(f"🔑 Ключ LLM воркера: {generate_authkey()}")
+    else:
+        LLMWorkerServer(args.address, model_path=args.model, dtype=args.dtype).serve_forever()
@@ -0,0 +1,254 @@
+"""
+Общий реестр LLM моделей процесса
+
+LLMRequestParser, LLMValidator, LLMQueryPreprocessor и LLMGenerator
+используют один и тот же чекпойнт Qwen. Реестр загружает каждую комбинацию
+(путь, dtype, устройство) один раз, выдает компонентам общие модель и
+токенизатор и считает ссылки: модель выгружается (а поток ее планировщика
+останавливается), когда ее освободил последний компонент.
+
+Точность на CPU задается параметром dtype или переменной окружения
+LLM_CPU_DTYPE:
+- float32 — по умолчанию;
+- bfloat16 — вдвое меньше памяти, быстрее на CPU с AVX512-BF16/AMX;
+- int8 — динамическая квантизация Linear слоев (веса int8, активации
+  квантуются на лету), примерно в 4 раза меньше памяти под веса.
+"""
+
+import gc
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+SUPPORTED_DTYPES = ("float32", "float16", "bfloat16", "int8")
+
+
+def default_dtype(device: str) -> str:
+    """dtype по умолчанию: float16 на GPU, на CPU — LLM_CPU_DTYPE или float32"""
+    if device in ("cuda", "mps"):
+        return "float16"
+    return os.environ.get("LLM_CPU_DTYPE", "float32")
+
+
+def normalize_model_path(model_path) -> str:
+    """
+    Приводит путь к модели к каноничному виду
+
+    "./Qwen/..." и "Qwen/..." дают один ключ: существующие директории
+    превращаются в абсолютный путь, остальное (идентификаторы HuggingFace
+    Hub) нормализуется как путь.
+    """
+    path = Path(model_path)
+    if path.exists():
+        return str(path.resolve())
+    return os.path.normpath(str(model_path))
+
+
+@dataclass(frozen=True)
+class ModelKey:
+    """Ключ модели в реестре"""
+    path: str
+    dtype: str
+    device: str
+
+
+class ModelHandle:
+    """
+    Общие модель и токенизатор, выданные компоненту
+
+    Компонент должен вызвать release() (или ModelRegistry.release), когда
+    модель ему больше не нужна.
+    """
+
+    def __init__(self, registry: 'ModelRegistry', key: ModelKey, model: Any, tokenizer: Any):
+        self.key = key
+        self.model = model
+        self.tokenizer = tokenizer
+        self._registry = registry
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._registry._release(self.key)
+            self.model = None
+            self.tokenizer = None
+
+
+class _Entry:
+    """Загруженная модель и число выданных ссылок"""
+
+    def __init__(self):
+        self.model = None
+        self.tokenizer = None
+        self.refcount = 0
+        self.lock = threading.Lock()
+        # Ошибка загрузки: запросы, ждавшие эту загрузку, не повторяют ее
+        self.error: Optional[Exception] = None
+
+
+class ModelRegistry:
+    """
+    Реестр загруженных моделей (один на процесс, см. get_model_registry)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[ModelKey, _Entry] = {}
+
+    def acquire(
+        self,
+        model_path,
+        device: str = "cpu",
+        dtype: Optional[str] = None
+    ) -> ModelHandle:
+        """
+        Возвращает общие модель и токенизатор, загружая их при первом запросе
+
+        Args:
+            model_path: локальный путь или идентификатор модели в HuggingFace Hub
+            device: устройство ('cuda', 'mps', 'cpu')
+            dtype: 'float32' / 'float16' / 'bfloat16' / 'int8' (только CPU)
+                или None (по устройству, см. default_dtype)
+
+        Returns:
+            ModelHandle
+
+        Raises:
+            ValueError: неизвестный dtype или int8 не на CPU
+            RuntimeError: загрузка, которую ждал запрос, завершилась ошибкой
+            Исключения загрузки transformers (модель не регистрируется)
+        """
+        dtype = dtype or default_dtype(device)
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Неизвестный dtype '{dtype}', допустимо: {', '.join(SUPPORTED_DTYPES)}")
+        if dtype == "int8" and device != "cpu":
+            raise ValueError("int8 квантизация поддерживается только на CPU")
+
+        key = ModelKey(normalize_model_path(model_path), dtype, device)
+
+        while True:
+            with self._lock:
+                entry = self._entries.setdefault(key, _Entry())
+                entry.refcount += 1
+
+            # Загрузка под блокировкой записи: параллельные запросы той же модели ждут
+            try:
+                with entry.lock:
+                    if entry.error is not None:
+                        raise RuntimeError(f"Не удалось загрузить LLM {key.path}: {entry.error}") from entry.error
+                    with self._lock:
+                        registered = self._entries.get(key) is entry
+                    if registered:
+                        if entry.model is None:
+                            try:
+                                entry.model, entry.tokenizer = self._load(key)
+                            except Exception as e:
+                                # Следующие запросы модели загружают ее заново
+                                entry.error = e
+                                with self._lock:
+                                    if self._entries.get(key) is entry:
+                                        del self._entries[key]
+                                raise
+                        return ModelHandle(self, key, entry.model, entry.tokenizer)
+            except Exception:
+                self._release(key, entry)
+                raise
+            # Запись выгрузили, пока запрос ждал блокировку — берем новую
+
+    def _load(self, key: ModelKey):
+        """Загружает модель и токенизатор"""
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        import torch
+
+        print(f"Загрузка LLM из {key.path} ({key.dtype}, {key.device})...")
+
+        tokenizer = AutoTokenizer.from_pretrained(key.path, trust_remote_code=True)
+        # int8: веса загружаются в float32 и квантуются после загрузки
+        load_dtype = "float32" if key.dtype == "int8" else key.dtype
+        model = AutoModelForCausalLM.from_pretrained(
+            key.path,
+            torch_dtype=getattr(torch, load_dtype),
+            device_map="auto" if key.device == "cuda" else None,
+            trust_remote_code=True,
+            low_cpu_mem_usage=True
+        )
+        if key.device != "cuda":
+            model = model.to(key.device)
+        model.eval()
+
+        if key.dtype == "int8":
+            torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+        print(f"✓ LLM загружена на {key.device}")
+        return model, tokenizer
+
+    def release(self, handle: ModelHandle):
+        """Освобождает ссылку на модель"""
+        handle.release()
+
+    def _release(self, key: ModelKey, entry: Optional[_Entry] = None):
+        """
+        Уменьшает число ссылок на модель и выгружает ее после последней
+
+        Args:
+            key: ключ модели
+            entry: запись, на которую взята ссылка (None — текущая запись ключа);
+                если ее уже нет в реестре, ничего не делает
+        """
+        with self._lock:
+            current = self._entries.get(key)
+            if current is None or (entry is not None and current is not entry):
+                return
+            entry = current
+            entry.refcount -= 1
+            if entry.refcount > 0:
+                return
+            del self._entries[key]
+
+        if entry.model is None:
+            # Модель так и не загрузилась
+            return
+        from src.llm_scheduler import release_scheduler
+        release_scheduler(entry.model)
+        entry.model = None
+        entry.tokenizer = None
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        print(f"🗑️ LLM выгружена: {key.path} ({key.dtype}, {key.device})")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Загруженные модели и число ссылок на них"""
+        with self._lock:
+            return [
+                {"path": key.path, "dtype": key.dtype, "device": key.device, "refcount": entry.refcount}
+                for key, entry in self._entries.items()
+                if entry.model is not None
+            ]
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Реестр моделей текущего процесса"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
+
+
+def acquire_model(model_path, device: str = "cpu", dtype: Optional[str] = None) -> ModelHandle:
+    """Сокращение для get_model_registry().acquire(...)"""
+    return get_model_registry().acquire(model_path, device=device, dtype=dtype)
@@ -0,0 +1,226 @@
+"""
+Персистентный кэш разбора запросов LLM (SQLite)
+
+Типовые запросы ("короб 200x200", "лоток 600 мм") приходят много раз за
+день, а каждый разбор через LLM занимает секунды. Кэш хранит проверенный
+JSON разбора по нормализованному запросу:
+- ключ включает версию (модель + текст промпта + параметры генерации),
+  поэтому правка промпта автоматически делает старые записи недоступными;
+- у записей есть TTL;
+- база в режиме WAL, поэтому ее одновременно используют все воркеры API;
+- чтение из кэша не пишет в базу: счетчики попаданий копятся в памяти и
+  записываются одной транзакцией не чаще раза в FLUSH_HITS_SECONDS.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from src.search_cache import normalize_query
+
+
+def normalize_parse_query(query: str) -> str:
+    """Нормализация запроса для ключа кэша: NFKC, пробелы, регистр"""
+    return normalize_query(query).lower()
+
+
+def make_version(*parts: str) -> str:
+    """Короткий отпечаток модели/промпта/параметров генерации для ключа кэша"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+class ParseCache:
+    """
+    Кэш: (версия, нормализованный запрос) -> разобранный JSON
+    """
+
+    # Как часто (в записях) удалять просроченные записи
+    PURGE_EVERY = 100
+
+    # Как часто записывать накопленные счетчики попаданий, секунд
+    FLUSH_HITS_SECONDS = 30.0
+
+    def __init__(self, db_path: str, version: str, ttl_seconds: float = 7 * 24 * 3600):
+        """
+        Args:
+            db_path: путь к файлу SQLite
+            version: версия модели/промпта (см. make_version)
+            ttl_seconds: время жизни записи
+        """
+        self.db_path = Path(db_path)
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._puts = 0
+        # (версия, запрос) -> попадания, еще не записанные в базу
+        self._pending_hits: Dict[Tuple[str, str], int] = {}
+        self._hits_flushed_at = time.monotonic()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS parse_cache (
+                version TEXT NOT NULL,
+                query TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (version, query)
+            )
+        ''')
+        conn.commit()
+        self.purge_expired()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=5.0, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, query: str) -> Optional[Dict]:
+        """
+        Возвращает разбор запроса из кэша
+
+        Args:
+            query: исходный запрос пользователя
+
+        Returns:
+            Dict разбора или None (нет записи, истек TTL, другая версия промпта)
+        """
+        key = normalize_parse_query(query)
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT result FROM parse_cache WHERE version = ? AND query = ? AND expires_at > ?',
+                (self.version, key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Кэш разбора недоступен: {e}")
+            row = None
+
+        with self._stats_lock:
+            if row is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                pending_key = (self.version, key)
+                self._pending_hits[pending_key] = self._pending_hits.get(pending_key, 0) + 1
+            flush = (
+                bool(self._pending_hits)
+                and time.monotonic() - self._hits_flushed_at >= self.FLUSH_HITS_SECONDS
+            )
+        if flush:
+            self.flush_hits()
+        return json.loads(row[0]) if row is not None else None
+
+    def flush_hits(self):
+        """Записывает накопленные счетчики попаданий одной транзакцией"""
+        with self._stats_lock:
+            pending, self._pending_hits = self._pending_hits, {}
+            self._hits_flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            conn = self._connect()
+            conn.executemany(
+                'UPDATE parse_cache SET hits = hits + ? WHERE version = ? AND query = ?',
+                [(count, version, query) for (version, query), count in pending.items()]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            # Счетчики — статистика: при ошибке они теряются, разбор не страдает
+            print(f"⚠️ Не удалось записать счетчики кэша разбора: {e}")
+
+    def put(self, query: str, result: Dict):
+        """
+        Сохраняет проверенный разбор запроса
+
+        Args:
+            query: исходный запрос пользователя
+            result: разобранный JSON (только успешный разбор LLM, не fallback)
+        """
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO parse_cache (version, query, result, created_at, expires_at, hits) '
+                'VALUES (?, ?, ?, ?, ?, 0)',
+                (self.version, normalize_parse_query(query), json.dumps(result, ensure_ascii=False),
+                 now, now + self.ttl_seconds)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Не удалось сохранить разбор в кэш: {e}")
+            return
+
+        with self._stats_lock:
+            self._puts += 1
+            purge = self._puts % self.PURGE_EVERY == 0
+        if purge:
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """
+        Удаляет просроченные записи
+
+        Записи старых версий промпта не удаляются сразу (во время
+        перезапуска воркеров версии могут сосуществовать) и уходят по TTL.
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.execute(
+                'DELETE FROM parse_cache WHERE expires_at <= ?',
+                (time.time(),)
+            )
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error:
+            return 0
+
+    def clear(self):
+        """Удаляет все записи"""
+        conn = self._connect()
+        conn.execute('DELETE FROM parse_cache')
+        conn.commit()
+
+    def stats(self) -> Dict:
+        """Метрики кэша: попадания этого процесса и суммарные по базе"""
+        self.flush_hits()
+        with self._stats_lock:
+            hits, misses = self._hits, self._misses
+
+        entries, total_hits = 0, 0
+        try:
+            row = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM parse_cache WHERE version = ?',
+                (self.version,)
+            ).fetchone()
+            entries, total_hits = row
+        except sqlite3.Error:
+            pass
+
+        lookups = hits + misses
+        return {
+            "version": self.version,
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "total_hits": total_hits
+        }
@@ -0,0 +1,225 @@
+"""
+Переиспользование KV-кэша статического префикса промпта
+
+Промпты LLM компонентов начинаются с длинного неизменного блока
+(системное сообщение + инструкции + формат ответа), а меняется только
+запрос пользователя в конце. Префикс прогоняется через модель один раз,
+его past_key_values сохраняются, и каждая генерация делает prefill только
+для переменного хвоста. На CPU это сокращает время до первого токена в
+разы.
+"""
+
+import copy
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+# Маркер места переменной части при рендеринге chat template
+_VARIABLE_MARKER = "\ue000"
+
+
+class PrefixKVCache:
+    """
+    KV-кэши статических префиксов для одной модели
+
+    Используйте get_prefix_cache(model, tokenizer): кэш общий для всех
+    компонентов, работающих с этой моделью.
+    """
+
+    def __init__(self, model: Any, tokenizer: Any, max_prefixes: int = 8):
+        """
+        Args:
+            model: модель transformers
+            tokenizer: ее токенизатор
+            max_prefixes: сколько разных префиксов держать в памяти (LRU)
+        """
+        # Слабая ссылка: кэш хранится в WeakKeyDictionary по модели и не должен ее удерживать
+        self._model_ref = weakref.ref(model)
+        self.tokenizer = tokenizer
+        self.max_prefixes = max_prefixes
+        # Сбрасывается, если transformers не умеет продолжать генерацию с кэшем
+        self.enabled = True
+        self._lock = threading.Lock()
+        # префикс (текст) -> (input_ids, past_key_values)
+        self._prefixes: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+        # Префиксы, чей сохраненный кэш сейчас дописывает generate
+        self._busy: Set[str] = set()
+        # (system, static_user) -> (текст префикса, хвост шаблона после переменной части)
+        self._templates: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+    @property
+    def model(self) -> Any:
+        return self._model_ref()
+
+    def split_prompt(self, system: str, static_user: str) -> Tuple[str, str]:
+        """
+        Делит отрендеренный chat template на статический префикс и хвост
+
+        Returns:
+            (префикс до переменной части, текст шаблона после нее)
+        """
+        key = (system, static_user)
+        split = self._templates.get(key)
+        if split is None:
+            text = self.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": static_user + _VARIABLE_MARKER}
+                ],
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            prefix, tail = text.split(_VARIABLE_MARKER, 1)
+            split = (prefix, tail)
+            self._templates[key] = split
+        return split
+
+    def _prefix_state(self, prefix_text: str) -> Tuple[Any, Any]:
+        """input_ids и past_key_values префикса (считаются один раз)"""
+        import torch
+
+        with self._lock:
+            state = self._prefixes.get(prefix_text)
+            if state is not None:
+                self._prefixes.move_to_end(prefix_text)
+                return state
+
+            prefix_ids = self.tokenizer(prefix_text, return_tensors="pt").input_ids.to(self.model.device)
+            with torch.no_grad():
+                outputs = self.model(input_ids=prefix_ids, use_cache=True)
+            state = (prefix_ids, outputs.past_key_values)
+
+            self._prefixes[prefix_text] = state
+            while len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+            return state
+
+    def build_input_ids(self, prefix_text: str, prefix_ids: Any, suffix_text: str) -> Optional[Any]:
+        """
+        input_ids полного промпта, если они начинаются с токенов префикса
+
+        Полный промпт токенизируется целиком: BPE может слить последние
+        символы префикса с первыми символами хвоста, и тогда токены префикса
+        (а значит, и его KV-кэш) не совпадают с началом промпта. В этом
+        случае возвращается None.
+        """
+        input_ids = self.tokenizer(prefix_text + suffix_text, return_tensors="pt").input_ids.to(self.model.device)
+        prefix_len = prefix_ids.shape[1]
+        if input_ids.shape[1] <= prefix_len or not bool((input_ids[:, :prefix_len] == prefix_ids).all()):
+            return None
+        return input_ids
+
+    def _checkout(self, prefix_text: str, prefix_cache: Any) -> Tuple[Any, bool]:
+        """
+        Кэш префикса для одной генерации
+
+        generate дописывает кэш на месте. Сохраненный кэш отдается без копии,
+        если его можно обрезать обратно до префикса (DynamicCache.crop) и он
+        не занят другой генерацией; иначе генерация получает копию.
+
+        Returns:
+            (past_key_values, True — это сохраненный кэш, его нужно вернуть через _checkin)
+        """
+        with self._lock:
+            if hasattr(prefix_cache, "crop") and prefix_text not in self._busy:
+                self._busy.add(prefix_text)
+                return prefix_cache, True
+        return copy.deepcopy(prefix_cache), False
+
+    def _checkin(self, prefix_text: str, prefix_cache: Any, prefix_len: int):
+        """Обрезает сохраненный кэш до префикса после генерации"""
+        try:
+            prefix_cache.crop(prefix_len)
+        except Exception:
+            # Кэш в неизвестном состоянии — префикс будет посчитан заново
+            with self._lock:
+                if self._prefixes.get(prefix_text, (None, None))[1] is prefix_cache:
+                    del self._prefixes[prefix_text]
+            raise
+        finally:
+            with self._lock:
+                self._busy.discard(prefix_text)
+
+    def generate(self, system: str, static_user: str, variable_user: str, **generate_kwargs) -> Optional[str]:
+        """
+        Генерирует ответ на промпт static_user + variable_user
+
+        Args:
+            system: системное сообщение
+            static_user: неизменная часть сообщения пользователя (инструкции)
+            variable_user: переменная часть (запрос, найденные товары)
+            **generate_kwargs: параметры model.generate
+
+        Returns:
+            str: декодированный ответ модели; None, если токены префикса не
+            совпадают с началом токенизации полного промпта
+        """
+        import torch
+
+        prefix_text, tail = self.split_prompt(system, static_user)
+        prefix_ids, prefix_cache = self._prefix_state(prefix_text)
+
+        input_ids = self.build_input_ids(prefix_text, prefix_ids, variable_user + tail)
+        if input_ids is None:
+            return None
+
+        past_key_values, owned = self._checkout(prefix_text, prefix_cache)
+        try:
+            output_ids = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                **generate_kwargs
+            )
+        finally:
+            if owned:
+                self._checkin(prefix_text, past_key_values, prefix_ids.shape[1])
+        return self.tokenizer.decode(output_ids[0][input_ids.shape[1]:], skip_special_tokens=True)
+
+    def clear(self):
+        with self._lock:
+            self._prefixes.clear()
+
+
+_caches: "weakref.WeakKeyDictionary[Any, PrefixKVCache]" = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def get_prefix_cache(model: Any, tokenizer: Any) -> PrefixKVCache:
+    """Общий кэш префиксов для модели (живет, пока жива модель)"""
+    with _caches_lock:
+        cache = _caches.get(model)
+        if cache is None:
+            cache = PrefixKVCache(model, tokenizer)
+            _caches[model] = cache
+        return cache
+
+
+def generate_with_prefix(
+    model: Any,
+    tokenizer: Any,
+    system: str,
+    static_user: str,
+    variable_user: str,
+    **generate_kwargs
+) -> Optional[str]:
+    """
+    Генерация с переиспользованием KV-кэша статического префикса
+
+    Если версия transformers не поддерживает продолжение генерации с
+    переданным кэшем или токенизация промпта на границе префикса не совпадает
+    с токенами префикса, возвращает None — вызывающий код делает обычную
+    генерацию полного промпта.
+    """
+    cache = get_prefix_cache(model, tokenizer)
+    if not cache.enabled:
+        return None
+    try:
+        return cache.generate(system, static_user, variable_user, **generate_kwargs)
+    except (TypeError, ValueError, AttributeError) as e:
+        print(f"⚠️ Переиспользование KV-кэша префикса недоступно: {e}")
+        cache.enabled = False
+        cache.clear()
+        return None
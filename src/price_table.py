@@ -0,0 +1,370 @@
+"""
+Таблица цен и остатков, хранящаяся отдельно от векторного индекса
+
+Цены меняются гораздо чаще, чем названия товаров, поэтому они лежат в
+небольшом файле prices.npz рядом с индексом (массивы id, cost, stock,
+отсортированные по id). Обновление прайс-листа переписывает только этот
+файл (атомарно, через os.replace); FAISS индекс, эмбеддинги и products.pkl
+не трогаются, а процессы, которые держат таблицу открытой, подхватывают
+новый файл при следующем обращении.
+
+Цены из прайс-листов (apply с base_costs) дополнительно записываются в
+price_overrides.json вместе с ценой каталога, поверх которой они применены.
+При пересборке таблицы (rebuild после /rebuild-db) они применяются заново,
+пока цена товара в каталоге не изменится.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Колонки прайс-листа с ценами (в нижнем регистре)
+ID_COLUMNS = ('id',)
+NAME_COLUMNS = ('товар', 'название', 'наименование', 'name')
+PRICE_COLUMNS = ('цена', 'стоимость', 'cost', 'price')
+STOCK_COLUMNS = ('остаток', 'наличие', 'stock')
+
+
+def _frozen(arrays: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Делает массивы таблицы доступными только для чтения"""
+    for array in arrays:
+        array.setflags(write=False)
+    return arrays
+
+
+def _positions(table_ids: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Позиции ID в отсортированном массиве table_ids и маска найденных"""
+    positions = np.searchsorted(table_ids, ids)
+    positions = np.minimum(positions, max(len(table_ids) - 1, 0))
+    found = (table_ids[positions] == ids) if len(table_ids) else np.zeros(len(ids), dtype=bool)
+    return positions, found
+
+
+class PriceTable:
+    """
+    Цены и остатки товаров по ID
+
+    Массивы неизменяемы (только для чтения): обновление собирает новые
+    массивы и подменяет кортеж одной операцией присваивания. Читатели берут
+    кортеж один раз за вызов, поэтому в других потоках всегда видят
+    согласованную версию без блокировок.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: путь к файлу prices.npz
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        # (ids, cost, stock) — ids отсортированы, stock = NaN если неизвестен
+        self._arrays: Tuple[np.ndarray, np.ndarray, np.ndarray] = (
+            np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        )
+        self._file_stamp: Optional[Tuple[int, int]] = None
+        # Цены из прайс-листов: id -> (цена каталога, цена, остаток), None = не задано
+        self.overrides_path = self.path.with_name('price_overrides.json')
+        self._overrides: Dict[int, Tuple[float, Optional[float], Optional[float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._arrays[0])
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def load(self) -> bool:
+        """
+        Загружает таблицу с диска
+
+        Returns:
+            bool: True, если файл существует и прочитан
+        """
+        self._overrides = self._read_overrides()
+        stamp = self._stamp()
+        if stamp is None:
+            return False
+        with np.load(self.path) as data:
+            arrays = (data['ids'], data['cost'], data['stock'])
+        self._arrays = _frozen(arrays)
+        self._file_stamp = stamp
+        return True
+
+    def _read_overrides(self) -> Dict[int, Tuple[float, Optional[float], Optional[float]]]:
+        if not self.overrides_path.exists():
+            return {}
+        with open(self.overrides_path, 'r', encoding='utf-8') as f:
+            return {int(pid): tuple(values) for pid, values in json.load(f).items()}
+
+    def _write_overrides(self, overrides: Dict[int, Tuple[float, Optional[float], Optional[float]]]):
+        """Атомарно записывает price_overrides.json (до prices.npz, см. load)"""
+        self.overrides_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.overrides_path.with_name(self.overrides_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(pid): list(values) for pid, values in overrides.items()}, f)
+        os.replace(tmp_path, self.overrides_path)
+        self._overrides = overrides
+
+    def catalog_costs(self) -> Dict[int, float]:
+        """Цены каталога для товаров, чья цена задана прайс-листом"""
+        self.refresh()
+        return {pid: base for pid, (base, cost, _) in self._overrides.items() if cost is not None}
+
+    def _reload_if_changed(self):
+        stamp = self._stamp()
+        if stamp is not None and stamp != self._file_stamp:
+            self.load()
+
+    def refresh(self):
+        """Перечитывает файл, если его подменил другой процесс"""
+        stamp = self._stamp()
+        if stamp is not None and stamp != self._file_stamp:
+            with self._lock:
+                self._reload_if_changed()
+
+    def _write(self, arrays: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        """Атомарно записывает массивы на диск и делает их текущими"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, ids=arrays[0], cost=arrays[1], stock=arrays[2])
+        os.replace(tmp_path, self.path)
+        self._arrays = _frozen(arrays)
+        self._file_stamp = self._stamp()
+
+    def rebuild(self, products: Iterable, keep_existing: bool = False):
+        """
+        Создает таблицу по товарам индекса
+
+        Цены и остатки из прайс-листов применяются заново. Если цена товара
+        в каталоге изменилась с момента применения прайс-листа, его цена
+        из прайс-листа отбрасывается (остаток сохраняется).
+
+        Args:
+            products: товары с полями id и cost (цены каталога)
+            keep_existing: сохранить цены и остатки товаров, которые уже есть
+                в таблице (инкрементальное обновление индекса); иначе цены
+                берутся из каталога, а остатки неизвестны
+        """
+        products = list(products)
+        ids = np.fromiter((p['id'] for p in products), dtype=np.int64, count=len(products))
+        cost = np.fromiter((p['cost'] for p in products), dtype=np.float64, count=len(products))
+        stock = np.full(len(ids), np.nan)
+        order = np.argsort(ids, kind='stable')
+        ids, cost, stock = ids[order], cost[order], stock[order]
+        catalog_cost = dict(zip(ids.tolist(), cost.tolist()))
+
+        with self._lock:
+            if keep_existing:
+                self._reload_if_changed()
+                old_ids, old_cost, old_stock = self._arrays
+                positions, found = _positions(old_ids, ids)
+                cost[found] = old_cost[positions[found]]
+                stock[found] = old_stock[positions[found]]
+            overrides = {}
+            for pid, (base, sheet_cost, sheet_stock) in self._overrides.items():
+                if pid not in catalog_cost:
+                    continue
+                if catalog_cost[pid] != base:
+                    base, sheet_cost = catalog_cost[pid], None
+                if sheet_cost is None and sheet_stock is None:
+                    continue
+                overrides[pid] = (base, sheet_cost, sheet_stock)
+            pos = np.searchsorted(ids, np.fromiter(overrides.keys(), dtype=np.int64, count=len(overrides)))
+            for p, (_, sheet_cost, sheet_stock) in zip(pos.tolist(), overrides.values()):
+                if sheet_cost is not None:
+                    cost[p] = sheet_cost
+                if sheet_stock is not None:
+                    stock[p] = sheet_stock
+            self._write_overrides(overrides)
+            self._write((ids, cost, stock))
+
+    def get(self, product_id: int) -> Optional[Tuple[float, Optional[float]]]:
+        """
+        Цена и остаток товара
+
+        Returns:
+            (cost, stock) или None, если товара нет в таблице; stock = None если неизвестен
+        """
+        self.refresh()
+        table_ids, cost, stock = self._arrays
+        positions, found = _positions(table_ids, np.array([product_id], dtype=np.int64))
+        if not found[0]:
+            return None
+        pos = positions[0]
+        return float(cost[pos]), (None if np.isnan(stock[pos]) else float(stock[pos]))
+
+    def costs_for(self, product_ids: List[int]) -> Dict[int, float]:
+        """Актуальные цены для списка ID (неизвестные ID пропускаются)"""
+        self.refresh()
+        table_ids, cost, _ = self._arrays
+        ids = np.asarray(product_ids, dtype=np.int64)
+        positions, found = _positions(table_ids, ids)
+        return dict(zip(ids[found].tolist(), cost[positions[found]].tolist()))
+
+    def apply(
+        self,
+        updates: Dict[int, Tuple[Optional[float], Optional[float]]],
+        base_costs: Optional[Dict[int, float]] = None
+    ) -> Dict[str, int]:
+        """
+        Применяет изменения цен/остатков и атомарно сохраняет таблицу
+
+        Args:
+            updates: product_id -> (cost, stock); None означает "не менять"
+            base_costs: цены каталога (product_id -> cost) для прайс-листа:
+                изменения запоминаются и переживают пересборку таблицы;
+                None — новые цены самого каталога, они отменяют цену из
+                прайс-листа для этих товаров
+
+        Returns:
+            Dict со счетчиками updated / unknown (ID, которых нет в таблице)
+        """
+        with self._lock:
+            self._reload_if_changed()
+            ids, cost, stock = self._arrays
+            cost = cost.copy()
+            stock = stock.copy()
+
+            update_ids = np.fromiter(updates.keys(), dtype=np.int64, count=len(updates))
+            positions, found = _positions(ids, update_ids)
+
+            overrides = dict(self._overrides)
+            updated = 0
+            for pid, pos, ok in zip(update_ids.tolist(), positions.tolist(), found.tolist()):
+                if not ok:
+                    continue
+                new_cost, new_stock = updates[pid]
+                if new_cost is not None:
+                    cost[pos] = new_cost
+                if new_stock is not None:
+                    stock[pos] = new_stock
+                updated += 1
+
+                base, sheet_cost, sheet_stock = overrides.get(pid, (None, None, None))
+                if base_costs is not None:
+                    overrides[pid] = (
+                        base_costs[pid] if base is None else base,
+                        sheet_cost if new_cost is None else new_cost,
+                        sheet_stock if new_stock is None else new_stock
+                    )
+                elif pid in overrides and new_cost is not None:
+                    if sheet_stock is None:
+                        del overrides[pid]
+                    else:
+                        overrides[pid] = (new_cost, None, sheet_stock)
+
+            if updated:
+                if overrides != self._overrides:
+                    self._write_overrides(overrides)
+                self._write((ids, cost, stock))
+
+        return {"updated": updated, "unknown": int((~found).sum())}
+
+
+def read_price_sheet(filepath: str, name_to_id: Dict[str, int]) -> Tuple[Dict[int, Tuple[Optional[float], Optional[float]]], List[str]]:
+    """
+    Читает прайс-лист поставщика с новыми ценами
+
+    Товар определяется по колонке id или по названию (Товар / Название /
+    Наименование...), цена — по колонке Цена / Стоимость, остаток — по
+    необязательной колонке Остаток / Наличие. Цены и названия разбираются
+    так же, как в DataLoader.
+
+    Args:
+        filepath: путь к CSV файлу
+        name_to_id: название товара -> ID (из индекса)
+
+    Returns:
+        Tuple (product_id -> (cost, stock), список нераспознанных названий)
+    """
+    from src.data_loader import DataLoader
+
+    df = pd.read_csv(filepath, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+    columns = {column.strip().lower(): column for column in df.columns}
+
+    def find(candidates):
+        for candidate in candidates:
+            for key, column in columns.items():
+                if key.startswith(candidate):
+                    return column
+        return None
+
+    id_column = find(ID_COLUMNS)
+    name_column = find(NAME_COLUMNS)
+    price_column = find(PRICE_COLUMNS)
+    stock_column = find(STOCK_COLUMNS)
+
+    if price_column is None and stock_column is None:
+        raise ValueError(f"В прайс-листе нет колонки с ценой или остатком: {list(df.columns)}")
+    if id_column is None and name_column is None:
+        raise ValueError(f"В прайс-листе нет колонки с ID или названием товара: {list(df.columns)}")
+
+    loader = DataLoader()
+    if price_column:
+        # Пустая ячейка цены означает "цену не менять", а не 0
+        blank = (df[price_column].str.strip() == '').tolist()
+        parsed = loader.parse_price_series(df[price_column]).tolist()
+        costs = [None if is_blank else cost for is_blank, cost in zip(blank, parsed)]
+    else:
+        costs = [None] * len(df)
+    stocks = (
+        pd.to_numeric(df[stock_column].str.replace(',', '.').str.strip(), errors='coerce').tolist()
+        if stock_column else [None] * len(df)
+    )
+
+    if id_column is not None:
+        keys = pd.to_numeric(df[id_column], errors='coerce').tolist()
+        labels = df[id_column].tolist()
+        resolved = [int(key) if key == key else None for key in keys]
+    else:
+        labels = loader.clean_product_name_series(df[name_column]).tolist()
+        resolved = [name_to_id.get(name) for name in labels]
+
+    updates: Dict[int, Tuple[Optional[float], Optional[float]]] = {}
+    unmatched: List[str] = []
+    for pid, label, cost, stock in zip(resolved, labels, costs, stocks):
+        if pid is None:
+            unmatched.append(label)
+            continue
+        stock = None if stock is None or stock != stock else float(stock)
+        updates[pid] = (cost, stock)
+
+    return updates, unmatched
+
+
+if __name__ == "__main__":
+    import argparse
+    import pickle
+
+    parser = argparse.ArgumentParser(description="Применение прайс-листа с новыми ценами без пересборки индекса")
+    parser.add_argument("price_sheet", help="CSV с колонками id или Товар/Название и Цена (и необязательно Остаток)")
+    parser.add_argument("--index-dir", default="data/index_e5", help="Директория векторного индекса")
+    args = parser.parse_args()
+
+    index_dir = Path(args.index_dir)
+    with open(index_dir / "products.pkl", 'rb') as f:
+        products = pickle.load(f)
+
+    table = PriceTable(index_dir / "prices.npz")
+    if not table.load():
+        table.rebuild(products)
+
+    updates, unmatched = read_price_sheet(args.price_sheet, {p['name']: p['id'] for p in products})
+    result = table.apply(updates)
+
+    print(f"✓ Обновлено цен: {result['updated']}")
+    if result['unknown'] or unmatched:
+        print(f"⚠️ Не найдено в индексе: {result['unknown'] + len(unmatched)}")
@@ -0,0 +1,161 @@
+"""
+Кластеризация почти одинаковых товаров (вариантов одного SKU) при построении индекса
+"""
+
+import re
+from typing import List, Dict, Tuple
+
+import numpy as np
+
+
+# Хвосты, которые не меняют сам товар ("или аналог", "или эквивалент")
+_ANALOG_SUFFIX_RE = re.compile(r'\s*,?\s*(или|либо)\s+(аналог|эквивалент)\w*\.?\s*$')
+# Все числовые/артикульные токены: размеры, резьба, артикулы
+_SPEC_TOKEN_RE = re.compile(r'[a-zа-я]*\d+[a-zа-я\d]*')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_product_name(name: str) -> str:
+    """
+    Нормализует название товара для сравнения вариантов
+
+    Приводит к нижнему регистру, убирает "или аналог", пунктуацию и лишние
+    пробелы, унифицирует латинскую/кириллическую "x" в размерах.
+
+    Args:
+        name: исходное название товара
+
+    Returns:
+        str: нормализованное название
+    """
+    name = str(name or '').lower().replace('ё', 'е')
+    name = _ANALOG_SUFFIX_RE.sub('', name)
+    # 200х200 (кириллица) -> 200x200, М6 (кириллица) -> m6
+    name = re.sub(r'(?<=\d)х(?=\d)', 'x', name)
+    name = re.sub(r'\bм(?=\d)', 'm', name)
+    name = _PUNCT_RE.sub(' ', name)
+    return _SPACES_RE.sub(' ', name).strip()
+
+
+def extract_spec_tokens(normalized_name: str) -> frozenset:
+    """
+    Извлекает токены с цифрами (размеры, резьба, артикулы)
+
+    Два товара с разными наборами таких токенов никогда не объединяются,
+    даже при высокой косинусной близости (М6 и М8, 100x100 и 200x200).
+    """
+    return frozenset(_SPEC_TOKEN_RE.findall(normalized_name))
+
+
+class NearDuplicateClusterer:
+    """
+    Группирует варианты одного товара под одним представителем
+
+    Товар присоединяется к группе, только если он сам похож на ее
+    представителя (первый товар группы в каталоге), а не на любого ее
+    участника: иначе цепочка A~B~C объединила бы A и C, которые друг на
+    друга не похожи. Правила сравнения с представителем:
+    1. Совпадают цены (товары с разной ценой никогда не объединяются), и
+    2. Совпадают нормализованные названия, или
+    3. Косинусная близость эмбеддингов >= similarity_threshold
+       И совпадают числовые/артикульные токены
+    """
+
+    def __init__(self, similarity_threshold: float = 0.97, block_size: int = 1024):
+        """
+        Args:
+            similarity_threshold: порог косинусной близости (эмбеддинги нормализованы)
+            block_size: размер блока при попарном сравнении эмбеддингов
+        """
+        self.similarity_threshold = similarity_threshold
+        self.block_size = block_size
+
+    def cluster(self, products: List[Dict], embeddings: np.ndarray) -> List[List[int]]:
+        """
+        Находит группы почти одинаковых товаров
+
+        Товары просматриваются в порядке каталога; каждый присоединяется к
+        самому близкому подходящему представителю или сам становится
+        представителем новой группы.
+
+        Args:
+            products: список товаров (в том же порядке, что и эмбеддинги)
+            embeddings: нормализованные эмбеддинги товаров (n x dim)
+
+        Returns:
+            List групп (индексы товаров); первый индекс группы - представитель
+        """
+        n = len(products)
+        normalized = [normalize_product_name(p.get('name', '')) for p in products]
+        spec_tokens = [extract_spec_tokens(name) for name in normalized]
+        costs = [p.get('cost') for p in products]
+
+        # Индекс представителя для каждого товара
+        leader = list(range(n))
+        # (название, цена) представителя -> его индекс
+        leader_by_name: Dict[Tuple[str, object], int] = {}
+
+        vectors = np.asarray(embeddings, dtype=np.float32) if embeddings is not None and n > 1 else None
+        block_size = self.block_size if vectors is not None else max(n, 1)
+
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            # Близость товаров блока ко всем товарам до них (с представителями сравниваются только они)
+            sims = vectors[start:stop] @ vectors[:stop].T if vectors is not None else None
+
+            for i in range(start, stop):
+                key = (normalized[i], costs[i])
+                rep = leader_by_name.get(key)
+
+                if rep is None and sims is not None:
+                    row = sims[i - start, :i]
+                    best = -1.0
+                    for j in np.nonzero(row >= self.similarity_threshold)[0].tolist():
+                        if (
+                            leader[j] == j
+                            and costs[j] == costs[i]
+                            and spec_tokens[j] == spec_tokens[i]
+                            and row[j] > best
+                        ):
+                            rep, best = j, row[j]
+
+                if rep is None:
+                    leader_by_name.setdefault(key, i)
+                else:
+                    leader[i] = rep
+
+        groups: Dict[int, List[int]] = {}
+        for i in range(n):
+            groups.setdefault(leader[i], []).append(i)
+
+        return [members for _, members in sorted(groups.items())]
+
+    def collapse(
+        self,
+        products: List[Dict],
+        embeddings: np.ndarray
+    ) -> Tuple[List[Dict], np.ndarray, Dict[int, List[Dict]]]:
+        """
+        Схлопывает варианты: оставляет по одному представителю на группу
+
+        Args:
+            products: список товаров
+            embeddings: нормализованные эмбеддинги товаров
+
+        Returns:
+            Tuple (представители, их эмбеддинги, {id представителя: варианты})
+        """
+        groups = self.cluster(products, embeddings)
+
+        representative_positions = [members[0] for members in groups]
+        representatives = [products[i] for i in representative_positions]
+        rep_embeddings = np.asarray(embeddings)[representative_positions]
+
+        variants = {}
+        for members in groups:
+            if len(members) > 1:
+                rep_id = products[members[0]]['id']
+                variants[rep_id] = [products[i] for i in members[1:]]
+
+        return representatives, rep_embeddings, variants
@@ -0,0 +1,131 @@
+"""
+Компактная неизменяемая запись товара
+
+ProductRecord заменяет словари из DataFrame.to_dict('records') на всем пути
+от каталога до API: поля хранятся в __slots__ (без __dict__ на каждую
+строку), доступны и как атрибуты (product.id), и как ключи словаря
+(product['id'], product.get('cost')), поэтому существующий код работает
+без изменений.
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List
+
+import pandas as pd
+
+
+class ProductRecord(Mapping):
+    """
+    Товар каталога (id, название, цена, категория)
+
+    Неизменяемый: обновленная цена — это новая запись (см. replace).
+    Порядок полей совпадает с колонками каталога, поэтому dict(product)
+    и JSON-представление совпадают с прежними словарями.
+    """
+
+    __slots__ = ('name', 'cost', 'category', 'id')
+
+    def __init__(self, name: str, cost: float, category: str, id: int):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'cost', cost)
+        object.__setattr__(self, 'category', category)
+        object.__setattr__(self, 'id', id)
+
+    @classmethod
+    def from_mapping(cls, data: Mapping) -> 'ProductRecord':
+        """
+        Создает запись из словаря (например, из старого products.pkl)
+
+        Старые индексы хранят цену под ключом 'price' (до переименования
+        колонки в 'cost'), она используется, если 'cost' нет.
+        """
+        if isinstance(data, cls):
+            return data
+        cost = data.get('cost')
+        if cost is None:
+            cost = data.get('price', 0.0)
+        return cls(data.get('name', ''), cost, data.get('category', ''), data.get('id'))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> List['ProductRecord']:
+        """
+        Записи для всех строк каталога
+
+        Колонки читаются целиком (tolist дает нативные типы Python), без
+        промежуточного словаря на каждую строку.
+
+        Args:
+            df: каталог с колонками name, cost, category, id
+        """
+        return list(map(
+            cls,
+            df['name'].tolist(),
+            df['cost'].tolist(),
+            df['category'].tolist(),
+            df['id'].tolist()
+        ))
+
+    def replace(self, **changes) -> 'ProductRecord':
+        """Копия записи с измененными полями"""
+        values = {field: getattr(self, field) for field in self.__slots__}
+        values.update(changes)
+        return ProductRecord(**values)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    # --- Неизменяемость ---
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ProductRecord неизменяем, используйте replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("ProductRecord неизменяем")
+
+    def __reduce__(self):
+        return (ProductRecord, (self.name, self.cost, self.category, self.id))
+
+    # --- Интерфейс словаря ---
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__slots__
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ProductRecord):
+            return (
+                self.id == other.id and self.name == other.name
+                and self.cost == other.cost and self.category == other.category
+            )
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self) -> int:
+        return hash((self.id, self.name, self.cost, self.category))
+
+    def __repr__(self) -> str:
+        return (
+            f"ProductRecord(id={self.id!r}, name={self.name!r}, "
+            f"cost={self.cost!r}, category={self.category!r})"
+        )
+
+
+def json_default(obj: Any) -> Any:
+    """
+    Обработчик default для json.dump: сериализует ProductRecord как словарь
+
+    Пример:
+        json.dump(response, f, ensure_ascii=False, default=json_default)
+    """
+    if isinstance(obj, ProductRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
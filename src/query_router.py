@@ -0,0 +1,179 @@
+"""
+Маршрутизация запросов: простые запросы разбираются без LLM
+
+Запросы вида "Гайка М6" или "Короб 200x200" — один товар известного типа
+с явной спецификацией — эвристика разбирает так же, как LLM, но без
+нескольких секунд генерации. Роутер оценивает уверенность эвристического
+разбора и отправляет в LLM только составные и неоднозначные запросы.
+Доля запросов по каждому маршруту и их задержка собираются в stats().
+"""
+
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, List, Optional
+
+from src.query_enhancement import QueryEnhancer
+
+
+# Признаки запроса, который нужно понимать, а не разбирать по шаблону
+AMBIGUOUS_MARKERS = ('?', 'какой', 'какая', 'какие', 'нужн', 'подбер', 'посовет', 'чтобы', ' для ', ' или ')
+
+# Признаки второй позиции в запросе ("лоток с крышкой", "гайка + шайба")
+COMPOUND_MARKERS = (' с ', ' со ', ' и ', '+', ' плюс ')
+
+# Дополнительные типы товаров (кроме синонимов QueryEnhancer)
+EXTRA_PRODUCT_TYPES = ('шайба', 'шайбы', 'крышки', 'гайки', 'короба')
+
+# Крепеж ищется с большим числом альтернатив (как в правилах промпта LLMRequestParser)
+FASTENER_STEMS = ('винт', 'болт', 'гайк', 'шайб', 'шуруп')
+
+_SPEC_PATTERN = re.compile(r'\d+\s*[xх×*]\s*\d+|\bм\d+|\d+\s*(?:мм|см|м)\b|\bip\d+', re.IGNORECASE)
+_QUANTITY_PATTERN = re.compile(r'(\d+)\s*(?:шт\.?|штук[аи]?)(?=\s|$)|^(\d+)\s+(?=[а-яё])', re.IGNORECASE)
+
+
+def _stem(word: str) -> str:
+    """Грубая основа слова: без гласной/мягкого знака в конце"""
+    word = word.lower()
+    return word[:-1] if len(word) > 3 and word[-1] in 'аяыиеоуьй' else word
+
+
+@dataclass
+class RouteDecision:
+    """Решение роутера по запросу"""
+    use_llm: bool
+    confidence: float
+    # Эвристический разбор в формате LLMRequestParser (для быстрого пути)
+    parsed: Optional[Dict] = None
+    reasons: List[str] = field(default_factory=list)
+
+
+class QueryRouter:
+    """
+    Оценивает уверенность эвристического разбора запроса
+
+    Уверенность складывается из признаков: один товар, известный тип
+    товара, явная спецификация, явное количество. Если она не ниже
+    порога, запрос идет по быстрому пути без LLM.
+    """
+
+    # Сколько последних задержек хранить для перцентилей
+    LATENCY_WINDOW = 1000
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        known_types: Optional[Iterable[str]] = None,
+        enhancer: Optional[QueryEnhancer] = None
+    ):
+        """
+        Args:
+            threshold: минимальная уверенность для разбора без LLM
+            known_types: названия типов товаров (например, категории каталога);
+                по умолчанию синонимы QueryEnhancer
+            enhancer: анализатор намерения запроса
+        """
+        self.threshold = threshold
+        self.enhancer = enhancer or QueryEnhancer()
+
+        if known_types is None:
+            known_types = [s for synonyms in QueryEnhancer.PRODUCT_SYNONYMS.values() for s in synonyms]
+            known_types += EXTRA_PRODUCT_TYPES
+        self.known_stems = {_stem(t.split()[0]) for t in known_types if t.strip()}
+
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def route(self, query: str) -> RouteDecision:
+        """
+        Решает, нужен ли LLM для разбора запроса
+
+        Args:
+            query: запрос пользователя
+
+        Returns:
+            RouteDecision; для быстрого пути parsed содержит разбор
+        """
+        query = query.strip()
+        query_lower = query.lower()
+        intent = self.enhancer.analyze_intent(query)
+
+        if intent.intent_type in ('assembly', 'multi_item'):
+            return RouteDecision(True, 0.0, reasons=[f"составной запрос ({intent.intent_type})"])
+        if any(marker in f" {query_lower} " for marker in COMPOUND_MARKERS):
+            return RouteDecision(True, 0.0, reasons=["составной запрос (несколько позиций)"])
+        if any(marker in f" {query_lower} " for marker in AMBIGUOUS_MARKERS):
+            return RouteDecision(True, 0.3, reasons=["неоднозначная формулировка"])
+
+        confidence = 0.4
+        reasons = ["один товар"]
+
+        quantity_match = _QUANTITY_PATTERN.search(query)
+        name = query
+        quantity = 1
+        if quantity_match:
+            quantity = int(quantity_match.group(1) or quantity_match.group(2))
+            name = (query[:quantity_match.start()] + query[quantity_match.end():]).strip(' ,.')
+            confidence += 0.1
+            reasons.append("явное количество")
+
+        words = re.findall(r'[а-яёa-z]+(?:-[а-яёa-z]+)*', name.lower())
+        product_stem = _stem(words[0]) if words else ''
+        # Второй известный тип товара ("Короб 200x200 крышка") — несколько позиций
+        if any(_stem(word) in self.known_stems and _stem(word) != product_stem for word in words[1:]):
+            return RouteDecision(True, 0.0, reasons=["составной запрос (несколько типов товаров)"])
+        if product_stem in self.known_stems:
+            confidence += 0.3
+            reasons.append("известный тип товара")
+
+        spec_match = _SPEC_PATTERN.search(name)
+        if spec_match:
+            confidence += 0.2
+            reasons.append("явная спецификация")
+
+        if len(name.split()) > 8:
+            confidence -= 0.2
+            reasons.append("длинный запрос")
+
+        confidence = round(min(confidence, 1.0), 2)
+        if confidence < self.threshold or not name:
+            return RouteDecision(True, confidence, reasons=reasons)
+
+        parsed = {
+            "items": [{
+                "name": name,
+                "quantity": quantity,
+                "specifications": spec_match.group(0) if spec_match else "",
+                "top_k": 5 if product_stem.startswith(FASTENER_STEMS) else 3
+            }],
+            "confidence": confidence,
+            "analysis": "Простой запрос, разбор без LLM: " + ", ".join(reasons)
+        }
+        return RouteDecision(False, confidence, parsed=parsed, reasons=reasons)
+
+    def record(self, route: str, seconds: float):
+        """Учитывает обработанный запрос (маршрут и полное время обработки)"""
+        with self._lock:
+            self._counts[route] = self._counts.get(route, 0) + 1
+            self._latencies.setdefault(route, deque(maxlen=self.LATENCY_WINDOW)).append(seconds)
+
+    def stats(self) -> Dict:
+        """Доля запросов по маршрутам и их задержка (по последним LATENCY_WINDOW)"""
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = {route: sorted(values) for route, values in self._latencies.items()}
+
+        total = sum(counts.values())
+        routes = {}
+        for route, count in counts.items():
+            values = latencies[route]
+            routes[route] = {
+                "count": count,
+                "share": count / total if total else 0.0,
+                "avg_ms": 1000 * sum(values) / len(values),
+                "p50_ms": 1000 * values[len(values) // 2],
+                "p95_ms": 1000 * values[min(int(len(values) * 0.95), len(values) - 1)],
+            }
+        return {"total": total, "threshold": self.threshold, "routes": routes}
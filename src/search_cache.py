@@ -0,0 +1,132 @@
+"""
+Кэш результатов векторного поиска, привязанный к версии индекса
+"""
+
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Tuple, Optional, Hashable
+
+
+# Оценка памяти на один результат: кортеж (id, score) + int + float
+_RESULT_ENTRY_BYTES = 56 + 28 + 24
+
+
+def normalize_query(query: str) -> str:
+    """
+    Нормализует запрос для ключа кэша
+
+    Unicode NFKC + схлопывание пробелов. Регистр не меняется, так как
+    эмбеддинг-модель чувствительна к регистру.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+class SearchResultCache:
+    """
+    LRU-кэш: (нормализованный запрос, top_k, порог, фильтры) -> [(id товара, score)]
+
+    Каждая запись хранит версию индекса, с которой она была посчитана.
+    Запись с другой версией считается промахом и удаляется, поэтому любая
+    пересборка или инкрементальное обновление индекса инвалидирует кэш
+    атомарно, без явной очистки.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_entries: максимальное число записей
+            max_bytes: ограничение на (оценочный) объем памяти
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[str, List[Tuple[int, float]], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        query: str,
+        top_k: int,
+        score_threshold: float,
+        filters: Optional[Tuple] = None
+    ) -> Tuple:
+        """Формирует ключ кэша"""
+        return (normalize_query(query), int(top_k), float(score_threshold), filters or ())
+
+    @staticmethod
+    def _entry_size(key: Tuple, results: List[Tuple[int, float]]) -> int:
+        return sys.getsizeof(key[0]) + len(results) * _RESULT_ENTRY_BYTES + 200
+
+    def get(self, key: Tuple, index_version: str) -> Optional[List[Tuple[int, float]]]:
+        """
+        Возвращает результаты из кэша или None
+
+        Args:
+            key: ключ из make_key()
+            index_version: текущая версия индекса
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            version, results, size = entry
+            if version != index_version:
+                # Запись от старой версии индекса
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return results
+
+    def put(self, key: Tuple, index_version: str, results: List[Tuple[int, float]]):
+        """
+        Сохраняет результаты поиска
+
+        Args:
+            key: ключ из make_key()
+            index_version: версия индекса, на которой получены результаты
+            results: список (id товара, score)
+        """
+        size = self._entry_size(key, results)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (index_version, results, size)
+            self._bytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        """Очищает кэш"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
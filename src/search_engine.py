@@ -1,22 +1,93 @@
 """
 Модуль векторного поиска с использованием FAISS и sentence-transformers
+
+Поиск выполняется из пула потоков API параллельно с /rebuild-db и
+/prices/apply. Все, что адресуется позициями FAISS индекса (сам индекс,
+ID товаров, эмбеддинги, записи товаров, версия), хранится в одном
+неизменяемом _IndexState: обновление собирает новое состояние рядом со
+старым и публикует его одним присваиванием ссылки, а поиск берет ссылку
+на состояние один раз и до конца работает с одной версией индекса.
 """
 
 import numpy as np
 import pickle
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, replace
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Any, List, Dict, Tuple, Optional
 import pandas as pd
 
+from src.search_cache import SearchResultCache
+from src.product_record import ProductRecord
+from src.price_table import PriceTable, read_price_sheet
+from src.catalog_diff import CatalogDiff, diff_catalogs
+from src.catalog_snapshot import catalog_fingerprint
+
+
+@dataclass(frozen=True)
+class _IndexState:
+    """
+    Одна версия индекса
+    
+    Позиции FAISS индекса совпадают с product_ids, строками embeddings и
+    (если записи загружены) products. После публикации состояние не
+    меняется: FAISS индекс только читается (search), а обновления
+    собирают новое состояние.
+    """
+    index: Any = None
+    product_ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    id_to_pos: Dict[int, int] = field(default_factory=dict)
+    embeddings: Optional[np.ndarray] = None
+    # Группы вариантов: id представителя -> список вариантов
+    variant_groups: Dict[int, List[ProductRecord]] = field(default_factory=dict)
+    # Версия из manifest.json (ключ кэша результатов поиска)
+    version: Optional[str] = None
+    # Отпечаток каталога, по которому построен индекс (None — неизвестен)
+    catalog_fingerprint: Optional[str] = None
+    # Записи товаров по позициям индекса (None — выгружены, см. _loaded_state)
+    products: Optional[List[ProductRecord]] = None
+    
+    @classmethod
+    def create(
+        cls,
+        index: Any,
+        products: List[ProductRecord],
+        embeddings: Optional[np.ndarray],
+        variant_groups: Dict[int, List[ProductRecord]],
+        fingerprint: Optional[str],
+        version: Optional[str] = None
+    ) -> '_IndexState':
+        """Состояние для индекса и товаров по его позициям"""
+        product_ids = np.fromiter((p['id'] for p in products), dtype=np.int64, count=len(products))
+        return cls(
+            index=index,
+            product_ids=product_ids,
+            id_to_pos={pid: i for i, pid in enumerate(product_ids.tolist())},
+            embeddings=embeddings,
+            variant_groups=variant_groups,
+            version=version,
+            catalog_fingerprint=fingerprint,
+            products=list(products)
+        )
+
 
 class VectorSearchEngine:
     """Класс для векторного поиска товаров"""
     
     def __init__(
-        self, 
+        self,
         model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
         index_dir: str = "data/index",
-        device: str = "cpu"
+        device: str = "cpu",
+        collapse_duplicates: bool = False,
+        duplicate_threshold: float = 0.97,
+        result_cache_size: int = 10000,
+        result_cache_bytes: int = 64 * 1024 * 1024,
+        catalog=None
     ):
         """
         Инициализация поискового движка
@@ -26,6 +97,15 @@ class VectorSearchEngine:
                 По умолчанию: all-MiniLM-L6-v2 (стабильная, быстрая модель)
             index_dir: директория для сохранения индекса
             device: устройство для вычислений (cpu/cuda/mps)
+            collapse_duplicates: схлопывать почти одинаковые товары (варианты SKU)
+                в один вектор при построении индекса
+            duplicate_threshold: порог косинусной близости для схлопывания
+            result_cache_size: максимум записей в кэше результатов (0 = без кэша)
+            result_cache_bytes: ограничение памяти кэша результатов
+            catalog: источник актуальных строк каталога с методом
+                get_products_by_ids (например, DataLoader с backend="sqlite");
+                если задан, найденные товары читаются из него по ID, а записи
+                товаров индекса (products.pkl) не держатся в памяти — только ID
         """
         self.model_name = model_name
         self.index_dir = Path(index_dir)
@@ -35,12 +115,57 @@ class VectorSearchEngine:
         # Отложенная загрузка модели
         self.model = None
         self.dimension = None
-        self.index = None
-        self.products = None
-        self.product_embeddings = None
+        
+        # Текущая версия индекса; подменяется целиком (см. _publish)
+        self._state = _IndexState()
+        # Обновления индекса и цен выполняются по одному; поиск блокировку не берет
+        self._write_lock = threading.RLock()
+        
+        self.collapse_duplicates = collapse_duplicates
+        self.duplicate_threshold = duplicate_threshold
+        
+        self._catalog_mismatch_reported = False
+        self.result_cache = (
+            SearchResultCache(max_entries=result_cache_size, max_bytes=result_cache_bytes)
+            if result_cache_size > 0 else None
+        )
+        self.catalog = catalog
+        
+        # Цены и остатки хранятся отдельно от индекса (prices.npz)
+        self.prices = PriceTable(self.index_dir / "prices.npz")
         
         print(f"Инициализация векторного поиска (модель: {model_name})...")
         
+    # --- Текущая версия индекса (только чтение) ---
+    
+    @property
+    def index(self) -> Any:
+        return self._state.index
+        
+    @property
+    def products(self) -> Optional[List[ProductRecord]]:
+        return self._state.products
+        
+    @property
+    def product_ids(self) -> np.ndarray:
+        return self._state.product_ids
+        
+    @property
+    def product_embeddings(self) -> Optional[np.ndarray]:
+        return self._state.embeddings
+        
+    @property
+    def variant_groups(self) -> Dict[int, List[ProductRecord]]:
+        return self._state.variant_groups
+        
+    @property
+    def index_version(self) -> Optional[str]:
+        return self._state.version
+        
+    @property
+    def catalog_fingerprint(self) -> Optional[str]:
+        return self._state.catalog_fingerprint
+        
     def _load_model(self):
         """Загружает модель при первом использовании"""
         if self.model is not None:
@@ -93,85 +218,483 @@ class VectorSearchEngine:
         """
         Создает векторный индекс для товаров
         
+        Новый индекс собирается рядом с текущим: поиск до публикации идет
+        по предыдущей версии.
+        
         Args:
             products_df: DataFrame с товарами
             force_rebuild: принудительно пересоздать индекс
         """
-        # Загружаем модель если еще не загружена
-        self._load_model()
+        with self._write_lock:
+            # Загружаем модель если еще не загружена
+            self._load_model()
         
-        # Импортируем FAISS и tqdm
-        import faiss
-        from tqdm import tqdm
+            # Импортируем FAISS
+            import faiss
         
-        index_path = self.index_dir / "faiss.index"
-        products_path = self.index_dir / "products.pkl"
-        embeddings_path = self.index_dir / "embeddings.npy"
+            index_path = self.index_dir / "faiss.index"
+            products_path = self.index_dir / "products.pkl"
         
-        # Проверяем существование индекса
-        if not force_rebuild and index_path.exists() and products_path.exists():
-            print("Загрузка существующего индекса...")
-            self.load_index()
-            return
+            # Проверяем существование индекса
+            if not force_rebuild and index_path.exists() and products_path.exists():
+                print("Загрузка существующего индекса...")
+                self.load_index()
+                return
         
-        print("Создание нового индекса...")
-        self.products = products_df.to_dict('records')
+            print("Создание нового индекса...")
+            products = ProductRecord.from_frame(products_df)
         
-        # Создаем тексты для эмбеддинга
-        texts = [self.create_search_text(p) for p in self.products]
+            # Создаем тексты для эмбеддинга
+            texts = [self.create_search_text(p) for p in products]
         
-        # Генерируем эмбеддинги с прогресс-баром
-        print("Генерация эмбеддингов...")
-        self.product_embeddings = self.model.encode(
-            texts,
-            show_progress_bar=True,
-            convert_to_numpy=True,
-            normalize_embeddings=True,  # Нормализация для cosine similarity
-            device=self.device
-        )
+            # Генерируем эмбеддинги с прогресс-баром
+            print("Генерация эмбеддингов...")
+            embeddings = self.model.encode(
+                texts,
+                show_progress_bar=True,
+                convert_to_numpy=True,
+                normalize_embeddings=True,  # Нормализация для cosine similarity
+                device=self.device
+            )
         
-        # Создаем FAISS индекс
-        print("Создание FAISS индекса...")
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner Product (для нормализованных векторов = cosine)
-        self.index.add(self.product_embeddings)
+            # Схлопываем варианты одного товара в один вектор
+            variant_groups = {}
+            if self.collapse_duplicates:
+                from src.product_clustering import NearDuplicateClusterer
+            
+                print("Поиск почти одинаковых товаров...")
+                clusterer = NearDuplicateClusterer(similarity_threshold=self.duplicate_threshold)
+                products, embeddings, variant_groups = clusterer.collapse(products, embeddings)
+                collapsed = sum(len(v) for v in variant_groups.values())
+                print(f"Схлопнуто вариантов: {collapsed} (групп: {len(variant_groups)})")
+        
+            # Создаем FAISS индекс
+            print("Создание FAISS индекса...")
+            index = faiss.IndexFlatIP(self.dimension)  # Inner Product (для нормализованных векторов = cosine)
+            index.add(embeddings)
+        
+            # Сохраняем индекс
+            print("Сохранение индекса...")
+            self._save_index(_IndexState.create(
+                index, products, embeddings, variant_groups, catalog_fingerprint(products_df)
+            ))
+        
+            print(f"Индекс создан для {self.product_count()} товаров")
+    
+    def _save_index(self, state: _IndexState, keep_prices: bool = False):
+        """
+        Сохраняет все файлы новой версии индекса и публикует ее
+        
+        Вызывается под _write_lock. Поиск до публикации работает с прежним
+        состоянием в памяти и файлы индекса не читает.
+        
+        Args:
+            state: новая версия индекса (с записями товаров)
+            keep_prices: сохранить уже примененные цены для оставшихся товаров
+        """
+        import faiss
         
-        # Сохраняем индекс
-        print("Сохранение индекса...")
-        faiss.write_index(self.index, str(index_path))
+        faiss.write_index(state.index, str(self.index_dir / "faiss.index"))
+        self.prices.rebuild(state.products, keep_existing=keep_prices)
+        products, _ = self._priced_products(state.products)
+        self._save_products(products)
+        np.save(self.index_dir / "embeddings.npy", state.embeddings)
+        
+        groups_path = self.index_dir / "groups.pkl"
+        if state.variant_groups:
+            with open(groups_path, 'wb') as f:
+                pickle.dump(state.variant_groups, f)
+        elif groups_path.exists():
+            groups_path.unlink()
+        
+        # Манифест пишем последним: новая версия видна только после записи всех файлов
+        state = replace(state, products=products, version=uuid.uuid4().hex)
+        self._write_manifest(state)
+        self._publish(state)
+    
+    def _publish(self, state: _IndexState):
+        """
+        Делает состояние текущим одним присваиванием ссылки
         
-        with open(products_path, 'wb') as f:
-            pickle.dump(self.products, f)
+        Записи товаров выгружаются, если строки берутся из каталога той же
+        версии: остаются только ID по позициям индекса (product_ids); при
+        расхождении версий каталога и индекса записи нужны для результатов.
+        """
+        if (
+            state.products is not None and self.catalog is not None
+            and self._fingerprint_matches(self.catalog, state.catalog_fingerprint)
+        ):
+            state = replace(state, products=None)
+        self._state = state
+        
+    def _save_products(self, products: List[ProductRecord]):
+        """Атомарно сохраняет метаданные товаров (products.pkl)"""
+        products_path = self.index_dir / "products.pkl"
+        tmp_path = products_path.with_suffix(".pkl.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(products, f)
+        os.replace(tmp_path, products_path)
+    
+    def _read_products(self) -> List[ProductRecord]:
+        """Записи товаров из products.pkl (индексы старого формата хранят словари)"""
+        with open(self.index_dir / "products.pkl", 'rb') as f:
+            return [ProductRecord.from_mapping(p) for p in pickle.load(f)]
+    
+    def _loaded_state(self) -> _IndexState:
+        """
+        Текущее состояние с записями товаров (читаются из products.pkl, если выгружены)
         
-        np.save(embeddings_path, self.product_embeddings)
+        Файл читается под _write_lock: пока блокировка не захвачена
+        обновлением, products.pkl соответствует текущему состоянию.
+        """
+        state = self._state
+        if state.products is not None:
+            return state
+        with self._write_lock:
+            state = self._state
+            if state.products is None:
+                state = replace(state, products=self._read_products())
+                self._state = state
+            return state
+    
+    def product_count(self) -> int:
+        """Число товаров (векторов) в индексе"""
+        return len(self._state.product_ids)
+    
+    def _catalog_products(self, state: _IndexState) -> List[ProductRecord]:
+        """Товары состояния с ценами каталога (без цен из прайс-листов)"""
+        catalog_costs = self.prices.catalog_costs()
+        if not catalog_costs:
+            return list(state.products)
+        return [
+            p.replace(cost=catalog_costs[p['id']])
+            if p['id'] in catalog_costs and catalog_costs[p['id']] != p['cost'] else p
+            for p in state.products
+        ]
+    
+    def _priced_products(self, products: List[ProductRecord]) -> Tuple[List[ProductRecord], bool]:
+        """
+        Товары с текущими ценами из таблицы цен
         
-        print(f"Индекс создан для {len(self.products)} товаров")
+        Returns:
+            (новый список товаров, изменилась ли хоть одна цена)
+        """
+        costs = self.prices.costs_for([p['id'] for p in products])
+        changed = False
+        priced = []
+        for product in products:
+            cost = costs.get(product['id'])
+            if cost is not None and cost != product['cost']:
+                product = product.replace(cost=cost)
+                changed = True
+            priced.append(product)
+        return priced, changed
+        
+    def _publish_prices(self, state: _IndexState, **changes):
+        """Публикует состояние с текущими ценами товаров (products.pkl — если они изменились)"""
+        products, changed = self._priced_products(state.products)
+        if changed:
+            self._save_products(products)
+        self._publish(replace(state, products=products, **changes))
+    
+    def update_index(self, products_df: pd.DataFrame) -> CatalogDiff:
+        """
+        Инкрементально обновляет индекс под новую версию каталога
+        
+        Сравнивает товары в индексе с новым каталогом (см. catalog_diff):
+        - изменения цен записываются только в prices.npz, без эмбеддингов,
+          без перезаписи файлов индекса и без смены его версии;
+        - в энкодер отправляются только новые и переименованные товары,
+          эмбеддинги остальных берутся из embeddings.npy.
+        
+        Новый FAISS индекс и список товаров собираются отдельно от текущих и
+        публикуются вместе (см. _publish): параллельный поиск видит либо
+        старую, либо новую версию целиком.
+        
+        Если индекс собран со схлопыванием вариантов, эмбеддинги не
+        сохранены или ID товаров индекса расходятся с ID каталога (индекс
+        построен по старой нумерации), выполняется полная пересборка.
+        
+        Args:
+            products_df: DataFrame с новой версией каталога
+            
+        Returns:
+            CatalogDiff с классификацией изменений
+        """
+        with self._write_lock:
+            if self._state.index is None:
+                self.load_index()
+            state = self._loaded_state()
+        
+            # Сравниваются цены каталога: цены из прайс-листов не считаются изменениями
+            products = self._catalog_products(state)
+            new_products = ProductRecord.from_frame(products_df)
+            diff = diff_catalogs(products, new_products)
+            print(f"Изменения каталога: {diff.summary()}")
+        
+            # diff сопоставляет товары по названиям: ID в индексе должны совпадать с каталогом
+            catalog_ids = dict(zip(products_df['name'].tolist(), products_df['id'].tolist()))
+            ids_match = all(catalog_ids.get(p['name'], p['id']) == p['id'] for p in products)
+            fingerprint = catalog_fingerprint(products_df)
+        
+            if not ids_match or (
+                not diff.is_empty
+                and (state.variant_groups or self.collapse_duplicates or state.embeddings is None)
+            ):
+                print("Инкрементальное обновление невозможно, полная пересборка индекса...")
+                self.build_index(products_df, force_rebuild=True)
+                return diff
+        
+            # Цены: обновляется только таблица цен
+            if diff.price_changed:
+                repriced = {id(old): new for old, new in diff.price_changed}
+                products = [repriced.get(id(p), p) for p in products]
+                self.prices.apply({new['id']: (new['cost'], None) for _, new in diff.price_changed})
+        
+            if not (diff.added or diff.removed or diff.renamed):
+                if fingerprint != state.catalog_fingerprint:
+                    state = replace(
+                        state, catalog_fingerprint=fingerprint, version=state.version or uuid.uuid4().hex
+                    )
+                    self._write_manifest(state)
+                self._publish_prices(state)
+                return diff
+        
+            # Эмбеддинги только для новых и переименованных товаров
+            to_encode = diff.needs_encoding
+            self._load_model()
+            new_embeddings = self.model.encode(
+                [self.create_search_text(p) for p in to_encode],
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                device=self.device
+            )
+            encoded = {id(p): emb for p, emb in zip(to_encode, new_embeddings)}
+        
+            removed = {id(p) for p in diff.removed}
+            renamed = {id(old): new for old, new in diff.renamed}
+        
+            kept = []
+            rows = []
+            for pos, product in enumerate(products):
+                if id(product) in removed:
+                    continue
+                if id(product) in renamed:
+                    new = renamed[id(product)]
+                    kept.append(new)
+                    rows.append(encoded[id(new)])
+                else:
+                    kept.append(product)
+                    rows.append(state.embeddings[pos])
+            for product in diff.added:
+                kept.append(product)
+                rows.append(encoded[id(product)])
+        
+            import faiss
+        
+            embeddings = np.vstack(rows).astype(np.float32)
+            index = faiss.IndexFlatIP(embeddings.shape[1])
+            index.add(embeddings)
+        
+            self._save_index(_IndexState.create(index, kept, embeddings, {}, fingerprint), keep_prices=True)
+            print(f"Индекс обновлен: закодировано {len(to_encode)} из {self.product_count()} товаров")
+            return diff
     
     def load_index(self):
         """Загружает существующий индекс"""
         import faiss
         
-        index_path = self.index_dir / "faiss.index"
-        products_path = self.index_dir / "products.pkl"
-        embeddings_path = self.index_dir / "embeddings.npy"
+        with self._write_lock:
+            index_path = self.index_dir / "faiss.index"
+            embeddings_path = self.index_dir / "embeddings.npy"
+            groups_path = self.index_dir / "groups.pkl"
+        
+            if not index_path.exists():
+                raise FileNotFoundError(f"Индекс не найден в {index_path}")
+        
+            index = faiss.read_index(str(index_path))
+            products = self._read_products()
+            embeddings = np.load(embeddings_path) if embeddings_path.exists() else None
+        
+            variant_groups = {}
+            if groups_path.exists():
+                with open(groups_path, 'rb') as f:
+                    variant_groups = {
+                        rep_id: [ProductRecord.from_mapping(v) for v in variants]
+                        for rep_id, variants in pickle.load(f).items()
+                    }
+        
+            manifest = self._read_manifest()
+            if manifest:
+                version = manifest['version']
+            else:
+                # Индекс, созданный до появления манифеста
+                stat = index_path.stat()
+                version = f"legacy-{stat.st_size}-{stat.st_mtime_ns}"
+            state = _IndexState.create(
+                index, products, embeddings, variant_groups,
+                manifest.get('catalog_fingerprint') if manifest else None, version
+            )
+        
+            # Индексы без prices.npz: цены берутся из products.pkl
+            if not self.prices.load():
+                self.prices.rebuild(self._catalog_products(state))
+                
+            self._publish(state)
+            print(f"Индекс загружен: {self.product_count()} товаров")
+    
+    def _write_manifest(self, state: _IndexState):
+        """Атомарно записывает manifest.json с версией индекса"""
+        manifest = {
+            "version": state.version,
+            "model_name": self.model_name,
+            "num_products": len(state.product_ids),
+            "catalog_fingerprint": state.catalog_fingerprint,
+            "collapse_duplicates": bool(state.variant_groups),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        manifest_path = self.index_dir / "manifest.json"
+        tmp_path = manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+    
+    def _read_manifest(self) -> Optional[Dict]:
+        """Читает manifest.json (None если его нет)"""
+        manifest_path = self.index_dir / "manifest.json"
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _fingerprint_matches(self, catalog, fingerprint: Optional[str]) -> bool:
+        """Совпадает ли отпечаток каталога с отпечатком индекса (предупреждает один раз)"""
+        current = catalog.catalog_fingerprint()
+        matches = current is not None and current == fingerprint
+        if not matches and not self._catalog_mismatch_reported:
+            self._catalog_mismatch_reported = True
+            print("⚠️ Индекс построен по другой версии каталога: строки каталога "
+                  "не подставляются, пересоберите индекс (/rebuild-db)")
+        return matches
+    
+    def matches_catalog(self, catalog) -> bool:
+        """
+        Построен ли индекс по той же нумерации товаров, что и каталог
+        
+        Args:
+            catalog: источник строк каталога с методом catalog_fingerprint
+                (DataLoader)
+        """
+        return self._fingerprint_matches(catalog, self._state.catalog_fingerprint)
+    
+    def replace_from_catalog(
+        self,
+        results: List[Tuple[ProductRecord, float]],
+        catalog
+    ) -> List[Tuple[ProductRecord, float]]:
+        """
+        Заменяет товары из индекса строками каталога с теми же ID
         
-        if not index_path.exists():
-            raise FileNotFoundError(f"Индекс не найден в {index_path}")
+        Замена выполняется только если отпечаток каталога совпадает с
+        отпечатком индекса, и только для строк с тем же названием; остальные
+        товары остаются как в индексе. Цены берутся из таблицы цен.
+        
+        Args:
+            results: List кортежей (товар, релевантность)
+            catalog: источник строк каталога (get_products_by_ids, catalog_fingerprint)
+        """
+        if results and self.matches_catalog(catalog):
+            rows = {p['id']: p for p in catalog.get_products_by_ids([p['id'] for p, _ in results])}
+            results = [
+                (rows[product['id']], score)
+                if product['id'] in rows and rows[product['id']]['name'] == product['name']
+                else (product, score)
+                for product, score in results
+            ]
+        return self.with_current_prices(results)
+    
+    def _results_from_ids(self, cached: List[Tuple[int, float]]) -> List[Tuple[Dict, float]]:
+        """
+        Восстанавливает результаты поиска по парам (id, score)
         
-        self.index = faiss.read_index(str(index_path))
+        ID товаров стабильны между версиями индекса, поэтому пары,
+        полученные на предыдущей версии, восстанавливаются по текущей.
+        """
+        if self.catalog is not None and self.matches_catalog(self.catalog):
+            # Та же версия каталога: ID и названия совпадают с индексом
+            rows = {p['id']: p for p in self.catalog.get_products_by_ids([pid for pid, _ in cached])}
+            return self.with_current_prices(
+                [(rows[pid], score) for pid, score in cached if pid in rows]
+            )
         
-        with open(products_path, 'rb') as f:
-            self.products = pickle.load(f)
+        state = self._loaded_state()
+        results = []
+        for product_id, score in cached:
+            pos = state.id_to_pos.get(product_id)
+            if pos is not None:
+                results.append((state.products[pos], score))
+        return self.with_current_prices(results)
+    
+    def with_current_prices(
+        self,
+        results: List[Tuple[ProductRecord, float]]
+    ) -> List[Tuple[ProductRecord, float]]:
+        """
+        Подставляет в результаты актуальные цены из таблицы цен
         
-        if embeddings_path.exists():
-            self.product_embeddings = np.load(embeddings_path)
+        Новая запись создается только для товаров, чья цена изменилась.
+        Все цены берутся из одной версии таблицы, даже если параллельно
+        применяется прайс-лист.
         
-        print(f"Индекс загружен: {len(self.products)} товаров")
+        Args:
+            results: List кортежей (товар, релевантность)
+        """
+        if not results:
+            return results
+        
+        costs = self.prices.costs_for([product['id'] for product, _ in results])
+        priced = []
+        for product, score in results:
+            cost = costs.get(product['id'])
+            if cost is not None and cost != product['cost']:
+                product = ProductRecord.from_mapping(product).replace(cost=cost)
+            priced.append((product, score))
+        return priced
+    
+    def apply_price_sheet(self, filepath: str) -> Dict[str, int]:
+        """
+        Применяет прайс-лист с новыми ценами/остатками без пересборки индекса
+        
+        Переписываются prices.npz, price_overrides.json (цены прайс-листа
+        применяются заново после /rebuild-db) и цены в products.pkl; FAISS
+        индекс, эмбеддинги и кэш результатов поиска (хранит только ID)
+        остаются как есть.
+        
+        Args:
+            filepath: CSV с колонками id или Товар/Название и Цена (и необязательно Остаток)
+            
+        Returns:
+            Dict со счетчиками updated / unknown
+        """
+        with self._write_lock:
+            if self._state.index is None:
+                self.load_index()
+            state = self._loaded_state()
+        
+            catalog = self._catalog_products(state)
+            name_to_id = {product['name']: product['id'] for product in catalog}
+            updates, unmatched = read_price_sheet(filepath, name_to_id)
+            result = self.prices.apply(updates, base_costs={p['id']: p['cost'] for p in catalog})
+            result["unknown"] += len(unmatched)
+            self._publish_prices(state)
+            return result
     
     def search(
-        self, 
-        query: str, 
+        self,
+        query: str,
         top_k: int = 10,
-        score_threshold: float = 0.0
+        score_threshold: float = 0.0,
+        expand_variants: bool = False
     ) -> List[Tuple[Dict, float]]:
         """
         Выполняет поиск по запросу
@@ -180,6 +703,8 @@ class VectorSearchEngine:
             query: поисковый запрос
             top_k: количество результатов
             score_threshold: минимальный порог релевантности (0-1)
+            expand_variants: добавить варианты схлопнутых товаров сразу после
+                представителя (с той же релевантностью)
             
         Returns:
             List кортежей (товар, релевантность)
@@ -188,9 +713,19 @@ class VectorSearchEngine:
         if self.model is None:
             self._load_model()
         
-        if self.index is None:
+        # Одна версия индекса на весь поиск: позиции FAISS → ID того же состояния
+        state = self._state
+        if state.index is None:
             raise ValueError("Индекс не создан. Вызовите build_index() или load_index()")
         
+        # Проверяем кэш результатов (запись валидна только для текущей версии индекса)
+        cache_key = None
+        if self.result_cache is not None and state.version:
+            cache_key = SearchResultCache.make_key(query, top_k, score_threshold)
+            cached = self.result_cache.get(cache_key, state.version)
+            if cached is not None:
+                return self._expand_variants(self._results_from_ids(cached), expand_variants, state)
+        
         # Создаем эмбеддинг запроса
         query_embedding = self.model.encode(
             [query],
@@ -200,16 +735,47 @@ class VectorSearchEngine:
         )
         
         # Поиск в FAISS
-        scores, indices = self.index.search(query_embedding, top_k)
+        scores, indices = state.index.search(query_embedding, top_k)
         
-        # Формируем результаты
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.products) and score >= score_threshold:
-                product = self.products[idx]
-                results.append((product, float(score)))
+        # Формируем результаты (id, score), строки товаров подтягиваются по ID
+        hits = [
+            (int(state.product_ids[idx]), float(score))
+            for score, idx in zip(scores[0], indices[0])
+            if 0 <= idx < len(state.product_ids) and score >= score_threshold
+        ]
         
-        return results
+        if cache_key is not None:
+            self.result_cache.put(cache_key, state.version, hits)
+        
+        return self._expand_variants(self._results_from_ids(hits), expand_variants, state)
+    
+    def _expand_variants(
+        self,
+        results: List[Tuple[Dict, float]],
+        expand_variants: bool,
+        state: _IndexState
+    ) -> List[Tuple[Dict, float]]:
+        """Добавляет варианты схлопнутых товаров после их представителей"""
+        if not expand_variants or not state.variant_groups:
+            return results
+        
+        expanded = []
+        for product, score in results:
+            expanded.append((product, score))
+            expanded.extend((variant, score) for variant in state.variant_groups.get(product['id'], []))
+        return expanded
+    
+    def get_variants(self, product_id: int) -> List[Dict]:
+        """
+        Возвращает варианты товара, схлопнутые под ним при построении индекса
+        
+        Args:
+            product_id: ID товара-представителя
+            
+        Returns:
+            List вариантов (без самого представителя)
+        """
+        return self._state.variant_groups.get(product_id, [])
     
     def search_by_category(
         self,
@@ -228,17 +794,34 @@ class VectorSearchEngine:
         Returns:
             List кортежей (товар, релевантность)
         """
+        version = self._state.version
+        cache_key = None
+        if self.result_cache is not None and version:
+            cache_key = SearchResultCache.make_key(
+                query, top_k, 0.0, filters=(('category', category.lower()),)
+            )
+            cached = self.result_cache.get(cache_key, version)
+            if cached is not None:
+                return self._results_from_ids(cached)
+        
         # Сначала получаем больше результатов
         all_results = self.search(query, top_k=top_k * 3)
         
         # Фильтруем по категории
         filtered = [
-            (product, score) 
-            for product, score in all_results 
+            (product, score)
+            for product, score in all_results
             if category.lower() in product.get('category', '').lower()
-        ]
+        ][:top_k]
+        
+        if cache_key is not None:
+            self.result_cache.put(
+                cache_key,
+                version,
+                [(product['id'], score) for product, score in filtered]
+            )
         
-        return filtered[:top_k]
+        return filtered
     
     def get_similar_products(
         self,
@@ -255,32 +838,30 @@ class VectorSearchEngine:
         Returns:
             List кортежей (товар, релевантность)
         """
-        if self.product_embeddings is None:
+        state = self._state
+        if state.embeddings is None:
             raise ValueError("Эмбеддинги не загружены")
         
         # Находим индекс товара
-        product_idx = next(
-            (i for i, p in enumerate(self.products) if p['id'] == product_id),
-            None
-        )
+        product_idx = state.id_to_pos.get(product_id)
         
         if product_idx is None:
             return []
         
         # Получаем эмбеддинг товара
-        product_embedding = self.product_embeddings[product_idx:product_idx+1]
+        product_embedding = state.embeddings[product_idx:product_idx+1]
         
         # Ищем похожие
-        scores, indices = self.index.search(product_embedding, top_k + 1)
+        scores, indices = state.index.search(product_embedding, top_k + 1)
         
         # Исключаем сам товар
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx != product_idx and idx < len(self.products):
-                product = self.products[idx]
-                results.append((product, float(score)))
+        hits = [
+            (int(state.product_ids[idx]), float(score))
+            for score, idx in zip(scores[0], indices[0])
+            if idx != product_idx and 0 <= idx < len(state.product_ids)
+        ]
         
-        return results[:top_k]
+        return self._results_from_ids(hits[:top_k])
 
 
 if __name__ == "__main__":
@@ -315,5 +896,5 @@ if __name__ == "__main__":
         
         for i, (product, score) in enumerate(results, 1):
             print(f"\n{i}. {product['name'][:80]}...")
-            print(f"   Цена: {product['price']} руб.")
+            print(f"   Цена: {product['cost']} руб.")
             print(f"   Релевантность: {score:.3f}")
@@ -0,0 +1,250 @@
+"""
+Промпт LLM валидатора с бюджетом токенов
+
+Раньше в промпт валидации попадали все найденные товары, и при
+итеративном поиске (IterativeSearchValidator) промпт рос с каждой
+итерацией, а вместе с ним и время prefill. ValidationPromptBuilder перед
+генерацией:
+- убирает почти одинаковые кандидаты одной запрошенной позиции
+  (совпадающие после нормализации названия), оставляя кандидата с лучшим
+  score; один и тот же товар для разных позиций остается у каждой;
+- оставляет не больше candidates_per_item лучших кандидатов на каждую
+  запрошенную позицию (поле requested_item товара);
+- сокращает длинные названия;
+- считает токены всего промпта в chat template (системное сообщение,
+  разметка шаблона, инструкции и товары) и, если он не помещается в бюджет, убирает
+  кандидатов с наименьшим score; если не помещается и минимальный
+  промпт, генерация не выполняется (PromptBudgetExceeded).
+"""
+
+import re
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Бюджет токенов промпта валидации (системное сообщение + шаблон + инструкции + запрос + товары)
+DEFAULT_PROMPT_TOKEN_BUDGET = 2048
+
+# Лучших кандидатов на одну запрошенную позицию
+DEFAULT_CANDIDATES_PER_ITEM = 3
+
+# Максимальная длина названия товара в промпте, символов
+MAX_NAME_CHARS = 80
+
+# Порог похожести нормализованных названий для дубликатов (при совпадении чисел)
+DUPLICATE_SIMILARITY = 0.95
+
+# Оценка числа токенов без токенизатора (кириллица в BPE Qwen — ~2.5 символа на токен)
+CHARS_PER_TOKEN = 2.5
+
+# Оценка токенов разметки chat template (роли, служебные токены) без токенизатора
+CHAT_TEMPLATE_TOKENS = 16
+
+VALIDATION_QUERY_TEMPLATE = """ЗАПРОС ПОЛЬЗОВАТЕЛЯ:
+{query}
+
+НАЙДЕННЫЕ ТОВАРЫ:
+{items}
+
+JSON:"""
+
+
+class PromptBudgetExceeded(ValueError):
+    """Промпт не помещается в бюджет токенов даже после сокращения"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов текста (если токенизатор недоступен)"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def estimate_prompt_tokens(system: str, user: str) -> int:
+    """Грубая оценка токенов промпта в chat template (если токенизатор недоступен)"""
+    return estimate_tokens(system) + estimate_tokens(user) + CHAT_TEMPLATE_TOKENS
+
+
+def normalize_name(name: str) -> str:
+    """Название для сравнения дубликатов: регистр, пробелы, знаки размеров"""
+    name = name.lower().replace('ё', 'е')
+    name = re.sub(r'(?<=\d)\s*[xх×*]\s*(?=\d)', 'x', name)
+    name = re.sub(r'[^\w.x]+', ' ', name)
+    return ' '.join(name.split())
+
+
+def is_duplicate(a: str, b: str) -> bool:
+    """
+    Почти одинаковые нормализованные названия
+
+    Числа (размеры, сечения, артикулы) должны совпадать полностью: "200x200"
+    и "200x300" — разные товары, как бы ни были похожи остальные слова.
+    """
+    if a == b:
+        return True
+    if re.findall(r'\d+', a) != re.findall(r'\d+', b):
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= DUPLICATE_SIMILARITY
+
+
+def abbreviate_name(name: str, max_chars: int = MAX_NAME_CHARS) -> str:
+    """Сокращает название до max_chars символов по границе слова"""
+    name = ' '.join(str(name).split())
+    if len(name) <= max_chars:
+        return name
+    cut = name[:max_chars - 1].rsplit(' ', 1)[0] or name[:max_chars - 1]
+    return cut.rstrip(' ,;-') + '…'
+
+
+def candidate_score(item: Dict[str, Any]) -> float:
+    """Score кандидата: similarity (итеративный поиск) или score / relevance_score"""
+    for key in ('similarity', 'score', 'relevance_score'):
+        if item.get(key) is not None:
+            return float(item[key])
+    return 0.0
+
+
+def item_candidates(requested_item: str, search_results: List[Tuple[Any, float]]) -> List[Dict[str, Any]]:
+    """
+    Кандидаты для валидации из результатов поиска одной запрошенной позиции
+
+    requested_item проставляется там, где кандидаты собираются по позициям
+    разбора, чтобы отбор в промпт (select) ограничивал каждую позицию
+    отдельно и кандидаты одной позиции не вытесняли кандидатов другой.
+
+    Args:
+        requested_item: запрошенная позиция (название из разбора запроса)
+        search_results: (товар, score) из VectorSearchEngine.search
+
+    Returns:
+        List[Dict] с полями id, name, cost, similarity, requested_item
+    """
+    return [
+        {
+            'id': product['id'],
+            'name': product['name'],
+            'cost': product['cost'],
+            'similarity': float(score),
+            'requested_item': requested_item
+        }
+        for product, score in search_results
+    ]
+
+
+class ValidationPromptBuilder:
+    """
+    Собирает переменную часть промпта валидации в пределах бюджета токенов
+    """
+
+    def __init__(
+        self,
+        static_part: str,
+        system_prompt: str = "",
+        count_tokens: Optional[Callable[[str], int]] = None,
+        token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET,
+        candidates_per_item: int = DEFAULT_CANDIDATES_PER_ITEM,
+        max_name_chars: int = MAX_NAME_CHARS
+    ):
+        """
+        Args:
+            static_part: статическая часть промпта (инструкции), входит в бюджет
+            system_prompt: системное сообщение, входит в бюджет
+            count_tokens: число токенов промпта в chat template по сообщению
+                пользователя (с системным сообщением и разметкой шаблона);
+                по умолчанию estimate_prompt_tokens
+            token_budget: максимум токенов промпта
+            candidates_per_item: лучших кандидатов на одну запрошенную позицию
+            max_name_chars: максимальная длина названия товара
+        """
+        self.static_part = static_part
+        self.system_prompt = system_prompt
+        self.count_tokens = count_tokens or (lambda user: estimate_prompt_tokens(system_prompt, user))
+        self.token_budget = token_budget
+        self.candidates_per_item = candidates_per_item
+        self.max_name_chars = max_name_chars
+
+    def select(self, found_items: List[Dict[str, Any]]) -> List[int]:
+        """
+        Индексы кандидатов после удаления дубликатов и отбора лучших по позициям
+
+        Дубликаты ищутся внутри каждой запрошенной позиции: товар, найденный
+        для двух позиций, остается кандидатом обеих. Товары без
+        requested_item не ограничиваются по числу, только очищаются от
+        дубликатов между собой. Порядок — по убыванию score.
+        """
+        order = sorted(range(len(found_items)), key=lambda i: -candidate_score(found_items[i]))
+
+        kept: List[int] = []
+        kept_names: Dict[Optional[str], List[str]] = {}
+        for idx in order:
+            item = found_items[idx]
+            requested = item.get('requested_item')
+            names = kept_names.setdefault(requested, [])
+            name = normalize_name(item.get('name', ''))
+            # Дубликат уже взятого кандидата этой позиции (у того score не ниже)
+            if any(is_duplicate(name, other) for other in names):
+                continue
+            if requested is not None and len(names) >= self.candidates_per_item:
+                continue
+
+            kept.append(idx)
+            names.append(name)
+        return kept
+
+    def render(self, original_query: str, items: List[Dict[str, Any]]) -> str:
+        """Переменная часть промпта для выбранных товаров"""
+        items_text = "\n".join(
+            f"{i + 1}. {abbreviate_name(item.get('name', ''), self.max_name_chars)} - {item.get('cost', 'N/A')} руб."
+            for i, item in enumerate(items)
+        )
+        return VALIDATION_QUERY_TEMPLATE.format(query=original_query, items=items_text)
+
+    def build(self, original_query: str, found_items: List[Dict[str, Any]]) -> Tuple[str, List[int], int]:
+        """
+        Переменная часть промпта в пределах бюджета
+
+        Args:
+            original_query: запрос пользователя
+            found_items: найденные товары
+
+        Returns:
+            (переменная часть промпта, индексы товаров found_items в порядке
+            их номеров в промпте, число токенов промпта)
+
+        Raises:
+            PromptBudgetExceeded: не помещается даже один кандидат на позицию
+        """
+        kept = self.select(found_items)
+
+        while True:
+            variable_part = self.render(original_query, [found_items[i] for i in kept])
+            tokens = self.count_tokens(self.static_part + variable_part)
+            if tokens <= self.token_budget:
+                return variable_part, kept, tokens
+
+            victim = self._least_valuable(found_items, kept)
+            if victim is None:
+                raise PromptBudgetExceeded(
+                    f"Промпт валидации {tokens} токенов при бюджете {self.token_budget}"
+                )
+            kept.remove(victim)
+
+    @staticmethod
+    def _least_valuable(found_items: List[Dict[str, Any]], kept: List[int]) -> Optional[int]:
+        """
+        Кандидат с наименьшим score, без которого позиция не останется пустой
+
+        Возвращает None, если у каждой позиции остался один кандидат.
+        """
+        counts: Dict[str, int] = {}
+        for idx in kept:
+            requested = found_items[idx].get('requested_item')
+            if requested is not None:
+                counts[requested] = counts.get(requested, 0) + 1
+
+        def removable(idx: int) -> bool:
+            requested = found_items[idx].get('requested_item')
+            return len(kept) > 1 if requested is None else counts[requested] > 1
+
+        candidates = [idx for idx in kept if removable(idx)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: candidate_score(found_items[i]))
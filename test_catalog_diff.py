@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Тест сравнения версий каталога для инкрементальной переиндексации
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.catalog_diff import diff_catalogs, extract_article
+from src.product_record import ProductRecord
+
+
+def test_diff_classifies_changes():
+    """added / removed / renamed / price_changed / unchanged"""
+    old = [
+        ProductRecord("Гайка М6", 2.0, "Гайка", 1),
+        ProductRecord("Винт М6x20", 5.0, "Винт", 2),
+        ProductRecord("Короб 200x200 DKC арт. 35101", 1500.0, "Короб", 3),
+        ProductRecord("Шайба М6", 1.0, "Шайба", 4),
+    ]
+    new = [
+        ProductRecord("Гайка М6", 2.0, "Гайка", 1),
+        ProductRecord("Винт М6x20", 6.0, "Винт", 2),
+        ProductRecord("Короб 200х200 оцинкованный DKC арт. 35101", 1500.0, "Короб", 3),
+        ProductRecord("Лоток 100x50", 900.0, "Лоток", 5),
+    ]
+
+    diff = diff_catalogs(old, new)
+    print(f"  {diff.summary()}")
+    assert diff.summary() == {"added": 1, "removed": 1, "renamed": 1, "price_changed": 1, "unchanged": 1}
+    assert [p["name"] for p in diff.added] == ["Лоток 100x50"]
+    assert [p["name"] for p in diff.removed] == ["Шайба М6"]
+    assert diff.renamed[0][0]["id"] == 3
+    assert diff.price_changed[0][1]["cost"] == 6.0
+    # Энкодер нужен только новым и переименованным товарам
+    assert [p["id"] for p in diff.needs_encoding] == [5, 3]
+
+
+def test_normalized_name_match_is_rename():
+    """Регистр и пунктуация не делают товар новым, но текст эмбеддинга изменился"""
+    diff = diff_catalogs(
+        [ProductRecord("Гайка М6", 2.0, "Гайка", 1)],
+        [ProductRecord("гайка м6.", 2.0, "Гайка", 1)]
+    )
+    assert not diff.added and not diff.removed
+    assert len(diff.renamed) == 1
+
+
+def test_identical_catalogs_are_empty_diff():
+    products = [ProductRecord(f"Товар {i}", float(i), "Товар", i) for i in range(10)]
+    diff = diff_catalogs(products, list(products))
+    assert diff.is_empty
+    assert diff.unchanged == 10
+
+
+def test_extract_article():
+    assert extract_article("Короб DKC арт. 35101") == "35101"
+    assert extract_article("Лоток арт.см010610") == "СМ010610"
+    assert extract_article("Гайка М6") is None
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🔄 ТЕСТ СРАВНЕНИЯ КАТАЛОГОВ")
+    print("=" * 70)
+    test_diff_classifies_changes()
+    test_normalized_name_match_is_rename()
+    test_identical_catalogs_are_empty_diff()
+    test_extract_article()
+    print("\n✅ Все проверки сравнения каталогов пройдены")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Тест загрузки каталога: векторизованный разбор, многострочные CSV,
+снимок каталога и SQLite backend
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.catalog_snapshot import CatalogSnapshot
+from src.data_loader import DataLoader, iter_price_list_records
+
+
+ROOT = Path(__file__).parent
+
+
+def test_vectorized_parsers_match_scalar():
+    """parse_price_series / clean_product_name_series совпадают с построчными версиями"""
+    loader = DataLoader(use_snapshot=False)
+    prices = pd.Series([
+        "61263 руб.", "1 860 руб", "12,5", "руб.", "", None, np.nan, "abc 15.75 def", "7", 42.0
+    ], dtype=object)
+    expected = prices.apply(loader.parse_price)
+    actual = loader.parse_price_series(prices)
+    print(f"  цены: {actual.tolist()}")
+    assert actual.tolist() == expected.tolist()
+
+    integers = pd.Series([5, -5, 0])
+    assert loader.parse_price_series(integers).tolist() == integers.apply(loader.parse_price).tolist()
+
+    names = pd.Series(["Короб 200x200 - 1500 руб.", "  Гайка М6  ", None, "Винт - 5 руб"], dtype=object)
+    assert loader.clean_product_name_series(names).tolist() == names.apply(loader.clean_product_name).tolist()
+
+
+def test_multiline_price_list_records():
+    """Многострочные названия в кавычках, запятые в названиях и цена внутри ячейки"""
+    directory = Path(tempfile.mkdtemp())
+    try:
+        path = directory / "materials.csv"
+        path.write_text(
+            'Товар,Цена\n'
+            '"Короб 100x100 мм, L=3000 мм,\nDKC арт. 35101,61263 руб."\n'
+            '"Лоток, перфорированный",1860 руб.\n'
+            'Гайка М6, оцинкованная,5 руб.\n'
+            '\n'
+            ',\n',
+            encoding='utf-8-sig'
+        )
+        records = list(iter_price_list_records(path))
+        print(f"  записи: {records}")
+        assert records == [
+            ("Короб 100x100 мм, L=3000 мм, DKC арт. 35101", "61263 руб."),
+            ("Лоток, перфорированный", "1860 руб."),
+            ("Гайка М6, оцинкованная", "5 руб."),
+        ]
+
+        frame = DataLoader(use_snapshot=False).load_materials_csv(path)
+        assert frame['price'].tolist() == [61263.0, 1860.0, 5.0]
+        assert frame['category'].tolist() == [name.split()[0] for name in frame['name']]
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_shipped_materials_file_parses_full_names():
+    """materials_50_items.csv дает полные названия, без обрывков многострочных записей"""
+    frame = DataLoader(data_dir=str(ROOT), use_snapshot=False).load_materials_csv()
+    assert len(frame) <= 50
+    assert frame['name'].is_unique
+    assert not frame['name'].str.startswith("DKC").any()
+
+
+def test_snapshot_invalidated_by_source_change():
+    """Снимок устаревает при изменении содержимого источника, но не при смене mtime"""
+    directory = Path(tempfile.mkdtemp())
+    try:
+        source = directory / "catalog.csv"
+        source.write_text("Товар,Цена\nГайка М6,5 руб.\n", encoding='utf-8')
+        snapshot = CatalogSnapshot(directory / "cache")
+        df = pd.DataFrame({'name': ["Гайка М6"], 'cost': [5.0], 'category': ["Гайка"], 'id': [0]})
+
+        assert snapshot.load([source]) is None
+        snapshot.save(df, [source])
+        assert snapshot.is_fresh([source])
+        assert snapshot.load([source]).equals(df)
+
+        # Тот же текст с новым mtime: sha1 совпадает, снимок актуален
+        stat = source.stat()
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert snapshot.is_fresh([source])
+
+        # Тот же размер, другое содержимое
+        source.write_text("Товар,Цена\nГайка М8,5 руб.\n", encoding='utf-8')
+        assert not snapshot.is_fresh([source])
+        assert snapshot.load([source]) is None
+
+        # Другой набор источников
+        snapshot.save(df, [source])
+        assert not snapshot.is_fresh([source, source])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_sqlite_backend_matches_pandas():
+    """backend="sqlite" отдает те же товары, что и каталог в памяти"""
+    cache_dir = tempfile.mkdtemp()
+    try:
+        pandas_loader = DataLoader(data_dir=str(ROOT), cache_dir=cache_dir, use_snapshot=False)
+        sqlite_loader = DataLoader(data_dir=str(ROOT), cache_dir=cache_dir, backend="sqlite")
+
+        products = pandas_loader.get_products()
+        ids = products['id'].tolist()
+        assert sqlite_loader.count_products() == len(products)
+        assert sqlite_loader.get_products_by_ids(ids[::-1]) == pandas_loader.get_products_by_ids(ids[::-1])
+        assert sqlite_loader.get_product_by_id(ids[0]) == pandas_loader.get_product_by_id(ids[0])
+        assert sqlite_loader.get_product_by_id(-1) is None
+
+        category = products['category'].iloc[0]
+        assert (
+            sorted(p.id for p in sqlite_loader.search_by_category(category))
+            == sorted(p.id for p in pandas_loader.search_by_category(category))
+        )
+        assert sqlite_loader.catalog_fingerprint() == pandas_loader.catalog_fingerprint()
+        print(f"  товаров: {len(products)}, категория {category}")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("📦 ТЕСТ ЗАГРУЗКИ КАТАЛОГА")
+    print("=" * 70)
+    test_vectorized_parsers_match_scalar()
+    test_multiline_price_list_records()
+    test_shipped_materials_file_parses_full_names()
+    test_snapshot_invalidated_by_source_change()
+    test_sqlite_backend_matches_pandas()
+    print("\n✅ Все проверки загрузки каталога пройдены")
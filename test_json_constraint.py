@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Тест автомата constrained decoding по JSON схеме
+"""
+
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.json_constraint import JsonSchemaMatcher
+from src.llm_request_parser import REQUEST_SCHEMA
+
+
+def _complete(matcher, text):
+    state = matcher.advance(matcher.initial_state(), text.encode('utf-8'))
+    return state is not None and matcher.is_complete(state)
+
+
+def _prefix(matcher, text):
+    return matcher.advance(matcher.initial_state(), text.encode('utf-8')) is not None
+
+
+def _request(quantity="1", top_k="3"):
+    return '{"items": [{"name": "Гайка М6", "quantity": %s, "top_k": %s}]}' % (quantity, top_k)
+
+
+def test_request_schema_accepts_valid_answer():
+    matcher = JsonSchemaMatcher(REQUEST_SCHEMA)
+    answer = {
+        "items": [
+            {"name": "Короб 200x200", "quantity": 2, "specifications": "200x200 мм", "top_k": 3},
+            {"name": "Винт \"М6\"", "quantity": 100, "top_k": 5}
+        ],
+        "confidence": 0.85,
+        "analysis": "Короб и крепеж"
+    }
+    assert _complete(matcher, json.dumps(answer, ensure_ascii=False))
+    assert _complete(matcher, json.dumps(answer, ensure_ascii=False, indent=4))
+
+
+def test_structure_violations_rejected():
+    """Текст вокруг JSON, лишние и недостающие ключи, пустой список"""
+    matcher = JsonSchemaMatcher(REQUEST_SCHEMA)
+    assert not _prefix(matcher, "```json")
+    assert not _prefix(matcher, _request() + " ")
+    assert not _prefix(matcher, '{"price"')
+    assert not _complete(matcher, '{"items": [{"name": "Гайка", "top_k": 3}]}')
+    assert not _complete(matcher, '{"items": []}')
+    assert not _prefix(matcher, '{"items": [{"name": "' + "а" * 201)
+    assert _prefix(matcher, '{"items": [{"name": "' + "а" * 200 + '"')
+
+
+def test_integer_bounds_and_leading_zeros():
+    """top_k 1-10, quantity от 1; ведущие нули недопустимы"""
+    matcher = JsonSchemaMatcher(REQUEST_SCHEMA)
+    for quantity, top_k, ok in [
+        ("1", "3", True),
+        ("100", "10", True),
+        ("007", "3", False),
+        ("0", "3", False),
+        ("-1", "3", False),
+        ("1", "0", False),
+        ("1", "11", False),
+        ("1", "05", False),
+        ("1.5", "3", False),
+    ]:
+        print(f"  quantity={quantity}, top_k={top_k}: {ok}")
+        assert _complete(matcher, _request(quantity, top_k)) == ok
+
+    # Префикс отсекается сразу, как только в пределы уже не попасть
+    assert _prefix(matcher, '{"items": [{"name": "a", "top_k": 1')
+    assert not _prefix(matcher, '{"items": [{"name": "a", "top_k": 11')
+    assert not _prefix(matcher, '{"items": [{"name": "a", "top_k": -')
+
+
+def test_numbers_without_bounds():
+    # Число заканчивается следующим байтом, поэтому значения — в массиве
+    integer = JsonSchemaMatcher({"type": "array", "items": {"type": "integer"}})
+    assert _complete(integer, "[0, -12, -0]")
+    assert not _prefix(integer, "[01") and not _prefix(integer, "[-01")
+    assert not _prefix(integer, "[1.5")
+
+    number = JsonSchemaMatcher({"type": "array", "items": {"type": "number"}})
+    assert _complete(number, "[0.85, 12]")
+    assert not _prefix(number, "[00.5")
+    assert not _complete(number, "[1.]")
+
+
+def test_max_items():
+    matcher = JsonSchemaMatcher({"type": "array", "items": {"type": "integer"}, "minItems": 1, "maxItems": 2})
+    assert _complete(matcher, "[1,2]")
+    assert not _prefix(matcher, "[1,2,")
+    assert not _complete(matcher, "[]")
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🧩 ТЕСТ JSON CONSTRAINED DECODING")
+    print("=" * 70)
+    test_request_schema_accepts_valid_answer()
+    test_structure_violations_rejected()
+    test_integer_bounds_and_leading_zeros()
+    test_numbers_without_bounds()
+    test_max_items()
+    print("\n✅ Все проверки JSON схемы пройдены")
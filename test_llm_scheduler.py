@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика LLM: сбор батчей и дедлайны (без модели)
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.llm_scheduler import DeadlineExceeded, LLMScheduler, deadline_after
+
+
+class _Model:
+    """Заглушка модели: планировщик хранит на нее слабую ссылку"""
+
+
+def _scheduler(**options):
+    """Планировщик, который вместо генерации записывает батчи"""
+    model = _Model()
+    scheduler = LLMScheduler(model, tokenizer=None, **options)
+    scheduler.batches = []
+
+    def execute(batch):
+        scheduler.batches.append([request.text for request in batch])
+        return [request.text.upper() for request in batch]
+
+    scheduler._execute = execute
+    # Планировщик держит на модель слабую ссылку — модель живет вместе с ним
+    scheduler._test_model = model
+    return scheduler
+
+
+def test_concurrent_requests_share_batch():
+    """Запросы, пришедшие в окне max_wait, выполняются одним батчем по параметрам генерации"""
+    scheduler = _scheduler(max_batch_size=8, max_wait_ms=300)
+    try:
+        futures = [scheduler.submit(f"запрос {i}", max_new_tokens=16) for i in range(4)]
+        other = scheduler.submit("другие параметры", max_new_tokens=32)
+
+        assert [f.result(timeout=5) for f in futures] == [f"ЗАПРОС {i}" for i in range(4)]
+        assert other.result(timeout=5) == "ДРУГИЕ ПАРАМЕТРЫ"
+        print(f"  батчи: {scheduler.batches}")
+        assert sorted(len(batch) for batch in scheduler.batches) == [1, 4]
+        stats = scheduler.stats()
+        assert (stats["batches"], stats["requests"], stats["max_batch_size"]) == (2, 5, 4)
+    finally:
+        scheduler.close()
+
+
+def test_batch_size_limit():
+    scheduler = _scheduler(max_batch_size=2, max_wait_ms=300)
+    try:
+        futures = [scheduler.submit(f"запрос {i}") for i in range(5)]
+        assert [f.result(timeout=5) for f in futures] == [f"ЗАПРОС {i}" for i in range(5)]
+        assert all(len(batch) <= 2 for batch in scheduler.batches)
+    finally:
+        scheduler.close()
+
+
+def test_expired_request_not_executed():
+    """Запрос, дедлайн которого истек в очереди, не попадает в генерацию"""
+    scheduler = _scheduler(max_wait_ms=50)
+    try:
+        expired = scheduler.submit("просрочен", deadline=time.monotonic() - 1)
+        alive = scheduler.submit("вовремя", deadline=deadline_after(5))
+
+        assert alive.result(timeout=5) == "ВОВРЕМЯ"
+        try:
+            expired.result(timeout=5)
+        except DeadlineExceeded:
+            pass
+        else:
+            raise AssertionError("ожидался DeadlineExceeded")
+        assert all("просрочен" not in batch for batch in scheduler.batches)
+    finally:
+        scheduler.close()
+
+
+def test_generate_returns_at_deadline():
+    """generate() возвращает управление к дедлайну, даже если модель занята"""
+    scheduler = _scheduler(max_wait_ms=1)
+    release = threading.Event()
+    recorder = scheduler._execute
+
+    def slow_execute(batch):
+        release.wait(5)
+        return recorder(batch)
+
+    scheduler._execute = slow_execute
+    try:
+        busy = scheduler.submit("занимает модель")
+        start = time.monotonic()
+        try:
+            scheduler.generate("ждет в очереди", deadline=deadline_after(0.2))
+        except DeadlineExceeded:
+            pass
+        else:
+            raise AssertionError("ожидался DeadlineExceeded")
+        elapsed = time.monotonic() - start
+        print(f"  generate вернулся через {elapsed:.2f} с")
+        assert elapsed < 2
+
+        release.set()
+        assert busy.result(timeout=5) == "ЗАНИМАЕТ МОДЕЛЬ"
+    finally:
+        release.set()
+        scheduler.close()
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("⏱️ ТЕСТ ПЛАНИРОВЩИКА LLM")
+    print("=" * 70)
+    test_concurrent_requests_share_batch()
+    test_batch_size_limit()
+    test_expired_request_not_executed()
+    test_generate_returns_at_deadline()
+    print("\n✅ Все проверки планировщика пройдены")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Тест таблицы цен и остатков (prices.npz отдельно от индекса)
+"""
+
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.price_table import PriceTable, read_price_sheet
+from src.product_record import ProductRecord
+
+
+def _catalog(costs):
+    return [ProductRecord(f"Товар {pid}", cost, "Товар", pid) for pid, cost in costs.items()]
+
+
+def test_apply_updates_prices_and_stock():
+    """apply меняет только указанные поля и считает неизвестные ID"""
+    directory = Path(tempfile.mkdtemp())
+    try:
+        table = PriceTable(directory / "prices.npz")
+        table.rebuild(_catalog({3: 30.0, 1: 10.0, 2: 20.0}))
+        assert len(table) == 3
+        assert table.get(1) == (10.0, None)
+
+        result = table.apply({1: (15.0, 7.0), 2: (None, 3.0), 99: (1.0, None)})
+        print(f"  apply: {result}")
+        assert result == {"updated": 2, "unknown": 1}
+        assert table.get(1) == (15.0, 7.0)
+        assert table.get(2) == (20.0, 3.0)
+        assert table.get(99) is None
+        assert table.costs_for([3, 1, 99]) == {3: 30.0, 1: 15.0}
+
+        # Другой процесс видит новую таблицу после перечитывания файла
+        other = PriceTable(directory / "prices.npz")
+        assert other.load()
+        assert other.costs_for([1, 2, 3]) == {1: 15.0, 2: 20.0, 3: 30.0}
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_published_arrays_are_read_only():
+    """Читатели получают неизменяемую версию: apply подменяет массивы, а не правит их"""
+    directory = Path(tempfile.mkdtemp())
+    try:
+        table = PriceTable(directory / "prices.npz")
+        table.rebuild(_catalog({1: 10.0, 2: 20.0}))
+        before = table._arrays
+        assert not any(array.flags.writeable for array in before)
+
+        table.apply({1: (11.0, None)})
+        assert before[1].tolist() == [10.0, 20.0]
+        assert table._arrays[1].tolist() == [11.0, 20.0]
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_sheet_prices_survive_rebuild_until_catalog_changes():
+    """Цена прайс-листа переживает пересборку, пока не изменится цена каталога"""
+    directory = Path(tempfile.mkdtemp())
+    try:
+        table = PriceTable(directory / "prices.npz")
+        catalog = {1: 10.0, 2: 20.0}
+        table.rebuild(_catalog(catalog))
+        table.apply({1: (15.0, 4.0), 2: (25.0, None)}, base_costs=catalog)
+
+        table.rebuild(_catalog(catalog))
+        assert table.get(1) == (15.0, 4.0)
+        assert table.get(2) == (25.0, None)
+
+        # Каталог поменял цену товара 2: цена прайс-листа отбрасывается, остаток 1 остается
+        table.rebuild(_catalog({1: 10.0, 2: 22.0}))
+        assert table.get(1) == (15.0, 4.0)
+        assert table.get(2) == (22.0, None)
+        assert table.catalog_costs() == {1: 10.0}
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_read_price_sheet_by_name_and_id():
+    """Прайс-лист по названиям и по ID; пустая цена не меняет цену"""
+    directory = Path(tempfile.mkdtemp())
+    try:
+        by_name = directory / "by_name.csv"
+        by_name.write_text("Товар,Цена,Остаток\nТовар 1,1 500 руб.,3\nНеизвестный,10,\n", encoding='utf-8')
+        updates, unmatched = read_price_sheet(str(by_name), {"Товар 1": 1})
+        assert updates == {1: (1500.0, 3.0)}
+        assert unmatched == ["Неизвестный"]
+
+        by_id = directory / "by_id.csv"
+        by_id.write_text("id,Цена,Остаток\n1,,5\n2,30,\n", encoding='utf-8')
+        updates, unmatched = read_price_sheet(str(by_id), {})
+        assert updates == {1: (None, 5.0), 2: (30.0, None)}
+        assert unmatched == []
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("💰 ТЕСТ ТАБЛИЦЫ ЦЕН")
+    print("=" * 70)
+    test_apply_updates_prices_and_stock()
+    test_published_arrays_are_read_only()
+    test_sheet_prices_survive_rebuild_until_catalog_changes()
+    test_read_price_sheet_by_name_and_id()
+    print("\n✅ Все проверки таблицы цен пройдены")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Тест маршрутизации запросов: простые запросы без LLM, составные — в LLM
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.query_router import QueryRouter
+
+
+def test_simple_queries_take_fast_path():
+    """Один товар известного типа со спецификацией разбирается без LLM"""
+    router = QueryRouter()
+
+    for query, name, spec, top_k in [
+        ("Гайка М6", "Гайка М6", "М6", 5),
+        ("Короб 200x200", "Короб 200x200", "200x200", 3),
+        ("Гайка М8 100 шт", "Гайка М8", "М8", 5),
+    ]:
+        decision = router.route(query)
+        print(f"  {query}: use_llm={decision.use_llm}, confidence={decision.confidence}")
+        assert not decision.use_llm
+        assert decision.confidence >= router.threshold
+        item, = decision.parsed["items"]
+        assert item["name"] == name
+        assert item["specifications"] == spec
+        assert item["top_k"] == top_k
+
+    assert router.route("Гайка М8 100 шт").parsed["items"][0]["quantity"] == 100
+
+
+def test_compound_queries_go_to_llm():
+    """Несколько позиций в запросе разбирает LLM"""
+    router = QueryRouter()
+
+    for query in [
+        "Лоток перфорированный 200x50 с крышкой",
+        "Гайка М6 со шайбой",
+        "Гайка М6 + шайба",
+        "Гайка М6 и шайба М6",
+        "Короб 200x200 крышка",
+        "Гайка М6, винт М6",
+        "Комплект для монтажа лотка",
+    ]:
+        decision = router.route(query)
+        print(f"  {query}: use_llm={decision.use_llm}, {decision.reasons}")
+        assert decision.use_llm
+        assert decision.parsed is None
+
+
+def test_ambiguous_and_underspecified_queries_go_to_llm():
+    """Вопросы и запросы без спецификации разбирает LLM"""
+    router = QueryRouter()
+
+    for query in ["Короб", "Какой лоток нужен для кабеля?", "Лоток или короб 200x200"]:
+        decision = router.route(query)
+        print(f"  {query}: use_llm={decision.use_llm}, confidence={decision.confidence}")
+        assert decision.use_llm
+
+
+def test_hyphenated_product_type_is_single_item():
+    """Кабель-канал — один тип товара, а не кабель и канал"""
+    decision = QueryRouter().route("Кабель-канал 16x16")
+    assert not decision.use_llm
+    assert decision.parsed["items"][0]["name"] == "Кабель-канал 16x16"
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🧭 ТЕСТ МАРШРУТИЗАЦИИ ЗАПРОСОВ")
+    print("=" * 70)
+    test_simple_queries_take_fast_path()
+    test_compound_queries_go_to_llm()
+    test_ambiguous_and_underspecified_queries_go_to_llm()
+    test_hyphenated_product_type_is_single_item()
+    print("\n✅ Все проверки маршрутизации пройдены")
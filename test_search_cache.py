@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Тест кэша результатов поиска, привязанного к версии индекса
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.search_cache import SearchResultCache, normalize_query
+
+
+def test_entry_from_old_index_version_is_miss():
+    """Запись другой версии индекса — промах, и она удаляется"""
+    cache = SearchResultCache()
+    key = cache.make_key("Гайка М6", 5, 0.0)
+    cache.put(key, "v1", [(1, 0.9), (2, 0.8)])
+
+    assert cache.get(key, "v1") == [(1, 0.9), (2, 0.8)]
+    assert cache.get(key, "v2") is None
+    # Удалена: и старая версия больше не находится
+    assert cache.get(key, "v1") is None
+
+    stats = cache.stats()
+    print(f"  {stats}")
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 2, 0, 0)
+
+
+def test_key_normalization():
+    """Пробелы и NFKC формы не меняют ключ, регистр и параметры поиска — меняют"""
+    assert normalize_query("  Гайка   М6 ") == "Гайка М6"
+    make_key = SearchResultCache.make_key
+    assert make_key("Гайка  М6", 5, 0) == make_key("Гайка М6", 5, 0.0)
+    assert make_key("гайка м6", 5, 0) != make_key("Гайка М6", 5, 0)
+    assert make_key("Гайка М6", 5, 0) != make_key("Гайка М6", 3, 0)
+    assert make_key("Гайка М6", 5, 0, ("category", "Гайка")) != make_key("Гайка М6", 5, 0)
+
+
+def test_lru_eviction_by_entries():
+    """Вытесняется давно не использованная запись"""
+    cache = SearchResultCache(max_entries=2)
+    keys = [cache.make_key(f"запрос {i}", 5, 0.0) for i in range(3)]
+    cache.put(keys[0], "v", [(0, 1.0)])
+    cache.put(keys[1], "v", [(1, 1.0)])
+    assert cache.get(keys[0], "v") is not None
+    cache.put(keys[2], "v", [(2, 1.0)])
+
+    assert cache.get(keys[1], "v") is None
+    assert cache.get(keys[0], "v") == [(0, 1.0)]
+    assert cache.get(keys[2], "v") == [(2, 1.0)]
+
+
+def test_oversized_entry_not_cached():
+    cache = SearchResultCache(max_bytes=1024)
+    key = cache.make_key("запрос", 100, 0.0)
+    cache.put(key, "v", [(i, 0.5) for i in range(100)])
+    assert cache.get(key, "v") is None
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🗃️ ТЕСТ КЭША ПОИСКА")
+    print("=" * 70)
+    test_entry_from_old_index_version_is_miss()
+    test_key_normalization()
+    test_lru_eviction_by_entries()
+    test_oversized_entry_not_cached()
+    print("\n✅ Все проверки кэша поиска пройдены")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Тест промпта валидации: кандидаты по позициям и бюджет токенов
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from src.hybrid_processor import HybridQueryProcessor
+from src.product_record import ProductRecord
+from src.validation_prompt import PromptBudgetExceeded, ValidationPromptBuilder, item_candidates
+
+
+def _results(prefix, first_id, scores):
+    return [
+        (ProductRecord(f"{prefix} {i}", 100.0 + i, prefix, first_id + i), score)
+        for i, score in enumerate(scores)
+    ]
+
+
+class _SearchEngine:
+    """Поиск с заранее заданными результатами по запросу"""
+
+    def __init__(self, results):
+        self.results = results
+
+    def search(self, query, top_k=3):
+        return self.results[query][:top_k]
+
+
+def test_hybrid_candidates_carry_requested_item():
+    """Кандидаты помечаются позицией разбора там, где они найдены"""
+    engine = _SearchEngine({
+        "Короб 200x200": _results("Короб", 1, [0.9, 0.8, 0.7]),
+        "Гайка М6": _results("Гайка", 10, [0.4]),
+    })
+    processor = HybridQueryProcessor(engine, use_llm_parser=False, use_fallback_enhancement=False)
+    processor.router = None
+    response = processor.process_query("Короб 200x200")
+
+    candidates = processor.validation_items(response)
+    assert [c["requested_item"] for c in candidates] == ["Короб 200x200"] * 3
+    assert candidates[0] == {
+        "id": 1, "name": "Короб 0", "cost": 100.0, "similarity": 0.9, "requested_item": "Короб 200x200"
+    }
+
+
+def test_one_item_cannot_push_out_another():
+    """Много сильных кандидатов одной позиции не вытесняют единственного кандидата другой"""
+    found = (
+        item_candidates("Короб 200x200", _results("Короб", 1, [0.99, 0.98, 0.97, 0.96, 0.95, 0.94]))
+        + item_candidates("Гайка М6", _results("Гайка", 10, [0.2]))
+    )
+
+    builder = ValidationPromptBuilder("", count_tokens=lambda text: len(text), token_budget=10_000)
+    kept = builder.select(found)
+    requested = [found[i]["requested_item"] for i in kept]
+    print(f"  select: {requested}")
+    assert requested.count("Короб 200x200") == builder.candidates_per_item
+    assert requested.count("Гайка М6") == 1
+
+    # Бюджет на два кандидата: уходят слабые кандидаты короба, а не гайка
+    two = len(builder.render("Короб и гайка", [found[0], found[-1]]))
+    builder.token_budget = two
+    _, kept, tokens = builder.build("Короб и гайка", found)
+    print(f"  build: {[found[i]['name'] for i in kept]}, {tokens} токенов")
+    assert sorted(found[i]["requested_item"] for i in kept) == ["Гайка М6", "Короб 200x200"]
+
+    # Меньше одного кандидата на позицию не остается — генерации нет
+    builder.token_budget = two - 1
+    try:
+        builder.build("Короб и гайка", found)
+    except PromptBudgetExceeded:
+        pass
+    else:
+        raise AssertionError("ожидался PromptBudgetExceeded")
+
+
+def test_same_product_kept_for_each_item():
+    """Товар, найденный для двух позиций, остается кандидатом обеих"""
+    product = _results("Винт", 5, [0.8])
+    found = item_candidates("Винт М6", product) + item_candidates("Крепеж", product)
+    builder = ValidationPromptBuilder("", count_tokens=lambda text: len(text), token_budget=10_000)
+    assert len(builder.select(found)) == 2
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🧾 ТЕСТ ПРОМПТА ВАЛИДАЦИИ")
+    print("=" * 70)
+    test_hybrid_candidates_carry_requested_item()
+    test_one_item_cannot_push_out_another()
+    test_same_product_kept_for_each_item()
+    print("\n✅ Все проверки промпта валидации пройдены")